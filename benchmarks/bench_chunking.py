@@ -0,0 +1,92 @@
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from typing import Optional
+
+from ccbox import chunking
+from ccbox.chunking import Chunker
+from ccbox.content_store import ContentStore
+from ccbox.storage_handler import InMemoryStorageHandler
+from ccbox.virtual_drive import Virtual_Drive
+
+
+def timed(func):
+        started = time.perf_counter()
+        result = func()
+        return result, time.perf_counter() - started
+
+
+def edit(data: bytes, edits: int, seed: int = 0) -> bytes:
+        """Overwrite a few bytes at edits random offsets"""
+        rng = random.Random(seed)
+        edited = bytearray(data)
+        for _ in range(edits):
+                offset = rng.randrange(len(edited) - 16)
+                edited[offset:offset + 16] = rng.randbytes(16)
+        return bytes(edited)
+
+
+def chunking_rate(chunker: Chunker, data: bytes) -> float:
+        """MB/s for cutting data in memory"""
+        _, elapsed = timed(lambda: chunker.cut_points(data))
+        return len(data) / (1024 * 1024) / elapsed
+
+
+def resync_bytes(root: str, data: bytes, edited: bytes, chunker: Optional[Chunker], container_name: str) -> int:
+        """Bytes sent re-syncing a file after it was edited, with or without chunking"""
+        path = os.path.join(root, "data", "large.bin")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+                f.write(data)
+        Virtual_Drive.CHUNKER = chunker
+        virtual_drive = Virtual_Drive()
+        virtual_drive.add_remote(InMemoryStorageHandler(container_name))
+        virtual_drive.use_content_store()
+        virtual_drive.sync_directory(os.path.dirname(path))
+        with open(path, "wb") as f:
+                f.write(edited)
+        return virtual_drive.sync_directory(os.path.dirname(path)).bytes
+
+
+def run(args, size_mb: int) -> dict:
+        data = os.urandom(size_mb * 1024 * 1024)
+        chunker = Chunker(avg_size=args.avg_size)
+        sample = data[:args.python_limit * 1024 * 1024]
+        result = dict(size=size_mb, chunks=len(chunker.cut_points(data)),
+                      python=chunking_rate(Chunker(avg_size=args.avg_size, vectorized=False), sample),
+                      vectorized=chunking_rate(chunker, data) if chunking.np is not None else None)
+
+        edited = edit(data, args.edits)
+        root = tempfile.mkdtemp(prefix="ccbox-bench-")
+        default_chunker = Virtual_Drive.CHUNKER
+        try:
+                result["chunked"] = resync_bytes(root, data, edited, chunker, f"bench-chunked-{size_mb}")
+                result["whole"] = resync_bytes(root, data, edited, None, f"bench-whole-{size_mb}")
+        finally:
+                Virtual_Drive.CHUNKER = default_chunker
+                InMemoryStorageHandler.clear()
+                ContentStore.close_all()
+                shutil.rmtree(root, ignore_errors=True)
+        return result
+
+
+if __name__ == "__main__":
+        parser = argparse.ArgumentParser(description="Time content-defined chunking and compare the bytes re-sent "
+                                                     "for an edited large file with and without chunking")
+        parser.add_argument('--sizes', type=int, nargs='+', default=[64, 256], help='File sizes in MiB')
+        parser.add_argument('--edits', type=int, default=4, help='Scattered 16-byte edits made before re-syncing')
+        parser.add_argument('--avg-size', type=int, default=Chunker.DEFAULT_AVG_SIZE, help='Average chunk size (power of two)')
+        parser.add_argument('--python-limit', type=int, default=16,
+                            help='MiB chunked by the (slow) pure Python implementation')
+        args = parser.parse_args()
+
+        print(f"{'size (MiB)':>10} {'chunks':>7} {'python MB/s':>12} {'numpy MB/s':>11} "
+              f"{'resent chunked (MiB)':>21} {'resent whole (MiB)':>19}")
+        for size_mb in args.sizes:
+                result = run(args, size_mb)
+                vectorized = f"{result['vectorized']:>11.1f}" if result['vectorized'] is not None else f"{'n/a':>11}"
+                print(f"{size_mb:>10} {result['chunks']:>7} {result['python']:>12.1f} {vectorized} "
+                      f"{result['chunked'] / (1024 * 1024):>21.2f} {result['whole'] / (1024 * 1024):>19.2f}")
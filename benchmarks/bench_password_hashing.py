@@ -0,0 +1,47 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ccbox.password_hasher import PasswordHasher
+
+
+COST_SETTINGS = [
+        {"algorithm": "scrypt", "n": 2 ** 12, "r": 8, "p": 1},
+        {"algorithm": "scrypt", "n": 2 ** 14, "r": 8, "p": 1},
+        {"algorithm": "pbkdf2_sha256", "iterations": 100000},
+        {"algorithm": "pbkdf2_sha256", "iterations": 600000},
+]
+
+
+def logins_per_sec(hasher: PasswordHasher, logins: int, clients: int) -> float:
+        """Verify one credential from many client threads at once, as a busy server would"""
+        credentials = hasher.new_credentials("user", "password123")
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+                results = list(executor.map(lambda _: hasher.verify("password123", credentials), range(logins)))
+        elapsed = time.perf_counter() - started
+        assert all(results)
+        return logins / elapsed
+
+
+def describe(params: dict) -> str:
+        return " ".join(f"{key}={value}" for key, value in params.items())
+
+
+if __name__ == "__main__":
+        parser = argparse.ArgumentParser(description="Measure logins/sec for password hashing settings and pool sizes")
+        parser.add_argument('--logins', type=int, default=64, help='Logins per measurement')
+        parser.add_argument('--clients', type=int, default=16, help='Concurrent client threads')
+        parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4, 8],
+                            help='Process pool sizes to try (0 hashes inline in the client threads)')
+        args = parser.parse_args()
+
+        print(f"{'settings':<44} {'workers':>7} {'logins/s':>9}")
+        for params in COST_SETTINGS:
+                for workers in args.workers:
+                        hasher = PasswordHasher(params, workers=workers)
+                        try:
+                                rate = logins_per_sec(hasher, args.logins, args.clients)
+                        finally:
+                                hasher.shutdown()
+                        print(f"{describe(params):<44} {workers:>7} {rate:>9.1f}")
@@ -0,0 +1,63 @@
+import argparse
+import os
+import tempfile
+import time
+
+from ccbox.scanner import scan_tree
+
+
+def build_tree(root: str, files: int, files_per_dir: int = 500, fanout: int = 10) -> None:
+        """Create a synthetic tree of empty-ish files, files_per_dir per directory"""
+        directories = [root]
+        created = 0
+        index = 0
+        while created < files:
+                directory = directories[index]
+                index += 1
+                for i in range(fanout):
+                        sub = os.path.join(directory, f"d{i}")
+                        os.mkdir(sub)
+                        directories.append(sub)
+                for i in range(min(files_per_dir, files - created)):
+                        with open(os.path.join(directory, f"f{i}.txt"), "wb") as f:
+                                f.write(b"x" * (i % 64))
+                created += files_per_dir
+
+
+def legacy_walk(dir_path: str) -> int:
+        """The previous mount_directory walk: listdir, then isdir/isfile and a stat per entry"""
+        count = 0
+        for item in os.listdir(dir_path):
+                path = dir_path + "/" + item
+                if os.path.isdir(path):
+                        count += legacy_walk(path)
+                elif os.path.isfile(path):
+                        os.stat(path)
+                        count += 1
+        return count
+
+
+def timed(label: str, func) -> None:
+        started = time.perf_counter()
+        count = func()
+        elapsed = time.perf_counter() - started
+        print(f"{label:<24} {count:>8} files  {elapsed:8.3f}s  {count / elapsed:12.0f} files/s")
+
+
+if __name__ == "__main__":
+        parser = argparse.ArgumentParser(description="Compare the legacy listdir walker with scan_tree")
+        parser.add_argument('--files', type=int, default=100000, help='Number of files in the synthetic tree')
+        parser.add_argument('--workers', type=int, default=8, help='Thread pool size for the parallel scan')
+        parser.add_argument('--root', type=str, default=None, help='Scan an existing tree instead of building one')
+        args = parser.parse_args()
+
+        with tempfile.TemporaryDirectory() as tmp:
+                root = args.root
+                if root is None:
+                        root = os.path.join(tmp, "tree")
+                        os.mkdir(root)
+                        build_tree(root, args.files)
+
+                timed("legacy listdir walk", lambda: legacy_walk(root))
+                timed("scan_tree", lambda: scan_tree(root).file_count())
+                timed(f"scan_tree workers={args.workers}", lambda: scan_tree(root, args.workers).file_count())
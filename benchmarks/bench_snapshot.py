@@ -0,0 +1,50 @@
+import argparse
+import json
+import time
+
+from ccbox.virtual_drive import Virtual_Drive, FileEntry
+
+
+def build_drive(nodes: int, files_per_folder: int = 100, mounts: int = 1) -> Virtual_Drive:
+        """Build an in-memory drive with roughly the given number of folders + files, spread over mounts"""
+        virtual_drive = Virtual_Drive()
+        mnts = [virtual_drive.add_folder(f"mnt{k}") for k in range(mounts)]
+        created = 0
+        i = 0
+        while created < nodes:
+                mnt = mnts[i % mounts]
+                folder = mnt.add_folder(f"dir{i}")
+                for j in range(files_per_folder):
+                        name = f"file{j}.dat"
+                        folder.add_file(FileEntry(name, f"/data/{mnt._name}/dir{i}/{name}", j * 1024, 1700000000000000000 + j,
+                                                  None, f"{mnt._name}/dir{i}/{name}"))
+                created += files_per_folder + 1
+                i += 1
+        return virtual_drive
+
+
+def timed(func):
+        started = time.perf_counter()
+        result = func()
+        return result, time.perf_counter() - started
+
+
+if __name__ == "__main__":
+        parser = argparse.ArgumentParser(description="Compare JSON and binary drive snapshots")
+        parser.add_argument('--nodes', type=int, default=1000000, help='Approximate number of nodes in the drive')
+        parser.add_argument('--mounts', type=int, default=10, help='Number of top-level folders to spread the nodes over')
+        args = parser.parse_args()
+
+        virtual_drive = build_drive(args.nodes, mounts=args.mounts)
+
+        encoded_json, json_save = timed(lambda: json.dumps(virtual_drive.to_dict()).encode('utf-8'))
+        _, json_load = timed(lambda: Virtual_Drive.from_dict(json.loads(encoded_json)))
+        encoded_binary, binary_save = timed(virtual_drive.to_bytes)
+        _, binary_load = timed(lambda: Virtual_Drive.from_bytes(encoded_binary))
+        lazy_drive, lazy_open = timed(lambda: Virtual_Drive.from_bytes(encoded_binary, lazy=True))
+        _, lazy_first = timed(lambda: lazy_drive.folders["mnt0"].contents)
+
+        print(f"{'format':<8} {'size (MB)':>10} {'save (s)':>9} {'load (s)':>9}")
+        print(f"{'json':<8} {len(encoded_json) / 1e6:>10.2f} {json_save:>9.2f} {json_load:>9.2f}")
+        print(f"{'binary':<8} {len(encoded_binary) / 1e6:>10.2f} {binary_save:>9.2f} {binary_load:>9.2f}")
+        print(f"lazy binary: {lazy_open * 1000:.2f} ms to open, {lazy_first:.2f} s to load the first of {args.mounts} mounts")
@@ -0,0 +1,87 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from ccbox.storage_handler import StorageHandler, LocalFSStorageHandler, InMemoryStorageHandler
+from ccbox.virtual_drive import Virtual_Drive
+
+
+def build_tree(root: str, files: int, files_per_folder: int = 1000, file_size: int = 256) -> str:
+        """Write files small files under root/tree, files_per_folder to a folder"""
+        tree = os.path.join(root, "tree")
+        payload = os.urandom(file_size)
+        for i in range(files):
+                folder = os.path.join(tree, f"dir{i // files_per_folder}")
+                if i % files_per_folder == 0:
+                        os.makedirs(folder)
+                with open(os.path.join(folder, f"file{i}.dat"), "wb") as f:
+                        f.write(payload)
+        return tree
+
+
+def make_handler(args, root: str, files: int) -> StorageHandler:
+        container_name = f"bench-{files}"
+        if args.backend == "local":
+                return LocalFSStorageHandler(os.path.join(root, "blobs"), container_name, args.fsync_batch)
+        InMemoryStorageHandler.clear(container_name)
+        return InMemoryStorageHandler(container_name, args.latency, args.bandwidth)
+
+
+def timed(func):
+        started = time.perf_counter()
+        result = func()
+        return result, time.perf_counter() - started
+
+
+def run(args, files: int) -> dict:
+        root = tempfile.mkdtemp(prefix="ccbox-bench-")
+        try:
+                tree = build_tree(root, files, args.files_per_folder, args.file_size)
+                handler = make_handler(args, root, files)
+                virtual_drive = Virtual_Drive()
+                virtual_drive.add_remote(handler)
+
+                folder, mount = timed(lambda: virtual_drive.mount_directory(tree, args.scan_workers))
+                _, upload = timed(lambda: virtual_drive.upload_contents(args.workers, folders=[folder]))
+                _, resync = timed(lambda: virtual_drive.upload_contents(args.workers, folders=[folder]))
+                _, save = timed(virtual_drive.save_to_remote)
+                if isinstance(handler, LocalFSStorageHandler):
+                        handler.flush()
+
+                def load(lazy: bool) -> Virtual_Drive:
+                        loaded = Virtual_Drive(_id=virtual_drive._id, _from_dict=True)
+                        loaded.add_remote(handler)
+                        return loaded.load_from_remote(lazy=lazy)
+
+                _, load_eager = timed(lambda: load(False))
+                _, load_lazy = timed(lambda: load(True))
+                return dict(files=files, mount=mount, upload=upload, resync=resync, save=save,
+                            load=load_eager, load_lazy=load_lazy)
+        finally:
+                shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+        parser = argparse.ArgumentParser(description="Time mount, upload, save_to_remote and load_from_remote "
+                                                     "against a local or in-memory storage backend")
+        parser.add_argument('--files', type=int, nargs='+', default=[1000, 100000],
+                            help='Drive sizes to run, e.g. 1000 100000 1000000 (the tree is written to a temp dir first)')
+        parser.add_argument('--backend', choices=['memory', 'local'], default='memory')
+        parser.add_argument('--latency', type=float, default=0.0, help='Simulated seconds per request (memory backend)')
+        parser.add_argument('--bandwidth', type=float, help='Simulated bytes per second (memory backend)')
+        parser.add_argument('--fsync-batch', type=int, help='fsync every N blobs (local backend, default never)')
+        parser.add_argument('--file-size', type=int, default=256, help='Bytes per file')
+        parser.add_argument('--files-per-folder', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=16, help='Upload threads')
+        parser.add_argument('--scan-workers', type=int, default=0, help='Threads for scanning the tree')
+        args = parser.parse_args()
+
+        print(f"{'files':>9} {'mount (s)':>10} {'upload (s)':>11} {'files/s':>9} {'resync (s)':>11} "
+              f"{'save (s)':>9} {'load (s)':>9} {'lazy (ms)':>10}")
+        for files in args.files:
+                result = run(args, files)
+                print(f"{files:>9} {result['mount']:>10.2f} {result['upload']:>11.2f} {files / result['upload']:>9.0f} "
+                      f"{result['resync']:>11.2f} {result['save']:>9.2f} {result['load']:>9.2f} "
+                      f"{result['load_lazy'] * 1000:>10.2f}")
@@ -1,17 +1,25 @@
-import sys
-import threading
-import socketserver
+from typing import Union, List, Dict, Optional, Any, ClassVar, Tuple, Iterator, AsyncIterator
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
-from ccbox.virtual_drive import Virtual_Drive, Folder
+from itertools import chain
+import threading
+import asyncio
+import json
+from ccbox.virtual_drive import Virtual_Drive, Folder, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 from ccbox.user import User, UserDatabase
 from ccbox.authentication import Authentication
 from ccbox.storage_handler import AzureStorageHandler
 from ccbox.log import Logger
+from ccbox.protocol import FRAMES_COMMAND, FRAMES_ACK, encode_frame, encode_frames, read_frame
+from ccbox.jobs import mount_jobs
 
 
-class ApiRequestHandler(socketserver.StreamRequestHandler):
+class ApiCommands:
         """
-        The request handler for our API server.
+        The commands of the API server's line protocol. They block on storage,
+        SQLite and password hashing, so the server runs them on its executor.
+        Large responses are returned as iterators of strings, which the server
+        sends piece by piece as they are produced.
         """
 
         help_message = (
@@ -20,61 +28,51 @@ class ApiRequestHandler(socketserver.StreamRequestHandler):
                 "  -> about:\t Prints a short description\n\r"
                 "  -> register <username> <password>:\t Register a new user\n\r"
                 "  -> login <username> <password>:\t Log in a user\n\r"
-                "  -> mount <username> <dir_path>:\t Mount a directory to the virtual drive\n\r"
-                "  -> contents <username>:\t Get the contents of the virtual drive\n\r"
+                "  -> mount <username> <dir_path>:\t Start mounting a directory to the virtual drive\n\r"
+                "  -> job <job_id>:\t Show the progress of a mount job\n\r"
+                "  -> contents <username> [depth]:\t Get the contents of the virtual drive as JSON\n\r"
+                "  -> list <username> [path] [depth=N] [limit=N] [cursor=C]:\t List one folder a page at a time\n\r"
+                "  -> cache:\t Show user cache statistics\n\r"
+                "  -> frames:\t Switch this connection to the framed protocol (see ccbox.protocol)\n\r"
         )
 
-        def setup(self):
-                socketserver.StreamRequestHandler.setup(self)
-                self._logger = Logger()
-                self._logger.info("Client connected")
-
-        def handle(self):
-                client_info = "Client connected from %s\n\r" % self.client_address[0]
-                self.wfile.write(client_info.encode('utf-8'))
-                welcome_message = "Welcome to CCBox (%s). Type \"help\" for a list of all available commands.\n\r" % str(date.today())
-                self.wfile.write(welcome_message.encode('utf-8'))
+        def __init__(self, logger: Logger):
+                self._logger = logger
 
-                while True:
-                        try:
-                                command = self.rfile.readline().strip().decode('utf-8').lower()
-                                if command:
-                                        self.execute_command(command)
-                        except Exception as e:
-                                print(f"Error: {e}")
-
-        def execute_command(self, command):
+        def execute_command(self, command: str) -> Union[str, Iterator[str]]:
                 parts = command.split()
-                cmd = parts[0]
+                # Only the command word is case-insensitive: names and paths are passed as typed
+                cmd = parts[0].lower()
 
                 try:
-                        if cmd == 'quit':
-                                self.wfile.write("Closing connection. Hope to see you again!\n\r".encode('utf-8'))
-                                return
-                        elif cmd == 'exit':
-                                sys.exit(2)
-                        elif cmd == 'help':
-                                self.wfile.write(self.help_message.encode('utf-8'))
+                        if cmd == 'help':
+                                return self.help_message
                         elif cmd == 'register' and len(parts) == 3:
                                 username, password = parts[1], parts[2]
-                                response = self.register_user(username, password)
-                                self.wfile.write(response.encode('utf-8'))
+                                return self.register_user(username, password)
                         elif cmd == 'login' and len(parts) == 3:
                                 username, password = parts[1], parts[2]
-                                response = self.login_user(username, password)
-                                self.wfile.write(response.encode('utf-8'))
+                                return self.login_user(username, password)
                         elif cmd == 'mount' and len(parts) == 3:
                                 username, dir_path = parts[1], parts[2]
-                                response = self.mount_directory(username, dir_path)
-                                self.wfile.write(response.encode('utf-8'))
-                        elif cmd == 'contents' and len(parts) == 2:
+                                return self.mount_directory(username, dir_path)
+                        elif cmd == 'job' and len(parts) == 2:
+                                return self.mount_job(parts[1])
+                        elif cmd == 'contents' and len(parts) in (2, 3):
                                 username = parts[1]
-                                response = self.get_virtual_drive_contents(username)
-                                self.wfile.write(response.encode('utf-8'))
+                                if len(parts) == 3 and not parts[2].isdigit():
+                                        return "Invalid depth\n\r"
+                                depth = int(parts[2]) if len(parts) == 3 else None
+                                return self.get_virtual_drive_contents(username, depth)
+                        elif cmd == 'list' and len(parts) >= 2:
+                                return self.list_virtual_drive(parts[1], parts[2:])
+                        elif cmd == 'cache' and len(parts) == 1:
+                                return f"{Authentication.user_database.cache_stats().to_dict()}\n\r"
                         else:
-                                self.wfile.write("Invalid command\n\r".encode('utf-8'))
-                except ConnectionResetError:
-                        self._logger.error("Broken pipe: client disconnected while sending response")
+                                return "Invalid command\n\r"
+                except Exception as e:
+                        self._logger.error(f"Command {cmd} failed: {e}")
+                        return f"Error: {e}\n\r"
 
         def register_user(self, username, password):
                 if not username or not password:
@@ -97,56 +95,234 @@ class ApiRequestHandler(socketserver.StreamRequestHandler):
                         return "Incorrect username or password\n\r"
 
         def mount_directory(self, username, dir_path):
-                user = Authentication.user_database.get_user_from_db(username)
-                if not user:
+                job = mount_jobs.submit_mount(username, dir_path)
+                if not job:
                         return "User not found\n\r"
-                
-                print(user.username)
 
-                account_url = 'https://saccbox.blob.core.windows.net'
-                container_name = f'virtual-drive-{user.virtual_drive._id}'
-                azure_storage = AzureStorageHandler(account_url, container_name=container_name)
+                self._logger.info(f"Queued mount job {job.id} of {dir_path} for {username}")
+                return f"Mount started, job {job.id}\n\r"
 
-                user.virtual_drive.add_remote(azure_storage)
-                user.virtual_drive.mount_directory(dir_path)
-                user.virtual_drive.upload_contents()
+        def mount_job(self, job_id):
+                job = mount_jobs.get(job_id)
+                if not job:
+                        return "Job not found\n\r"
 
-                return "Directory mounted successfully\n\r"
+                return f"{job.to_dict()}\n\r"
 
-        def get_virtual_drive_contents(self, username):
+        def get_virtual_drive_contents(self, username, depth=None):
                 user = Authentication.user_database.get_user_from_db(username)
                 if not user:
                         return "User not found\n\r"
 
-                virtual_drive_contents = user.virtual_drive.to_dict()
-                return f"{virtual_drive_contents}\n\r"
+                return chain(user.virtual_drive.iter_json(depth), ["\n\r"])
 
-        def finish(self):
-                socketserver.StreamRequestHandler.finish(self)
-                self._logger.info("Client disconnected")
+        def list_virtual_drive(self, username, arguments):
+                user = Authentication.user_database.get_user_from_db(username)
+                if not user:
+                        return "User not found\n\r"
+
+                path, options = "", {}
+                for argument in arguments:
+                        key, sep, value = argument.partition("=")
+                        if sep and key in ('depth', 'limit', 'cursor'):
+                                options[key] = value
+                        else:
+                                path = argument
+                limit = min(max(int(options.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+                listing = user.virtual_drive.list_contents(path.strip("/"), int(options.get('depth', 1)),
+                                                           limit, options.get('cursor'))
+                if listing is None:
+                        return "Path not found\n\r"
+                return f"{json.dumps(listing)}\n\r"
 
 
-class ApiServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-    """
-    This class implements the API server.
-    """
+class ApiServer:
+        """
+        This class implements the API server.
+
+        Connections are served by a single asyncio event loop, so idle clients
+        cost a socket and a coroutine rather than an OS thread. Commands run on
+        a fixed-size thread pool; hashing is further offloaded to the password
+        hasher's process pool. A connection is closed on quit, exit or EOF.
+
+        After the "frames" command a connection speaks the framed protocol:
+        commands are read as they arrive and run concurrently, up to
+        MAX_PIPELINED per connection, and each response is sent as soon as it
+        is ready.
+        """
+        DEFAULT_WORKERS: ClassVar[int] = 16
+        # Longest command line (or command frame) accepted before the connection is dropped
+        MAX_LINE_LENGTH: ClassVar[int] = 64 * 1024
+        # Framed requests run at once per connection; reading pauses beyond that
+        MAX_PIPELINED: ClassVar[int] = 64
 
-    def __init__(self, host, port):
-        self._logger = Logger()
+        def __init__(self, host: str, port: int, workers: int = DEFAULT_WORKERS):
+                self._logger = Logger()
+                self.host = host
+                self.port = port
+                self.commands = ApiCommands(self._logger)
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ccbox-api")
+                self._server = None
+                self._writers = set()
+
+        async def start(self) -> asyncio.AbstractServer:
+                self._server = await asyncio.start_server(self.handle_client, self.host, self.port,
+                                                          limit=self.MAX_LINE_LENGTH)
+                # Port 0 picks a free port; report the one actually bound
+                self.port = self._server.sockets[0].getsockname()[1]
+                self._logger.info("API server listening on " + self.host + ", " + str(self.port))
+                return self._server
+
+        async def serve(self) -> None:
+                if self._server is None:
+                        await self.start()
+                await self._server.serve_forever()
+
+        def serve_forever(self) -> None:
+                try:
+                        asyncio.run(self.serve())
+                except KeyboardInterrupt:
+                        pass
+
+        async def close(self) -> None:
+                if self._server is not None:
+                        self._server.close()
+                        for writer in list(self._writers):
+                                writer.close()
+                        await self._server.wait_closed()
+                        self._server = None
+                self._executor.shutdown(wait=False)
+
+        async def iter_response(self, command: str) -> AsyncIterator[str]:
+                """The response to a command, a piece at a time; iterators are advanced on the executor"""
+                loop = asyncio.get_running_loop()
+                response = await loop.run_in_executor(self._executor, self.commands.execute_command, command)
+                if isinstance(response, str):
+                        yield response
+                        return
+                pieces = iter(response)
+                while (piece := await loop.run_in_executor(self._executor, next, pieces, None)) is not None:
+                        yield piece
+        async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+                self._writers.add(writer)
+                peer = writer.get_extra_info("peername")
+                self._logger.info("Client connected")
+                try:
+                        writer.write(("Client connected from %s\n\r" % (peer[0] if peer else "unknown")).encode('utf-8'))
+                        welcome_message = "Welcome to CCBox (%s). Type \"help\" for a list of all available commands.\n\r" % str(date.today())
+                        writer.write(welcome_message.encode('utf-8'))
+                        await writer.drain()
+
+                        while True:
+                                line = await reader.readline()
+                                if not line:
+                                        break
+                                command = line.strip().decode('utf-8', errors='replace')
+                                if not command:
+                                        continue
+                                if command.split()[0].lower() in ('quit', 'exit'):
+                                        writer.write("Closing connection. Hope to see you again!\n\r".encode('utf-8'))
+                                        await writer.drain()
+                                        break
+                                if command.lower() == FRAMES_COMMAND:
+                                        writer.write(FRAMES_ACK)
+                                        await writer.drain()
+                                        await self.serve_frames(reader, writer)
+                                        break
+                                try:
+                                        async for piece in self.iter_response(command):
+                                                writer.write(piece.encode('utf-8'))
+                                                await writer.drain()
+                                except (ConnectionResetError, BrokenPipeError):
+                                        raise
+                                except Exception as e:
+                                        self._logger.error(f"Command {command.split()[0]} failed: {e}")
+                                        writer.write(f"Error: {e}\n\r".encode('utf-8'))
+                                        await writer.drain()
+                except (ConnectionResetError, BrokenPipeError):
+                        self._logger.error("Broken pipe: client disconnected while sending response")
+                except ValueError:
+                        self._logger.error("Client sent a line or frame longer than %d bytes" % self.MAX_LINE_LENGTH)
+                except asyncio.IncompleteReadError:
+                        self._logger.error("Client disconnected mid-frame")
+                finally:
+                        self._writers.discard(writer)
+                        writer.close()
+                        try:
+                                await writer.wait_closed()
+                        except (ConnectionResetError, BrokenPipeError):
+                                pass
+                        self._logger.info("Client disconnected")
+
+        async def serve_frames(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+                in_flight = asyncio.Semaphore(self.MAX_PIPELINED)
+                tasks = set()
+
+                async def send(frames: Iterator[bytes]) -> None:
+                        for frame in frames:
+                                writer.write(frame)
+                                await writer.drain()
+
+                async def answer(request_id: int, command: str) -> None:
+                        try:
+                                # Each piece is sent once the next shows it is not the last
+                                previous = None
+                                try:
+                                        if command:
+                                                async for piece in self.iter_response(command):
+                                                        if previous is not None:
+                                                                await send(encode_frames(request_id, previous, more=True))
+                                                        previous = piece
+                                        else:
+                                                previous = "Invalid command"
+                                        await send(encode_frames(request_id, (previous or "").rstrip("\n\r")))
+                                except (ConnectionResetError, BrokenPipeError):
+                                        raise
+                                except Exception as e:
+                                        # The client waits for the last frame of every request, so failures end with one too
+                                        self._logger.error(f"Framed request {request_id} failed: {e}")
+                                        if previous is not None:
+                                                await send(encode_frames(request_id, previous, more=True))
+                                        await send(encode_frames(request_id, f"Error: {e}"))
+                        finally:
+                                in_flight.release()
+
+                try:
+                        while True:
+                                frame = await read_frame(reader, self.MAX_LINE_LENGTH)
+                                if frame is None:
+                                        break
+                                request_id, payload = frame
+                                command = payload.decode('utf-8', errors='replace').strip()
+                                if command.lower().split()[:1] in (['quit'], ['exit']):
+                                        # Answer everything already received before saying goodbye
+                                        await asyncio.gather(*tasks, return_exceptions=True)
+                                        writer.write(encode_frame(request_id, "Closing connection. Hope to see you again!"))
+                                        await writer.drain()
+                                        break
+                                await in_flight.acquire()
+                                task = asyncio.create_task(answer(request_id, command))
+                                tasks.add(task)
+                                task.add_done_callback(tasks.discard)
+                finally:
+                        await asyncio.gather(*tasks, return_exceptions=True)
 
-        self.server_address = (host, port)
-        socketserver.TCPServer.__init__(self, self.server_address, ApiRequestHandler)
+        def start_in_thread(self) -> threading.Thread:
+                """Serve on a background daemon thread, e.g. next to the web server"""
+                started = threading.Event()
 
-        # Start a thread with the server -- that thread will start one
-        # more thread for each request
-        server_thread = threading.Thread(target=self.serve_forever)
-        # Exit the server thread when the main thread terminates
-        server_thread.daemon = True
-        server_thread.start()
+                async def serve():
+                        await self.start()
+                        started.set()
+                        await self.serve()
 
-        self._logger.info("API server listening on " + host + ", " + str(port))
+                thread = threading.Thread(target=asyncio.run, args=(serve(),), name="ccbox-api-server", daemon=True)
+                thread.start()
+                started.wait()
+                return thread
 
 
 if __name__ == '__main__':
+        # Mount jobs left unfinished are resumed by the web server (TornadoServer.start_server), not here
         api_server = ApiServer('localhost', 9999)
         api_server.serve_forever()
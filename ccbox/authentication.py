@@ -1,15 +1,28 @@
-from typing import Union, List, Dict, Optional, Any, ClassVar
+from typing import Union, List, Dict, Optional, Any, ClassVar, Iterable, Tuple
 from dataclasses import dataclass, field, asdict
+from itertools import count, islice
 import secrets
 import string
 import hashlib
-from itertools import count
+import time
 import json
 
 from ccbox.virtual_drive import Virtual_Drive
-from ccbox.user import User, UserDatabase
+from ccbox.user import User, UserDatabase, UserRecord, Credentials
+from ccbox.password_hasher import PasswordHasher
 
 
+@dataclass
+class BulkRegistration:
+        """Outcome of a bulk registration run"""
+        created: int = 0
+        existing: int = 0
+        invalid: int = 0
+        elapsed: float = 0.0
+
+        def to_dict(self) -> dict:
+                return asdict(self)
+
 
 class Authentication:
         USER_DETAILS_FILEPATH: ClassVar[str] = "../data/users.txt"
@@ -20,7 +33,11 @@ class Authentication:
         Generating password with default length of {DEFAULT_PASSWORD_LENGTH} characters.
         '''
 
-        user_database: UserDatabase = UserDatabase("../data/users.db")
+        # users.txt is only read once, to import credentials saved before they moved to the database
+        user_database: UserDatabase = UserDatabase("../data/users.db", legacy_credentials_path=USER_DETAILS_FILEPATH)
+        # KDF and cost used for new hashes; replace with PasswordHasher(params, workers) to tune it
+        hasher: PasswordHasher = PasswordHasher()
+        BULK_BATCH_SIZE: ClassVar[int] = 5000
 
         @classmethod
         def generate_password(cls, length: Optional[int]=12) -> str:
@@ -29,42 +46,45 @@ class Authentication:
                 return pwd
         
         @classmethod
-        def hash_password(cls, pwd: str) -> str:
+        def hash_password(cls, pwd: str, salt: str = "") -> str:
                 """
-                Hash a password using SHA-256 algorithm
+                Hash a password using SHA-256 algorithm, as users.txt did.
+                Only kept for legacy credentials; new ones go through cls.hasher.
                 """
-                pwd_bytes = pwd.encode('utf-8')
+                pwd_bytes = (salt + pwd).encode('utf-8')
                 hashed_pwd = hashlib.sha256(pwd_bytes).hexdigest()
                 return hashed_pwd
         
         @classmethod
-        def save_user(cls, username: str, hashed_pwd:str) -> None:
-                """Save user-details to the users db and file"""
-                with open(cls.USER_DETAILS_FILEPATH, "a") as f:
-                        f.write(f"{username} {hashed_pwd}\n")
-                
-                curr_user = User(username=username)
-                cls.user_database.add_user_to_db(curr_user)                
+        def save_user(cls, username: str, pwd: str) -> bool:
+                """Save user-details and salted password hash to the users db; False if the username is taken"""
+                if cls.user_database.user_exists(username):
+                        return False
+                credentials = cls.hasher.new_credentials(username, pwd)
+                # One transaction: only the process that gets the username sets its password, and a
+                # username is never taken without one
+                return cls.user_database.add_user_to_db(User(username=username), credentials=credentials).result()
                 
         
         @classmethod
         def user_exists(cls, username: str) -> bool:
-                """Check if users exists in database"""
-                user = cls.user_database.get_user_from_db(username)
-                return user is not None
+                """Check if users exists in database, without loading their drive"""
+                return cls.user_database.user_exists(username)
 
         @classmethod
         def authenticate_user(cls, username: str, password: str) -> bool:
-                try:
-                        with open(cls.USER_DETAILS_FILEPATH, "r") as f:
-                                for line in f:
-                                        items = line.split()
-                                        if items[0] == username and items[1] == cls.hash_password(password):
-                                                return True
-                                return False
-                except:
-                        raise ValueError("Invalid password storage location")
+                """
+                One indexed lookup of the user's credentials and one hash of the password.
+                Credentials hashed with outdated parameters are rehashed on success.
+                """
+                credentials = cls.user_database.get_credentials(username)
+                if credentials is None:
                         return False
+                if not cls.hasher.verify(password, credentials):
+                        return False
+                if cls.hasher.needs_rehash(credentials):
+                        cls.user_database.save_credentials(cls.hasher.new_credentials(username, password))
+                return True
 
 
         @classmethod
@@ -91,14 +111,50 @@ class Authentication:
                         password = cls.generate_password(cls.DEFAULT_PASSWORD_LENGTH)
                         print("Your password is:", password)
 
-                hashed_password = cls.hash_password(password)
-                cls.save_user(username, hashed_password)
+                if not cls.save_user(username, password):
+                        print("User already exists.")
+                        return None
                 print("User created successfully. You will now be logged in.\n")
                 authenticated_user = cls.login(username, password)
                 return authenticated_user
 
         @classmethod
-        def login(cls, username: Optional[str] = "", password: Optional[str] = "") -> "User":
+        def register_bulk(cls, users: Iterable[Tuple[str, str]], batch_size: int = BULK_BATCH_SIZE,
+                          hasher: Optional[PasswordHasher] = None) -> BulkRegistration:
+                """
+                Register a stream of (username, password) pairs, batch_size at a time:
+                each batch is checked against the database in one query, hashed in
+                parallel and inserted in one transaction. No drives are created or
+                loaded; they are built on first use. A cheaper hasher can be passed for
+                large imports, and the hashes get upgraded as users log in.
+                """
+                hasher = hasher or cls.hasher
+                result = BulkRegistration()
+                started = time.perf_counter()
+                users = iter(users)
+                while batch := list(islice(users, batch_size)):
+                        valid = {}
+                        for username, password in batch:
+                                if not username or not password or not 8 <= len(password) <= 16 or username in valid:
+                                        result.invalid += 1
+                                else:
+                                        valid[username] = password
+                        existing = cls.user_database.existing_usernames(list(valid))
+                        result.existing += len(existing)
+                        new_users = [(username, password) for username, password in valid.items() if username not in existing]
+                        if not new_users:
+                                continue
+                        credentials = hasher.new_credentials_many(new_users)
+                        created = cls.user_database.add_users_bulk([username for username, _ in new_users], credentials)
+                        result.created += created
+                        # Registered concurrently by someone else between the check and the insert
+                        result.existing += len(new_users) - created
+                result.elapsed = time.perf_counter() - started
+                return result
+
+        @classmethod
+        def login(cls, username: Optional[str] = "", password: Optional[str] = "") -> "UserRecord":
+                """Authenticate a user; their drive is only loaded later, by whoever needs it"""
                 if not cls.user_exists(username):
                         print("User does not exist.")
                         return False
@@ -107,7 +163,7 @@ class Authentication:
                         print("Incorrect username or password.")
                         return None
 
-                authenticated_user = cls.user_database.get_user_from_db(username)
+                authenticated_user = cls.user_database.get_user_record(username)
                 print("Login successful.\n")
                 return authenticated_user
                 
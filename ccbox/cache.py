@@ -0,0 +1,103 @@
+from typing import Union, List, Dict, Optional, Any, ClassVar, Callable, Hashable
+from dataclasses import dataclass, asdict
+from collections import OrderedDict
+import threading
+import time
+
+
+@dataclass
+class CacheStats:
+        """Counters for sizing a cache: lookups served, lookups missed and entries dropped"""
+        hits: int = 0
+        misses: int = 0
+        evictions: int = 0
+        expirations: int = 0
+        invalidations: int = 0
+        size: int = 0
+        max_size: int = 0
+
+        @property
+        def hit_rate(self) -> float:
+                lookups = self.hits + self.misses
+                return self.hits / lookups if lookups else 0.0
+
+        def to_dict(self) -> dict:
+                stats = asdict(self)
+                stats["hit_rate"] = round(self.hit_rate, 4)
+                return stats
+
+
+class LRUCache:
+        """
+        Thread-safe least-recently-used cache bounded by entry count and,
+        optionally, by age: entries older than ttl seconds are treated as
+        missing. A max_size of 0 disables caching altogether.
+        """
+
+        def __init__(self, max_size: int = 128, ttl: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+                self.max_size = max_size
+                self.ttl = ttl
+                self._clock = clock
+                self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+                self._lock = threading.Lock()
+                self._stats = CacheStats(max_size=max_size)
+
+        def get(self, key: Hashable) -> Optional[Any]:
+                with self._lock:
+                        entry = self._entries.get(key)
+                        if entry is not None:
+                                value, stored_at = entry
+                                if self.ttl is not None and self._clock() - stored_at > self.ttl:
+                                        del self._entries[key]
+                                        self._stats.expirations += 1
+                                else:
+                                        self._entries.move_to_end(key)
+                                        self._stats.hits += 1
+                                        return value
+                        self._stats.misses += 1
+                        return None
+
+        def put(self, key: Hashable, value: Any) -> None:
+                if self.max_size <= 0:
+                        return
+                with self._lock:
+                        self._entries[key] = (value, self._clock())
+                        self._entries.move_to_end(key)
+                        while len(self._entries) > self.max_size:
+                                self._entries.popitem(last=False)
+                                self._stats.evictions += 1
+
+        def setdefault(self, key: Hashable, value: Any) -> Any:
+                """Store value unless a live entry exists already; returns whichever is cached"""
+                with self._lock:
+                        entry = self._entries.get(key)
+                        if entry is not None and (self.ttl is None or self._clock() - entry[1] <= self.ttl):
+                                self._entries.move_to_end(key)
+                                return entry[0]
+                self.put(key, value)
+                return value
+
+        def invalidate(self, key: Hashable) -> bool:
+                with self._lock:
+                        if self._entries.pop(key, None) is None:
+                                return False
+                        self._stats.invalidations += 1
+                        return True
+
+        def clear(self) -> None:
+                with self._lock:
+                        self._entries.clear()
+
+        def stats(self) -> CacheStats:
+                with self._lock:
+                        stats = CacheStats(**asdict(self._stats))
+                        stats.size = len(self._entries)
+                        return stats
+
+        def __contains__(self, key: Hashable) -> bool:
+                with self._lock:
+                        return key in self._entries
+
+        def __len__(self) -> int:
+                with self._lock:
+                        return len(self._entries)
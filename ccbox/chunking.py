@@ -0,0 +1,216 @@
+"""
+Content-defined chunking for delta uploads of large files.
+
+A file is cut wherever a rolling "gear" hash of the bytes just before the
+cut matches a mask, so cut points move with the content: an edit only
+changes the chunks around it, and the chunks after it are found again at
+their new offsets. Chunks are then stored by digest like whole files (see
+ccbox.content_store), so re-uploading a modified file only sends the
+chunks that are not stored yet.
+
+Cut points follow FastCDC's normalized chunking: no cut before min_size,
+a strict mask up to avg_size and a looser one after it, and a forced cut
+at max_size, which keeps chunk sizes close to avg_size.
+
+The masks only test the low bits of the hash. Bit k of the gear hash
+depends only on the last k + 1 bytes, so whether a position is a cut
+candidate depends on a fixed window of bytes before it. That is what lets
+the numpy implementation hash a whole buffer at once in a handful of
+vector shift-and-add passes; the pure Python loop, used when numpy is not
+installed, finds exactly the same cut points.
+"""
+from typing import Union, List, Dict, Optional, Any, ClassVar, Iterator, Callable, BinaryIO, Tuple
+from bisect import bisect_left
+import hashlib
+
+try:
+        import numpy as np
+except ImportError:  # pragma: no cover - numpy is optional
+        np = None
+
+# One pseudo-random 32-bit value per byte value. Derived from SHA-256 rather
+# than a seeded RNG so cut points, and with them chunk digests, never change.
+GEAR = [int.from_bytes(hashlib.sha256(bytes([value])).digest()[:4], "little") for value in range(256)]
+HASH_MASK = 0xFFFFFFFF
+
+# Bytes hashed per vector pass: small enough for the hash arrays to stay in cache
+SEGMENT_SIZE = 128 * 1024
+# Bytes of the previous segment rehashed so hashes at the start of a segment are complete
+SEGMENT_OVERLAP = 32
+
+
+class Chunker:
+        """
+        Splits data into content-defined chunks of min_size to max_size bytes,
+        avg_size (a power of two) on average. Only files of at least threshold
+        bytes are worth chunking; smaller ones are stored whole.
+
+        vectorized picks the numpy implementation; by default it is used when
+        numpy is installed.
+        """
+        DEFAULT_MIN_SIZE: ClassVar[int] = 256 * 1024
+        DEFAULT_AVG_SIZE: ClassVar[int] = 1024 * 1024
+        DEFAULT_MAX_SIZE: ClassVar[int] = 4 * 1024 * 1024
+        DEFAULT_THRESHOLD: ClassVar[int] = 4 * 1024 * 1024
+        DEFAULT_BUFFER_SIZE: ClassVar[int] = 16 * 1024 * 1024
+        # Masks one bit stricter/looser than avg_size per level either side of it
+        NORMALIZATION: ClassVar[int] = 2
+
+        def __init__(self, min_size: int = DEFAULT_MIN_SIZE, avg_size: int = DEFAULT_AVG_SIZE,
+                     max_size: int = DEFAULT_MAX_SIZE, threshold: int = DEFAULT_THRESHOLD,
+                     buffer_size: int = DEFAULT_BUFFER_SIZE, vectorized: Optional[bool] = None):
+                bits = avg_size.bit_length() - 1
+                if avg_size <= 0 or avg_size != 1 << bits:
+                        raise ValueError(f"avg_size must be a power of two, got {avg_size}")
+                self.window = bits + self.NORMALIZATION
+                if self.window > 32 or bits <= self.NORMALIZATION:
+                        raise ValueError(f"avg_size {avg_size} is out of range")
+                if not self.window <= min_size < avg_size < max_size:
+                        raise ValueError(f"Expected {self.window} <= min_size < avg_size < max_size, "
+                                         f"got {min_size}, {avg_size}, {max_size}")
+                if vectorized and np is None:
+                        raise ValueError("The vectorized chunker needs numpy")
+                self.min_size = min_size
+                self.avg_size = avg_size
+                self.max_size = max_size
+                self.threshold = threshold
+                # A buffer must hold at least one whole chunk past the bytes carried over
+                self.buffer_size = max(buffer_size, 2 * max_size)
+                self.vectorized = np is not None if vectorized is None else vectorized
+                self.mask_strict = (1 << self.window) - 1
+                self.mask_loose = (1 << (bits - self.NORMALIZATION)) - 1
+
+        def cut_points(self, data: Union[bytes, bytearray, memoryview], eof: bool = True) -> List[int]:
+                """
+                End offsets of the chunks of data, in order. Unless eof is set, the bytes
+                after the last cut are left out: more data could still move the next cut.
+                """
+                if self.vectorized:
+                        find = self._finder_vectorized(data)
+                else:
+                        find = self._finder(data)
+                cuts = []
+                start, length = 0, len(data)
+                while start < length:
+                        end = start + self.max_size
+                        if end > length:
+                                if not eof:
+                                        break
+                                end = length
+                        start = find(start, end) if end - start > self.min_size else end
+                        cuts.append(start)
+                return cuts
+
+        def split(self, data: Union[bytes, bytearray, memoryview]) -> List[memoryview]:
+                view = memoryview(data)
+                cuts = self.cut_points(view)
+                return [view[start:end] for start, end in zip([0] + cuts, cuts)]
+
+        def iter_chunks(self, stream: BinaryIO) -> Iterator[memoryview]:
+                """Chunks of a binary stream, read buffer_size bytes at a time"""
+                pending = b""
+                while True:
+                        block = stream.read(self.buffer_size)
+                        eof = not block
+                        data = pending + block if pending else block
+                        view = memoryview(data)
+                        start = 0
+                        for end in self.cut_points(view, eof):
+                                yield view[start:end]
+                                start = end
+                        if eof:
+                                return
+                        pending = data[start:]
+
+        def iter_file(self, path: str) -> Iterator[memoryview]:
+                with open(path, "rb") as f:
+                        yield from self.iter_chunks(f)
+
+        def _finder(self, data: Union[bytes, bytearray, memoryview]) -> Callable[[int, int], int]:
+                """The cut for a chunk from start to at most end, one byte at a time"""
+                gear, min_size, avg_size = GEAR, self.min_size, self.avg_size
+                mask_strict, mask_loose, window = self.mask_strict, self.mask_loose, self.window
+
+                def find(start: int, end: int) -> int:
+                        # Prime the hash with the window before the first candidate
+                        h = 0
+                        for byte in data[start + min_size - window:start + min_size - 1]:
+                                h = ((h << 1) + gear[byte]) & HASH_MASK
+                        normal = min(start + avg_size, end)
+                        position = start + min_size - 1
+                        for byte in data[position:normal]:
+                                h = ((h << 1) + gear[byte]) & HASH_MASK
+                                position += 1
+                                if not h & mask_strict:
+                                        return position
+                        for byte in data[normal:end]:
+                                h = ((h << 1) + gear[byte]) & HASH_MASK
+                                position += 1
+                                if not h & mask_loose:
+                                        return position
+                        return end
+
+                return find
+
+        def _finder_vectorized(self, data: Union[bytes, bytearray, memoryview]) -> Callable[[int, int], int]:
+                """The same cuts, looked up among every candidate of the buffer hashed up front"""
+                strict, loose = self._candidates(data)
+                min_size, avg_size = self.min_size, self.avg_size
+
+                def find(start: int, end: int) -> int:
+                        normal = min(start + avg_size, end)
+                        i = bisect_left(strict, start + min_size)
+                        if i < len(strict) and strict[i] <= normal:
+                                return strict[i]
+                        i = bisect_left(loose, normal + 1)
+                        if i < len(loose) and loose[i] <= end:
+                                return loose[i]
+                        return end
+
+                return find
+
+        def _candidates(self, data: Union[bytes, bytearray, memoryview]) -> Tuple[List[int], List[int]]:
+                """Cut offsets (one past the hashed byte) matching the strict and the loose mask"""
+                array = np.frombuffer(data, dtype=np.uint8)
+                out = np.empty(SEGMENT_SIZE + SEGMENT_OVERLAP, dtype=np.uint32)
+                scratch = np.empty_like(out)
+                strict, loose = [], []
+                for offset in range(0, len(array), SEGMENT_SIZE):
+                        first = max(offset - SEGMENT_OVERLAP, 0)
+                        segment = array[first:offset + SEGMENT_SIZE]
+                        h = _window_hashes(segment, out[:len(segment)], scratch)[offset - first:]
+                        hits = np.flatnonzero((h & np.uint32(self.mask_loose)) == 0)
+                        # The strict mask has every bit of the loose one
+                        strict_hits = hits[(h[hits] & np.uint32(self.mask_strict)) == 0]
+                        loose.append(hits + (offset + 1))
+                        strict.append(strict_hits + (offset + 1))
+                if not loose:
+                        return [], []
+                return np.concatenate(strict).tolist(), np.concatenate(loose).tolist()
+
+
+def default_chunker() -> Optional[Chunker]:
+        """A Chunker with the default sizes, or None (store files whole) without numpy"""
+        return Chunker() if np is not None else None
+
+
+_GEAR_ARRAY = np.array(GEAR, dtype=np.uint32) if np is not None else None
+
+
+def _window_hashes(array: "np.ndarray", out: "np.ndarray", scratch: "np.ndarray") -> "np.ndarray":
+        """
+        The gear hash at every position of array, over the (up to) 32 bytes
+        ending there. h(i) is the sum of gear[byte(i - k)] << k, so hashes over
+        windows of 2m bytes are built from those over m bytes in one pass:
+        h2m(i) = hm(i) + (hm(i - m) << m). Five passes cover 32 bytes, all a
+        32-bit hash can hold. The hashes are written to out, which must be as
+        long as array; scratch must be at least as long.
+        """
+        h = np.take(_GEAR_ARRAY, array, out=out)
+        shift = 1
+        while shift < 32:
+                shifted = scratch[:len(h) - shift]
+                np.left_shift(h[:-shift], np.uint32(shift), out=shifted)
+                h[shift:] += shifted
+                shift *= 2
+        return h
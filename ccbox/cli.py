@@ -1,21 +1,56 @@
 import argparse
-import socket
+import sys
 
-def send_command(command):
-        HOST, PORT = "localhost", 9999
-        data = f"{command}\n"
+from ccbox.protocol import FramedClient
 
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-                sock.connect((HOST, PORT))
-                sock.sendall(data.encode('utf-8'))
+HOST, PORT = "localhost", 9999
 
-                received = sock.recv(1024).decode('utf-8')
-        
-        print("Sent:     {}".format(data.strip()))
-        print("Received: {}".format(received.strip()))
+
+def send_command(command, host=HOST, port=PORT, out=None):
+        """Send one command and write the response to out as it arrives"""
+        out = out or sys.stdout
+        with FramedClient(host, port) as client:
+                request_id = client.send(command)
+                out.write("Sent:     {}\n".format(command))
+                out.write("Received: ")
+                first = True
+                for piece in client.iter_response(request_id):
+                        out.write(piece.lstrip() if first else piece)
+                        first = False
+                        out.flush()
+                out.write("\n")
+
+def read_commands(lines):
+        for line in lines:
+                command = line.strip()
+                if command and not command.startswith("#"):
+                        yield command
+                        if command.split()[0].lower() in ('quit', 'exit'):
+                                return
+
+def run_batch(lines, host=HOST, port=PORT, window=32, out=None):
+        """
+        Run commands (one per line, "#" comments allowed) over a single
+        connection, pipelining up to window of them, and write the responses
+        to out in command order, each piece as soon as it arrives. Stops at
+        quit or exit.
+        """
+        out = out or sys.stdout
+        count = 0
+        with FramedClient(host, port) as client:
+                commands = read_commands(lines)
+                for text, last in client.stream_pieces(commands, window):
+                        out.write(text)
+                        if last:
+                                out.write("\n")
+                                count += 1
+                        out.flush()
+        return count
 
 def main():
         parser = argparse.ArgumentParser(description='CCBox Command Line Interface')
+        parser.add_argument('--host', type=str, default=HOST, help='API server host')
+        parser.add_argument('--port', type=int, default=PORT, help='API server port')
 
         subparsers = parser.add_subparsers(dest='command')
 
@@ -28,14 +63,32 @@ def main():
         login_parser = subparsers.add_parser('login', help='Login an existing user')
         login_parser.add_argument('--username', type=str, required=True, help='Username')
         login_parser.add_argument('--password', type=str, required=True, help='Password')
-        
+
         # Mount command
         mount_parser = subparsers.add_parser('mount', help='Mount Directory')
         mount_parser.add_argument('--username', type=str, required=True, help='Username')
         mount_parser.add_argument('--dir', type=str, required=True, help='Directory to mount')
-        
+
+        # Job command
+        job_parser = subparsers.add_parser('job', help='Show the progress of a mount job')
+        job_parser.add_argument('job_id', type=str, help='Job id printed by mount')
+
         content_parser = subparsers.add_parser('contents', help='View Contents of Current Directory')
         content_parser.add_argument('--username', type=str, required=True, help='Username')
+        content_parser.add_argument('--depth', type=int, help='Only list this many folder levels')
+
+        list_parser = subparsers.add_parser('list', help='List one folder of the virtual drive a page at a time')
+        list_parser.add_argument('--username', type=str, required=True, help='Username')
+        list_parser.add_argument('--path', type=str, default='', help='Folder to list, the drive root by default')
+        list_parser.add_argument('--depth', type=int, help='Folder levels to include per entry (default 1)')
+        list_parser.add_argument('--limit', type=int, help='Entries per page')
+        list_parser.add_argument('--cursor', type=str, help='next_cursor of the previous page')
+
+        # Batch command
+        batch_parser = subparsers.add_parser('batch', help='Run commands from a file (or stdin) over one connection')
+        batch_parser.add_argument('file', type=argparse.FileType('r'), nargs='?', default=sys.stdin,
+                                  help='File with one command per line, "-" or omitted for stdin')
+        batch_parser.add_argument('--window', type=int, default=32, help='Commands in flight at once')
 
         # Other commands
         subparsers.add_parser('quit', help='Close connection')
@@ -46,19 +99,36 @@ def main():
 
         args = parser.parse_args()
 
-        if args.command == 'register':
-                command = f"register {args.username} {args.password}"
-                send_command(command)
-        elif args.command == 'login':
-                command = f"login {args.username} {args.password}"
-                send_command(command)
-        elif args.command == "mount":
-                command = f"login {args.dir}"
-                send_command(command)
-        elif args.command in ['quit', 'exit', 'version', 'about', 'help', 'contents']:
-                send_command(args.command)
-        else:
-                parser.print_help()
+        try:
+                if args.command == 'register':
+                        command = f"register {args.username} {args.password}"
+                        send_command(command, args.host, args.port)
+                elif args.command == 'login':
+                        command = f"login {args.username} {args.password}"
+                        send_command(command, args.host, args.port)
+                elif args.command == "mount":
+                        command = f"mount {args.username} {args.dir}"
+                        send_command(command, args.host, args.port)
+                elif args.command == 'job':
+                        send_command(f"job {args.job_id}", args.host, args.port)
+                elif args.command == 'contents':
+                        command = f"contents {args.username}" + (f" {args.depth}" if args.depth is not None else "")
+                        send_command(command, args.host, args.port)
+                elif args.command == 'list':
+                        options = [f"{name}={value}" for name, value in
+                                   (('depth', args.depth), ('limit', args.limit), ('cursor', args.cursor)) if value is not None]
+                        command = " ".join([f"list {args.username}", args.path] + options)
+                        send_command(command, args.host, args.port)
+                elif args.command == 'batch':
+                        with args.file:
+                                run_batch(args.file, args.host, args.port, args.window)
+                elif args.command in ['quit', 'exit', 'version', 'about', 'help']:
+                        send_command(args.command, args.host, args.port)
+                else:
+                        parser.print_help()
+        except (ConnectionError, OSError) as e:
+                print(f"Error: could not talk to the API server at {args.host}:{args.port}: {e}", file=sys.stderr)
+                sys.exit(1)
 
 if __name__ == '__main__':
-        main()
\ No newline at end of file
+        main()
@@ -0,0 +1,247 @@
+from typing import Union, List, Dict, Optional, Any, ClassVar, Callable, Tuple
+from dataclasses import dataclass, asdict
+import threading
+import random
+import json
+import time
+
+from ccbox.storage_handler import StorageHandler, VersionConflict
+
+
+@dataclass
+class ContentRecord:
+        """A stored content blob: its size and how many drive entries point at it"""
+        size: int
+        refs: int = 0
+        # When refs dropped to zero (a time.time()); the blob is deleted once that is ORPHAN_GRACE ago
+        released: Optional[float] = None
+
+
+class ContentStore:
+        """
+        Content-addressed blob layout: every distinct file content is stored
+        once, as sha256/<first two hex digits>/<sha256>, in the container of
+        the store's storage handler, and drives reference it by digest.
+
+        The index keeps one record per stored blob with a reference count: one
+        reference per drive entry (manifest blob name) whose current content it
+        is. A digest is only referenced once its blob has been uploaded, so a
+        hit means the upload can be skipped.
+
+        Several processes (or servers) may share a container, so reference
+        changes are kept as deltas and save() merges them into the index as
+        stored right now, with a conditional write that is retried when
+        another writer got there first. A blob whose count drops to zero is
+        only deleted by delete_orphans() once it has been unreferenced for
+        ORPHAN_GRACE, and only if it was not uploaded again meanwhile; views
+        older than half of that are refreshed before they are relied on.
+
+        Drives that point at the same container share one store per process
+        (see open()), which is how identical files across folders, re-mounts
+        and users are uploaded only once.
+        """
+        INDEX_NAME: ClassVar[str] = "content_index.json"
+        ORPHAN_GRACE: ClassVar[float] = 24 * 60 * 60
+        MAX_SAVE_ATTEMPTS: ClassVar[int] = 10
+        _stores: ClassVar[Dict[str, "ContentStore"]] = {}
+        _stores_lock: ClassVar[threading.Lock] = threading.Lock()
+
+        def __init__(self, storage_handler: StorageHandler):
+                self.storage_handler = storage_handler
+                self.records: Dict[str, ContentRecord] = {}
+                # digest -> (reference change not saved yet, blob size)
+                self._deltas: Dict[str, Tuple[int, int]] = {}
+                self._loaded = 0.0
+                self._lock = threading.Lock()
+                self._save_lock = threading.Lock()
+                self._refresh()
+
+        @classmethod
+        def open(cls, storage_handler: StorageHandler) -> "ContentStore":
+                """The process-wide store for the handler's container"""
+                key = json.dumps(storage_handler.to_dict(), sort_keys=True)
+                with cls._stores_lock:
+                        store = cls._stores.get(key)
+                        if store is None:
+                                store = cls._stores[key] = cls(storage_handler)
+                        return store
+
+        @classmethod
+        def close_all(cls) -> None:
+                """Forget the open stores, e.g. in a forked worker or between tests"""
+                with cls._stores_lock:
+                        cls._stores.clear()
+
+        @property
+        def container_name(self) -> str:
+                return self.storage_handler.container_name
+
+        @staticmethod
+        def blob_name(digest: str) -> str:
+                return f"sha256/{digest[:2]}/{digest}"
+
+        def contains(self, digest: str) -> bool:
+                self._refresh_if_stale()
+                with self._lock:
+                        record = self.records.get(digest)
+                        return record is not None and record.refs > 0
+
+        def add_ref(self, digest: str) -> bool:
+                """Reference already stored content; False if it is not stored and must be uploaded first"""
+                self._refresh_if_stale()
+                with self._lock:
+                        record = self.records.get(digest)
+                        # Unreferenced content may be deleted any time now: upload it again
+                        if record is None or record.refs <= 0:
+                                return False
+                        self._change(digest, 1, record.size)
+                        return True
+
+        def add_stored(self, digest: str, size: int) -> None:
+                """Record a reference to content that was just uploaded"""
+                self._refresh_if_stale()
+                with self._lock:
+                        self._change(digest, 1, size)
+
+        def release(self, digest: str) -> None:
+                """Drop one reference; unknown digests (e.g. from a path-named upload) are ignored"""
+                self._refresh_if_stale()
+                with self._lock:
+                        record = self.records.get(digest)
+                        if record is None:
+                                return
+                        self._change(digest, -1, record.size)
+
+        def delete_orphans(self) -> int:
+                """Delete the blobs nothing has referenced for ORPHAN_GRACE; returns how many were deleted"""
+                self.save()
+                cutoff = time.time() - self.ORPHAN_GRACE
+                with self._lock:
+                        expired = {digest: record.released for digest, record in self.records.items()
+                                   if record.refs <= 0 and record.released is not None and record.released <= cutoff}
+                if not expired:
+                        return 0
+
+                def forget(records: Dict[str, ContentRecord]) -> Dict[str, ContentRecord]:
+                        # Only what is still unreferenced in the index as stored now
+                        forgotten = {}
+                        for digest in expired:
+                                record = records.get(digest)
+                                if record is not None and record.refs <= 0 and record.released is not None \
+                                        and record.released <= cutoff:
+                                        forgotten[digest] = records.pop(digest)
+                        return forgotten
+
+                # Drop the records before the blobs, so a reference added meanwhile makes the write conflict
+                forgotten = self._commit(forget)
+                deleted, kept = 0, {}
+                for digest, record in forgotten.items():
+                        if self.storage_handler.delete_blob_if_unmodified(self.container_name, self.blob_name(digest),
+                                                                          record.released):
+                                deleted += 1
+                        else:
+                                kept[digest] = record
+
+                def restore(records: Dict[str, ContentRecord]) -> None:
+                        # Uploaded again since it was released: keep the blob known until the uploader saves
+                        now = time.time()
+                        for digest, record in kept.items():
+                                records.setdefault(digest, ContentRecord(record.size, 0, now))
+
+                if kept:
+                        self._commit(restore)
+                return deleted
+
+        def save(self) -> None:
+                """Merge the reference changes made since the last save into the stored index"""
+                with self._save_lock:
+                        with self._lock:
+                                deltas, self._deltas = self._deltas, {}
+                        if not deltas:
+                                self._refresh()
+                                return
+
+                        def merge(records: Dict[str, ContentRecord]) -> None:
+                                now = time.time()
+                                for digest, (delta, size) in deltas.items():
+                                        self._apply(records, digest, delta, size, now)
+
+                        try:
+                                self._commit(merge)
+                        except BaseException:
+                                with self._lock:
+                                        for digest, (delta, size) in deltas.items():
+                                                pending, _ = self._deltas.get(digest, (0, size))
+                                                self._deltas[digest] = (pending + delta, size)
+                                raise
+
+        def stats(self) -> dict:
+                with self._lock:
+                        live = [record for record in self.records.values() if record.refs > 0]
+                        return {
+                        "blobs": len(live),
+                        "bytes": sum(record.size for record in live),
+                        "refs": sum(record.refs for record in live)
+                        }
+
+        def _change(self, digest: str, delta: int, size: int) -> None:
+                """Apply a reference change to the local view and queue it for save(); holds _lock"""
+                self._apply(self.records, digest, delta, size, time.time())
+                pending, _ = self._deltas.get(digest, (0, size))
+                self._deltas[digest] = (pending + delta, size)
+
+        @staticmethod
+        def _apply(records: Dict[str, ContentRecord], digest: str, delta: int, size: int, now: float) -> None:
+                record = records.get(digest)
+                if record is None:
+                        # A blob uploaded and released again before a save is still recorded, to be deleted
+                        if delta < 0:
+                                return
+                        record = records[digest] = ContentRecord(size)
+                referenced = record.refs > 0
+                record.refs = max(record.refs + delta, 0)
+                if record.refs > 0:
+                        record.released = None
+                elif referenced or record.released is None:
+                        record.released = now
+
+        def _commit(self, change: Callable[[Dict[str, ContentRecord]], Any]) -> Any:
+                """
+                Apply change to the index as stored now and write it back unless
+                another writer changed it meanwhile, in which case start over.
+                """
+                for attempt in range(self.MAX_SAVE_ATTEMPTS):
+                        index, version = self.storage_handler.download_json_versioned(self.INDEX_NAME)
+                        records = self._records(index)
+                        result = change(records)
+                        try:
+                                self.storage_handler.upload_json_versioned(
+                                        {digest: asdict(record) for digest, record in records.items()},
+                                        self.INDEX_NAME, version)
+                        except VersionConflict:
+                                time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+                                continue
+                        self._update(records)
+                        return result
+                raise VersionConflict(f"{self.INDEX_NAME} kept changing, gave up after {self.MAX_SAVE_ATTEMPTS} attempts")
+
+        def _refresh(self) -> None:
+                index, _ = self.storage_handler.download_json_versioned(self.INDEX_NAME)
+                self._update(self._records(index))
+
+        def _refresh_if_stale(self) -> None:
+                if time.time() - self._loaded > self.ORPHAN_GRACE / 2:
+                        self.save()
+
+        def _update(self, records: Dict[str, ContentRecord]) -> None:
+                """Make records, plus the changes not saved yet, the local view"""
+                with self._lock:
+                        now = time.time()
+                        for digest, (delta, size) in self._deltas.items():
+                                self._apply(records, digest, delta, size, now)
+                        self.records = records
+                        self._loaded = now
+
+        @staticmethod
+        def _records(index: Optional[dict]) -> Dict[str, ContentRecord]:
+                return {digest: ContentRecord(**record) for digest, record in (index or {}).items()}
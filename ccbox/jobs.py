@@ -0,0 +1,264 @@
+"""
+Background mount jobs.
+
+A mount can take minutes, so the web and API servers only queue it and hand
+back a job id; a JobScheduler runs the scan and upload on a small pool of
+its own and the client polls the job for progress. Job state is saved to
+the user database as it goes, together with the drive's manifest, so jobs
+that were queued or running when the server stopped can be resumed: the
+manifest lets the restarted upload skip whatever already reached storage.
+"""
+from typing import Union, List, Dict, Optional, Any, ClassVar, Callable
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import deque
+from dataclasses import dataclass, field, asdict
+import threading
+import logging
+import time
+import uuid
+
+from ccbox.virtual_drive import Virtual_Drive, Folder
+from ccbox.user import UserDatabase
+from ccbox.authentication import Authentication
+from ccbox.storage_handler import storage_handler_from_dict
+from ccbox.upload_pipeline import UploadStats
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+UNFINISHED = [QUEUED, RUNNING]
+
+
+@dataclass
+class MountJob:
+        """Progress of one mount; counts include files found already up to date"""
+        username: str
+        dir_path: str
+        id: str = field(default_factory=lambda: uuid.uuid4().hex)
+        status: str = QUEUED
+        files_total: Optional[int] = None
+        bytes_total: Optional[int] = None
+        files_done: int = 0
+        bytes_done: int = 0
+        created: float = field(default_factory=time.time)
+        started: Optional[float] = None
+        finished: Optional[float] = None
+        resumed: int = 0
+        upload: Optional[dict] = None
+        error: Optional[str] = None
+
+        def advance(self, path: Optional[str], size: int) -> None:
+                # Folder marker blobs have no local path and are not counted as files
+                if path is not None:
+                        self.files_done += 1
+                        self.bytes_done += size
+
+        @property
+        def elapsed(self) -> float:
+                if self.started is None:
+                        return 0.0
+                return (self.finished or time.time()) - self.started
+
+        @property
+        def rate(self) -> float:
+                """Bytes per second since the job (last) started"""
+                elapsed = self.elapsed
+                return self.bytes_done / elapsed if elapsed > 0 else 0.0
+
+        @property
+        def eta(self) -> Optional[float]:
+                """Seconds left at the current rate, once the scan has sized the job"""
+                if self.status == DONE:
+                        return 0.0
+                if self.status != RUNNING or self.bytes_total is None or self.rate == 0:
+                        return None
+                return max(self.bytes_total - self.bytes_done, 0) / self.rate
+
+        def to_dict(self) -> dict:
+                data = asdict(self)
+                data['rate'] = round(self.rate, 1)
+                data['eta'] = round(self.eta, 1) if self.eta is not None else None
+                return data
+
+        @classmethod
+        def from_dict(cls, data: dict) -> 'MountJob':
+                fields = cls.__dataclass_fields__
+                return cls(**{key: value for key, value in data.items() if key in fields})
+
+
+class JobScheduler:
+        """
+        Runs mount jobs with at most max_concurrent at a time across the
+        server; the rest wait in the pool's queue. A user's jobs run one after
+        the other, since they all update the same cached drive and manifest.
+        Jobs of other processes are not waited for: their snapshot and manifest
+        writes are merged instead (see Virtual_Drive.sync_directory).
+        Progress is written to the store at most every persist_interval
+        seconds and on every status change.
+        With a content_container, drives that do not have a content store yet
+        are switched to that shared one, so identical files are stored once
+        across all users.
+        """
+        DEFAULT_MAX_CONCURRENT: ClassVar[int] = 2
+        DEFAULT_PERSIST_INTERVAL: ClassVar[float] = 5.0
+
+        def __init__(self, store: UserDatabase, max_concurrent: int = DEFAULT_MAX_CONCURRENT,
+                     persist_interval: float = DEFAULT_PERSIST_INTERVAL,
+                     runner: Optional[Callable[["JobScheduler", MountJob], UploadStats]] = None,
+                     content_container: Optional[str] = None):
+                self.store = store
+                self.content_container = content_container
+                self.max_concurrent = max_concurrent
+                self.persist_interval = persist_interval
+                self.runner = runner or JobScheduler.run_mount
+                self._jobs: Dict[str, MountJob] = {}
+                # Users with a job submitted to the pool, and their jobs waiting behind it
+                self._waiting: Dict[str, deque] = {}
+                self._unfinished = 0
+                self._lock = threading.Lock()
+                self._idle = threading.Condition(self._lock)
+                self._executor: Optional[ThreadPoolExecutor] = None
+
+        def _pool(self) -> ThreadPoolExecutor:
+                # Created on first use, so a scheduler built before a fork is safe to use after it
+                with self._lock:
+                        if self._executor is None:
+                                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent,
+                                                                    thread_name_prefix="ccbox-job")
+                        return self._executor
+
+        def submit_mount(self, username: str, dir_path: str) -> Optional[MountJob]:
+                """Queue a mount and return its job at once; None if the user does not exist"""
+                if not self.store.user_exists(username):
+                        return None
+                return self._submit(MountJob(username=username, dir_path=dir_path))
+
+        def _submit(self, job: MountJob) -> MountJob:
+                with self._lock:
+                        self._jobs[job.id] = job
+                        self._unfinished += 1
+                self.save(job)
+                self._schedule(job)
+                return job
+
+        def _schedule(self, job: MountJob) -> None:
+                with self._lock:
+                        waiting = self._waiting.get(job.username)
+                        if waiting is not None:
+                                waiting.append(job)
+                                return
+                        self._waiting[job.username] = deque()
+                self._pool().submit(self._run, job)
+
+        def get(self, job_id: str) -> Optional[MountJob]:
+                """A job of this process, or one saved by another worker or an earlier run"""
+                with self._lock:
+                        job = self._jobs.get(job_id)
+                if job is not None:
+                        return job
+                data = self.store.get_job(job_id)
+                return MountJob.from_dict(data) if data else None
+
+        def resume(self) -> List[MountJob]:
+                """Requeue the jobs a previous run left queued or running"""
+                jobs = []
+                for data in self.store.jobs_with_status(UNFINISHED):
+                        job = MountJob.from_dict(data)
+                        with self._lock:
+                                if job.id in self._jobs:
+                                        continue
+                        job.status = QUEUED
+                        job.resumed += 1
+                        job.files_done = job.bytes_done = 0
+                        job.started = job.finished = None
+                        jobs.append(self._submit(job))
+                if jobs:
+                        logging.info(f"Resumed {len(jobs)} mount jobs")
+                return jobs
+
+        def save(self, job: MountJob) -> None:
+                self.store.save_job(job.id, job.status, job.to_dict())
+
+        def _run(self, job: MountJob) -> None:
+                job.status = RUNNING
+                job.started = time.time()
+                self.save(job)
+                try:
+                        upload_stats = self.runner(self, job)
+                        job.upload = upload_stats.to_dict() if upload_stats is not None else None
+                        job.status = DONE
+                except Exception as e:
+                        logging.error(f"Mount job {job.id} for {job.username} failed: {e}")
+                        job.error = str(e)
+                        job.status = FAILED
+                finally:
+                        job.finished = time.time()
+                        self.save(job)
+                        with self._lock:
+                                self._jobs.pop(job.id, None)
+                                waiting = self._waiting[job.username]
+                                next_job = waiting.popleft() if waiting else None
+                                if next_job is None:
+                                        del self._waiting[job.username]
+                        if next_job is not None:
+                                self._pool().submit(self._run, next_job)
+                        with self._lock:
+                                self._unfinished -= 1
+                                if not self._unfinished:
+                                        self._idle.notify_all()
+
+        def run_mount(self, job: MountJob) -> UploadStats:
+                """Mount job.dir_path on the user's drive, saving progress along the way"""
+                user = self.store.get_user_from_db(job.username)
+                if not user:
+                        raise LookupError(f"User {job.username} not found")
+                drive = user.virtual_drive
+                if drive.storage_handler is None:
+                        drive.add_remote(Virtual_Drive.default_remote(drive._id))
+                if self.content_container and drive.content_store is None:
+                        # The shared container is kept by the same kind of storage as the drive
+                        drive.use_content_store(storage_handler_from_dict(
+                                dict(drive.storage_handler.to_dict(), container_name=self.content_container)))
+                try:
+                        upload_stats = drive.sync_directory(job.dir_path,
+                                                            on_mounted=lambda folder: self._sized(job, folder),
+                                                            progress=self._progress(job, drive))
+                finally:
+                        # The drive was saved (or left half-mounted); reload it on the next request
+                        self.store.invalidate_user(job.username)
+                logging.info(f"Mounted {job.dir_path} for {job.username}: {upload_stats}")
+                return upload_stats
+
+        def _sized(self, job: MountJob, folder: Folder) -> None:
+                files = list(folder.walk_files())
+                job.files_total = len(files)
+                job.bytes_total = sum(entry.size for entry in files)
+                self.save(job)
+
+        def _progress(self, job: MountJob, drive: Virtual_Drive) -> Callable[[Optional[str], int], None]:
+                lock = threading.Lock()
+                last_saved = [time.monotonic()]
+
+                def progress(path: Optional[str], size: int) -> None:
+                        with lock:
+                                job.advance(path, size)
+                                now = time.monotonic()
+                                if now - last_saved[0] < self.persist_interval:
+                                        return
+                                last_saved[0] = now
+                        # Save the manifest with the progress, so a resumed job skips what is already uploaded
+                        drive.save_manifest()
+                        self.save(job)
+
+                return progress
+
+        def shutdown(self, wait: bool = True) -> None:
+                """Stop the pool; with wait, once every submitted job, queued behind another or not, is done"""
+                with self._lock:
+                        while wait and self._unfinished:
+                                self._idle.wait()
+                        executor, self._executor = self._executor, None
+                if executor is not None:
+                        executor.shutdown(wait=wait)
+
+
+# Shared by the web and API servers
+mount_jobs = JobScheduler(Authentication.user_database)
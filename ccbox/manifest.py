@@ -0,0 +1,159 @@
+from typing import Union, List, Dict, Optional, Any, ClassVar, Iterable, Collection, Tuple
+from dataclasses import dataclass, asdict
+import threading
+import hashlib
+import os
+
+
+def hash_bytes(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+def hash_file(path: str) -> str:
+        with open(path, "rb") as f:
+                return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+@dataclass
+class ManifestEntry:
+        """
+        What was uploaded to a blob: its local source, size, mtime and content
+        hash, and for a file stored as content-defined chunks, their digests
+        """
+        path: Optional[str]
+        size: int
+        mtime_ns: int
+        sha256: str
+        chunks: Optional[List[str]] = None
+
+        @classmethod
+        def from_path(cls, path: str) -> "ManifestEntry":
+                stat = os.stat(path)
+                return cls(path=path, size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=hash_file(path))
+
+        @classmethod
+        def from_bytes(cls, data: bytes) -> "ManifestEntry":
+                return cls(path=None, size=len(data), mtime_ns=0, sha256=hash_bytes(data))
+
+        def same_content(self, other: Optional["ManifestEntry"]) -> bool:
+                return other is not None and self.sha256 == other.sha256 and self.chunks == other.chunks
+
+        def content_digests(self) -> List[str]:
+                """The content store entries the blob references"""
+                return self.chunks if self.chunks is not None else [self.sha256]
+
+        def to_dict(self) -> dict:
+                data = asdict(self)
+                if self.chunks is None:
+                        del data["chunks"]
+                return data
+
+        @classmethod
+        def from_dict(cls, data: dict) -> "ManifestEntry":
+                return cls(**data)
+
+
+class Manifest:
+        """
+        Per-drive record of every blob already uploaded, keyed by blob name.
+
+        An upload run collects the blob names the tree still contains (see
+        UploadPipeline.seen); whatever the manifest has beyond them was
+        removed locally. The set belongs to the run, not the manifest, so
+        runs that share a drive cannot clear each other's.
+
+        Several processes may upload to one drive, so the manifest is saved
+        conditionally on the version it was loaded or saved as. When another
+        writer saved it meanwhile, rebase() merges its changes in.
+        """
+
+        def __init__(self, entries: Optional[Dict[str, ManifestEntry]] = None, version: Optional[str] = None):
+                self.entries = entries if entries is not None else {}
+                # Version (ETag) of the stored manifest, and its entries, that these entries are based on
+                self.version = version
+                self._base = dict(self.entries)
+                self._lock = threading.Lock()
+                # Held by whoever is saving the manifest
+                self.saving = threading.Lock()
+
+        @staticmethod
+        def object_name(drive_id: int) -> str:
+                return f'virtual_drive_{drive_id}_manifest.json'
+
+        def is_unchanged(self, blob_name: str, path: str) -> bool:
+                """Cheap check: same local source with the same size and mtime as last upload"""
+                entry = self.entries.get(blob_name)
+                if entry is None or entry.path != path:
+                        return False
+                try:
+                        stat = os.stat(path)
+                except OSError:
+                        return False
+                return entry.size == stat.st_size and entry.mtime_ns == stat.st_mtime_ns
+
+        def has_content(self, blob_name: str, sha256: str) -> bool:
+                entry = self.entries.get(blob_name)
+                return entry is not None and entry.sha256 == sha256
+
+        def record(self, blob_name: str, entry: ManifestEntry) -> None:
+                with self._lock:
+                        self.entries[blob_name] = entry
+
+        def remove(self, blob_name: str) -> None:
+                with self._lock:
+                        self.entries.pop(blob_name, None)
+
+        def unseen(self, seen: Collection[str], prefixes: Optional[Iterable[str]] = None) -> List[str]:
+                """Blob names not in seen, optionally restricted to the given prefixes"""
+                prefixes = tuple(prefixes) if prefixes is not None else ("",)
+                with self._lock:
+                        return [name for name in self.entries
+                                if name not in seen and name.startswith(prefixes)]
+
+        def to_dict(self) -> dict:
+                # Locked so a snapshot can be saved while uploads are still recording
+                with self._lock:
+                        return {name: entry.to_dict() for name, entry in self.entries.items()}
+
+        def snapshot(self) -> Tuple[dict, Dict[str, ManifestEntry]]:
+                """to_dict(), and the entries it was made from, to pass to stored() once it is written"""
+                with self._lock:
+                        return {name: entry.to_dict() for name, entry in self.entries.items()}, dict(self.entries)
+
+        def stored(self, version: str, entries: Dict[str, ManifestEntry]) -> None:
+                """Record that the snapshot of entries was written as version"""
+                with self._lock:
+                        self.version = version
+                        self._base = entries
+
+        def rebase(self, remote: "Manifest") -> List[Tuple[str, Optional[ManifestEntry], Optional[ManifestEntry]]]:
+                """
+                Base these entries on remote, saved by another writer since they were
+                last based on the stored manifest. Blobs the other writer changed are
+                taken from remote unless these entries changed them too, in which case
+                they are kept. Returns (blob name, remote entry, base entry) for those:
+                both writers moved the blob's references away from the base entry and
+                the other writer took one on its entry, which the caller must settle.
+                """
+                with self._lock:
+                        both_changed = []
+                        for name in set(remote.entries) | set(self._base):
+                                theirs, base = remote.entries.get(name), self._base.get(name)
+                                if theirs is base is None or theirs is not None and theirs.same_content(base):
+                                        continue
+                                ours = self.entries.get(name)
+                                if ours is base is None or ours is not None and ours.same_content(base):
+                                        if theirs is None:
+                                                self.entries.pop(name, None)
+                                        else:
+                                                self.entries[name] = theirs
+                                else:
+                                        both_changed.append((name, theirs, base))
+                        self.version = remote.version
+                        self._base = dict(remote.entries)
+                        return both_changed
+
+        @classmethod
+        def from_dict(cls, data: Optional[dict], version: Optional[str] = None) -> "Manifest":
+                if not data:
+                        return cls(version=version)
+                return cls({name: ManifestEntry.from_dict(entry) for name, entry in data.items()}, version)
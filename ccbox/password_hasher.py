@@ -0,0 +1,115 @@
+from typing import Union, List, Dict, Optional, Any, ClassVar, Tuple
+from concurrent.futures import ProcessPoolExecutor, Future
+from itertools import repeat
+import multiprocessing
+import threading
+import secrets
+import hashlib
+import hmac
+import os
+
+from ccbox.user import Credentials
+
+
+def derive_key(password: str, salt: str, params: Dict[str, Any]) -> str:
+        """
+        Hash a password with the algorithm and cost named in params:
+
+            {"algorithm": "scrypt", "n": 16384, "r": 8, "p": 1}
+            {"algorithm": "pbkdf2_sha256", "iterations": 600000}
+            {"algorithm": "sha256"}  (legacy, unsalted users.txt hashes)
+
+        Module-level so it can be shipped to worker processes.
+        """
+        algorithm = params.get("algorithm")
+        if algorithm == "scrypt":
+                n, r, p = params["n"], params["r"], params["p"]
+                return hashlib.scrypt(password.encode('utf-8'), salt=salt.encode('utf-8'), n=n, r=r, p=p,
+                                      maxmem=2 * 128 * n * r * p + 1024 * 1024, dklen=32).hex()
+        if algorithm == "pbkdf2_sha256":
+                return hashlib.pbkdf2_hmac("sha256", password.encode('utf-8'), salt.encode('utf-8'),
+                                           params["iterations"]).hex()
+        if algorithm == "sha256":
+                return hashlib.sha256((salt + password).encode('utf-8')).hexdigest()
+        raise ValueError(f"Unknown password hashing algorithm {algorithm}")
+
+
+class PasswordHasher:
+        """
+        Hashes and verifies passwords with a configurable KDF.
+
+        Hashing runs on a process pool of the given number of workers, so
+        logins use every core instead of contending for the GIL, and threads
+        waiting on a hash do not hold up the rest of the server. The workers
+        are started by a forkserver rather than forked from a server whose
+        threads may hold locks. submit()
+        returns the future directly for callers running on an event loop.
+        With workers=0 hashing runs inline in the calling thread.
+        """
+        DEFAULT_PARAMS: ClassVar[Dict[str, Any]] = {"algorithm": "scrypt", "n": 2 ** 14, "r": 8, "p": 1}
+        SALT_BYTES: ClassVar[int] = 16
+        START_METHOD: ClassVar[str] = "forkserver"
+
+        def __init__(self, params: Optional[Dict[str, Any]] = None, workers: Optional[int] = None):
+                self.params = dict(params or self.DEFAULT_PARAMS)
+                self.workers = (os.cpu_count() or 1) if workers is None else workers
+                self._executor = None
+                self._lock = threading.Lock()
+
+        def _pool(self) -> ProcessPoolExecutor:
+                with self._lock:
+                        if self._executor is None:
+                                self._executor = ProcessPoolExecutor(
+                                        max_workers=self.workers, mp_context=multiprocessing.get_context(self.START_METHOD))
+                        return self._executor
+
+        def submit(self, password: str, salt: str, params: Optional[Dict[str, Any]] = None) -> Future:
+                params = params or self.params
+                if self.workers <= 0 or params.get("algorithm") == "sha256":
+                        future = Future()
+                        try:
+                                future.set_result(derive_key(password, salt, params))
+                        except Exception as e:
+                                future.set_exception(e)
+                        return future
+                return self._pool().submit(derive_key, password, salt, params)
+
+        def hash(self, password: str, salt: str, params: Optional[Dict[str, Any]] = None) -> str:
+                return self.submit(password, salt, params).result()
+
+        def hash_many(self, passwords: List[str], salts: List[str], params: Optional[Dict[str, Any]] = None) -> List[str]:
+                """Hash a batch of passwords, spread over the pool in chunks to keep IPC overhead low"""
+                params = params or self.params
+                if self.workers <= 0 or params.get("algorithm") == "sha256":
+                        return [derive_key(password, salt, params) for password, salt in zip(passwords, salts)]
+                chunksize = max(1, len(passwords) // (self.workers * 4))
+                return list(self._pool().map(derive_key, passwords, salts, repeat(params), chunksize=chunksize))
+
+        def new_credentials_many(self, users: List[Tuple[str, str]]) -> List[Credentials]:
+                """Credentials for a batch of (username, password) pairs, hashed in parallel"""
+                salts = [secrets.token_hex(self.SALT_BYTES) for _ in users]
+                hashes = self.hash_many([password for _, password in users], salts)
+                return [Credentials(username=username, salt=salt, hash=hashed, params=dict(self.params))
+                        for (username, _), salt, hashed in zip(users, salts, hashes)]
+
+        def new_credentials(self, username: str, password: str) -> Credentials:
+                salt = secrets.token_hex(self.SALT_BYTES)
+                return Credentials(username=username, salt=salt, hash=self.hash(password, salt), params=dict(self.params))
+
+        def verify(self, password: str, credentials: Credentials) -> bool:
+                return hmac.compare_digest(self.hash(password, credentials.salt, credentials.params), credentials.hash)
+
+        def needs_rehash(self, credentials: Credentials) -> bool:
+                """True when the credentials were hashed with other parameters than the current ones"""
+                return credentials.params != self.params
+
+        def reset(self) -> None:
+                """Forget the pool without shutting it down, e.g. in a forked worker: its processes belong to the parent"""
+                self._executor = None
+                self._lock = threading.Lock()
+
+        def shutdown(self) -> None:
+                with self._lock:
+                        if self._executor is not None:
+                                self._executor.shutdown(wait=True)
+                                self._executor = None
@@ -0,0 +1,193 @@
+"""
+Framed variant of the API server protocol, for scripted clients.
+
+A client switches a connection over by sending the text command "frames";
+the server answers with FRAMES_ACK and from then on both sides exchange
+frames:
+
+    u32 payload length, u32 request id, payload (UTF-8 command or response)
+
+Integers are big-endian. Requests can be pipelined: the server runs them
+concurrently and answers each as soon as it is done, tagged with the id of
+the request it answers, so responses may arrive out of order.
+
+A response may span several frames, sent as it is produced: the high bit of
+the length (FLAG_MORE) is set on every frame of it but the last. Frames of
+different responses can be interleaved. Requests are always single frames.
+"""
+from typing import Union, List, Dict, Optional, Any, ClassVar, Iterable, Iterator, Tuple
+from collections import deque
+from itertools import count
+import asyncio
+import codecs
+import socket
+import struct
+
+FRAME_HEADER = struct.Struct("!II")
+FRAMES_COMMAND = "frames"
+FRAMES_ACK = b"Framed protocol enabled\n"
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+# Set in the length field of every frame of a response but its last
+FLAG_MORE = 0x80000000
+
+
+def encode_frame(request_id: int, payload: Union[str, bytes], more: bool = False) -> bytes:
+        if isinstance(payload, str):
+                payload = payload.encode('utf-8')
+        if len(payload) > MAX_FRAME_SIZE:
+                raise ValueError(f"Frame of {len(payload)} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+        return FRAME_HEADER.pack(len(payload) | (FLAG_MORE if more else 0), request_id) + payload
+
+
+def encode_frames(request_id: int, payload: Union[str, bytes], more: bool = False) -> Iterator[bytes]:
+        """Frames of one piece of a response, split at MAX_FRAME_SIZE; more if pieces follow it"""
+        if isinstance(payload, str):
+                payload = payload.encode('utf-8')
+        for start in range(0, max(len(payload), 1), MAX_FRAME_SIZE):
+                end = start + MAX_FRAME_SIZE
+                yield encode_frame(request_id, payload[start:end], more or end < len(payload))
+
+
+async def read_frame(reader: asyncio.StreamReader, max_size: int = MAX_FRAME_SIZE) -> Optional[Tuple[int, bytes]]:
+        """Read one frame; None on a clean EOF between frames"""
+        try:
+                header = await reader.readexactly(FRAME_HEADER.size)
+        except asyncio.IncompleteReadError as e:
+                if not e.partial:
+                        return None
+                raise
+        length, request_id = FRAME_HEADER.unpack(header)
+        # Requests are never continued, so a set FLAG_MORE is simply too long
+        if length > max_size:
+                raise ValueError(f"Frame of {length} bytes exceeds the {max_size} byte limit")
+        return request_id, await reader.readexactly(length)
+
+
+class FramedClient:
+        """
+        Blocking client for the framed protocol over one persistent connection.
+        stream() and call_many() keep a window of commands in flight, so a batch costs
+        about one round trip per window instead of one per command. iter_response()
+        and stream_pieces() hand out responses frame by frame as they arrive, so
+        large ones need not fit in memory.
+        """
+
+        def __init__(self, host: str = "localhost", port: int = 9999, timeout: Optional[float] = None):
+                self._sock = socket.create_connection((host, port), timeout=timeout)
+                self._file = self._sock.makefile("rb")
+                self._ids = count(1)
+                # Frames received for responses not being read yet: request id -> (payload, more)
+                self._frames: Dict[int, deque] = {}
+                self._sock.sendall(f"{FRAMES_COMMAND}\n".encode('utf-8'))
+                # Skip the text welcome up to the acknowledgement
+                received = b""
+                while not received.endswith(FRAMES_ACK):
+                        byte = self._file.read(1)
+                        if not byte:
+                                raise ConnectionError("Server closed the connection before enabling frames")
+                        received += byte
+
+        def send(self, command: str) -> int:
+                request_id = next(self._ids)
+                self._sock.sendall(encode_frame(request_id, command))
+                return request_id
+
+        def receive_frame(self) -> Tuple[int, bytes, bool]:
+                """The next frame: request id, payload and whether more frames of the response follow"""
+                header = self._file.read(FRAME_HEADER.size)
+                if len(header) < FRAME_HEADER.size:
+                        raise ConnectionError("Server closed the connection")
+                length, request_id = FRAME_HEADER.unpack(header)
+                more = bool(length & FLAG_MORE)
+                length &= ~FLAG_MORE
+                payload = self._file.read(length)
+                if len(payload) < length:
+                        raise ConnectionError("Server closed the connection mid-frame")
+                return request_id, payload, more
+
+        def receive(self) -> Tuple[int, str]:
+                """The next response to be complete, whichever request it answers"""
+                while True:
+                        request_id, payload, more = self.receive_frame()
+                        self._frames.setdefault(request_id, deque()).append((payload, more))
+                        if not more:
+                                return request_id, self.wait(request_id)
+
+        def pieces(self, request_id: int) -> Iterator[Tuple[str, bool]]:
+                """
+                The response to one request as (text, last) pieces, one per frame as it
+                arrives; frames of other responses that come in meanwhile are kept for later.
+                """
+                decoder = codecs.getincrementaldecoder('utf-8')()
+                while True:
+                        frames = self._frames.get(request_id)
+                        if frames:
+                                payload, more = frames.popleft()
+                        else:
+                                received_id, payload, more = self.receive_frame()
+                                if received_id != request_id:
+                                        self._frames.setdefault(received_id, deque()).append((payload, more))
+                                        continue
+                        # A character may be split across frames
+                        text = decoder.decode(payload, final=not more)
+                        if not more:
+                                self._frames.pop(request_id, None)
+                                yield text, True
+                                return
+                        yield text, False
+
+        def iter_response(self, request_id: int) -> Iterator[str]:
+                for text, _ in self.pieces(request_id):
+                        if text:
+                                yield text
+
+        def wait(self, request_id: int) -> str:
+                """Response to one request; responses to others that arrive first are kept for later"""
+                return "".join(self.iter_response(request_id))
+
+        def call(self, command: str) -> str:
+                return self.wait(self.send(command))
+
+        def stream(self, commands: Iterable[str], window: int = 32) -> Iterator[str]:
+                """
+                Yield responses in the order of the commands as they come in. At most
+                window requests are outstanding at once, which keeps both sides' socket
+                buffers from filling up while neither is reading.
+                """
+                response = []
+                for text, last in self.stream_pieces(commands, window):
+                        response.append(text)
+                        if last:
+                                yield "".join(response)
+                                response = []
+
+        def stream_pieces(self, commands: Iterable[str], window: int = 32) -> Iterator[Tuple[str, bool]]:
+                """
+                Like stream(), but each response comes as (text, last) pieces as its frames
+                arrive (see pieces()), so no response is held in memory whole.
+                """
+                request_ids = deque()
+                for command in commands:
+                        if len(request_ids) >= window:
+                                yield from self.pieces(request_ids.popleft())
+                        request_ids.append(self.send(command))
+                while request_ids:
+                        yield from self.pieces(request_ids.popleft())
+
+        def call_many(self, commands: Iterable[str], window: int = 32) -> List[str]:
+                """Responses in the order of the commands"""
+                return list(self.stream(commands, window))
+
+        def close(self) -> None:
+                try:
+                        self._sock.shutdown(socket.SHUT_WR)
+                except OSError:
+                        pass
+                self._file.close()
+                self._sock.close()
+
+        def __enter__(self) -> "FramedClient":
+                return self
+
+        def __exit__(self, exc_type, exc_value, traceback) -> None:
+                self.close()
@@ -0,0 +1,67 @@
+from typing import Union, List, Dict, Optional, Any, ClassVar, Callable, FrozenSet
+from dataclasses import dataclass, field
+import random
+import time
+
+from azure.core.exceptions import HttpResponseError, ServiceRequestError, ServiceResponseError
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+        """
+        When and how long to wait before trying a failed storage call again.
+
+        Delays grow exponentially from base_delay up to max_delay with "full"
+        jitter (a uniform pick between 0 and the exponential delay), so clients
+        throttled together do not come back together. A Retry-After sent with a
+        throttling response is honoured when it asks for longer.
+        """
+        max_attempts: int = 5
+        base_delay: float = 0.5
+        max_delay: float = 30.0
+        multiplier: float = 2.0
+        jitter: bool = True
+        retryable_statuses: FrozenSet[int] = frozenset({408, 429, 500, 502, 503, 504})
+
+        def is_retryable(self, error: BaseException) -> bool:
+                if isinstance(error, HttpResponseError):
+                        return error.status_code in self.retryable_statuses
+                # Connection resets and timeouts on the way to or from the service
+                return isinstance(error, (ServiceRequestError, ServiceResponseError, ConnectionError, TimeoutError))
+
+        def should_retry(self, error: BaseException, attempt: int) -> bool:
+                """attempt is the number of the attempt that just failed, starting at 1"""
+                return attempt < self.max_attempts and self.is_retryable(error)
+
+        def delay(self, attempt: int, error: Optional[BaseException] = None) -> float:
+                delay = min(self.max_delay, self.base_delay * self.multiplier ** (attempt - 1))
+                if self.jitter:
+                        delay = random.uniform(0, delay)
+                retry_after = _retry_after(error)
+                return max(delay, min(retry_after, self.max_delay)) if retry_after else delay
+
+        def call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+                """Call func, sleeping between attempts; for one-off calls outside the upload pipeline"""
+                attempt = 1
+                while True:
+                        try:
+                                return func(*args, **kwargs)
+                        except Exception as e:
+                                if not self.should_retry(e, attempt):
+                                        raise
+                                time.sleep(self.delay(attempt, e))
+                                attempt += 1
+
+
+NO_RETRY = RetryPolicy(max_attempts=1)
+
+
+def _retry_after(error: Optional[BaseException]) -> Optional[float]:
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None)
+        if not headers:
+                return None
+        try:
+                return float(headers.get("Retry-After"))
+        except (TypeError, ValueError):
+                return None
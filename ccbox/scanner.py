@@ -0,0 +1,84 @@
+from typing import Union, List, Dict, Optional, Any, Tuple
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import os
+
+
+# (name, path, size, mtime_ns)
+ScannedFile = Tuple[str, str, int, int]
+
+
+@dataclass
+class ScannedDirectory:
+        """Result of scanning one directory: its files with their metadata and its subdirectories"""
+        name: str
+        path: str
+        files: List[ScannedFile] = field(default_factory=list)
+        subdirectories: List["ScannedDirectory"] = field(default_factory=list)
+
+        def file_count(self) -> int:
+                count = 0
+                stack = [self]
+                while stack:
+                        directory = stack.pop()
+                        count += len(directory.files)
+                        stack.extend(directory.subdirectories)
+                return count
+
+
+def scan_entries(dir_path: str) -> Tuple[List[ScannedFile], List[Tuple[str, str]]]:
+        """
+        List a single directory with os.scandir. Entry types come from the
+        directory listing itself, so only regular files cost a stat call.
+        """
+        files = []
+        subdirectories = []
+        with os.scandir(dir_path) as entries:
+                for entry in entries:
+                        try:
+                                if entry.is_dir():
+                                        subdirectories.append((entry.name, entry.path))
+                                elif entry.is_file():
+                                        stat = entry.stat()
+                                        files.append((entry.name, entry.path, stat.st_size, stat.st_mtime_ns))
+                        except OSError:
+                                # Vanished or unreadable entries are skipped, as os.path.isfile would
+                                continue
+        return files, subdirectories
+
+
+def scan_tree(dir_path: str, workers: int = 0) -> ScannedDirectory:
+        """
+        Scan a directory tree. With workers > 1 subdirectories are listed
+        concurrently on a thread pool, which pays off on network filesystems
+        where each listing is a round trip.
+        """
+        root = ScannedDirectory(os.path.basename(dir_path), dir_path)
+        root.files, subdirectories = scan_entries(dir_path)
+        pending = [(root, name, path) for name, path in subdirectories]
+
+        if workers <= 1:
+                while pending:
+                        parent, name, path = pending.pop()
+                        pending.extend(_scan_child(parent, name, path))
+                return root
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ccbox-scan") as executor:
+                futures = {executor.submit(_scan_child, *item) for item in pending}
+                while futures:
+                        done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                        for future in done:
+                                for item in future.result():
+                                        futures.add(executor.submit(_scan_child, *item))
+        return root
+
+
+def _scan_child(parent: ScannedDirectory, name: str, path: str) -> List[Tuple[ScannedDirectory, str, str]]:
+        directory = ScannedDirectory(name, path)
+        try:
+                directory.files, subdirectories = scan_entries(path)
+        except OSError:
+                subdirectories = []
+        # list.append is atomic, so worker threads can attach children concurrently
+        parent.subdirectories.append(directory)
+        return [(directory, child_name, child_path) for child_name, child_path in subdirectories]
@@ -0,0 +1,210 @@
+"""
+Binary snapshot format for virtual drives.
+
+    header   magic "CCBX", u16 version, u16 flags, u32 info length
+    info     JSON object with drive-level fields (_id, storage_handler, ...)
+    index    u32 section count, then (u64 offset, u64 length) per section
+    sections one body per section, each zlib-compressed when FLAG_ZLIB is set
+
+A section body is self-contained:
+
+    u32 string count, u32 string table size, u32 hash count, u32 node count
+    string table: NUL-separated UTF-8 strings
+    hash table: 32-byte SHA-256 digests
+    node array: fixed-size NODE records in pre-order
+
+Section 0 holds the drive root and its direct children. Every top-level
+folder is written as a KIND_SECTION node pointing at its own section, so a
+reader can materialize the first level from a couple of range reads and
+decode each subtree only when it is first accessed.
+
+Every node is written exactly once and points at its parent by index, so a
+section is rebuilt in a single pass over its node array. Strings (names,
+directory prefixes, metadata) are interned, so siblings share the
+directory part of their local path.
+
+Files stored as content-defined chunks (see ccbox.chunking) are followed
+by one KIND_CHUNK node per chunk, in order, whose parent is the file node.
+
+Version 1 snapshots have no index: the body directly follows the info and
+is read as section 0. Version 2 snapshots have no KIND_CHUNK nodes.
+"""
+from typing import Union, List, Dict, Optional, Any, ClassVar, Iterator, Tuple, Callable
+import struct
+import json
+import zlib
+
+MAGIC = b"CCBX"
+VERSION = 3
+READABLE_VERSIONS = (1, 2, VERSION)
+FLAG_ZLIB = 0x1
+
+KIND_ROOT = 0
+KIND_FOLDER = 1
+KIND_FILE = 2
+KIND_STRING = 3
+# A top-level folder whose subtree lives in the section given by the "path" field
+KIND_SECTION = 4
+# One chunk of a file stored as chunks, in order: "digest" is its hash; "size" is unused
+# (0), chunk lengths are kept by the content store
+KIND_CHUNK = 5
+
+NO_PARENT = 0xFFFFFFFF
+
+# For files, "dir" holds the local path minus the file name, "path" is 0 unless
+# the path does not end in the name (then it is the full path's index + 1), and "blob"
+# is 0 for no blob name, 1 when derived from the folder path, else index + 2.
+BLOB_NONE = 0
+BLOB_DERIVED = 1
+
+HEADER = struct.Struct("<4sHHI")
+SECTION_COUNT = struct.Struct("<I")
+SECTION_ENTRY = struct.Struct("<QQ")
+COUNTS = struct.Struct("<IIII")
+# kind, parent, name, dir/metadata, path, blob, digest, size, mtime_ns
+NODE = struct.Struct("<BIIIIIIQq")
+
+# How much of a remote snapshot to fetch up front: enough for the header,
+# info and index of most drives, and usually the root section too.
+PREFETCH_SIZE = 64 * 1024
+
+
+def is_snapshot(data: bytes) -> bool:
+        return data[:len(MAGIC)] == MAGIC
+
+
+class SectionWriter:
+        """Accumulates interned strings, digests and node records for one section"""
+
+        def __init__(self):
+                self._strings = []
+                self._string_index = {}
+                self._hashes = []
+                self._hash_index = {}
+                self._nodes = bytearray()
+                self.node_count = 0
+
+        def intern(self, value: str) -> int:
+                index = self._string_index.get(value)
+                if index is None:
+                        if "\x00" in value:
+                                raise ValueError("Snapshot strings cannot contain NUL characters")
+                        index = len(self._strings)
+                        self._strings.append(value)
+                        self._string_index[value] = index
+                return index
+
+        def intern_hash(self, sha256: Optional[str]) -> int:
+                """Returns 0 for no hash, otherwise the digest's index + 1"""
+                if sha256 is None:
+                        return 0
+                index = self._hash_index.get(sha256)
+                if index is None:
+                        index = len(self._hashes)
+                        self._hashes.append(bytes.fromhex(sha256))
+                        self._hash_index[sha256] = index
+                return index + 1
+
+        def add_node(self, kind: int, parent: int, name: int, dir_or_metadata: int = 0, path: int = 0,
+                     blob: int = BLOB_NONE, digest: int = 0, size: int = 0, mtime_ns: int = 0) -> int:
+                self._nodes += NODE.pack(kind, parent, name, dir_or_metadata, path, blob, digest, size, mtime_ns)
+                self.node_count += 1
+                return self.node_count - 1
+
+        def to_bytes(self, compress: bool = True) -> bytes:
+                strings = "\x00".join(self._strings).encode('utf-8')
+                body = b"".join([
+                        COUNTS.pack(len(self._strings), len(strings), len(self._hashes), self.node_count),
+                        strings,
+                        b"".join(self._hashes),
+                        bytes(self._nodes)
+                ])
+                return zlib.compress(body, 1) if compress else body
+
+
+class SectionReader:
+        """Parses one section body"""
+
+        def __init__(self, body: bytes, compressed: bool):
+                body = memoryview(zlib.decompress(body) if compressed else body)
+                string_count, strings_size, hash_count, node_count = COUNTS.unpack_from(body)
+                offset = COUNTS.size
+                strings = bytes(body[offset:offset + strings_size]).decode('utf-8')
+                self.strings = strings.split("\x00") if string_count else []
+                offset += strings_size
+                hashes = body[offset:offset + 32 * hash_count]
+                self.hashes = [hashes[i:i + 32].hex() for i in range(0, len(hashes), 32)]
+                offset += 32 * hash_count
+                self._nodes = body[offset:offset + NODE.size * node_count]
+                self.node_count = node_count
+
+        def nodes(self) -> Iterator[Tuple[int, int, int, int, int, int, int, int, int]]:
+                return NODE.iter_unpack(self._nodes)
+
+
+class SnapshotWriter:
+        """Builds a snapshot out of sections; section 0 is created up front for the root"""
+
+        def __init__(self, info: dict):
+                self.info = info
+                self.sections = [SectionWriter()]
+
+        def new_section(self) -> int:
+                self.sections.append(SectionWriter())
+                return len(self.sections) - 1
+
+        def to_bytes(self, compress: bool = True) -> bytes:
+                bodies = [section.to_bytes(compress) for section in self.sections]
+                info = json.dumps(self.info).encode('utf-8')
+                flags = FLAG_ZLIB if compress else 0
+                offset = HEADER.size + len(info) + SECTION_COUNT.size + SECTION_ENTRY.size * len(bodies)
+                index = bytearray(SECTION_COUNT.pack(len(bodies)))
+                for body in bodies:
+                        index += SECTION_ENTRY.pack(offset, len(body))
+                        offset += len(body)
+                return b"".join([HEADER.pack(MAGIC, VERSION, flags, len(info)), info, bytes(index)] + bodies)
+
+
+class SnapshotReader:
+        """
+        Reads a snapshot from its first bytes, fetching anything beyond them on
+        demand through fetch(offset, length), where a length of None means
+        "to the end". Pass the whole snapshot and no fetch to read it in memory.
+        """
+
+        def __init__(self, prefix: bytes, fetch: Optional[Callable[[int, Optional[int]], bytes]] = None):
+                self._prefix = prefix
+                self._fetch = fetch
+                if len(prefix) < HEADER.size or not is_snapshot(prefix):
+                        raise ValueError("Not a virtual drive snapshot")
+                magic, self.version, flags, info_length = HEADER.unpack_from(prefix)
+                if self.version not in READABLE_VERSIONS:
+                        raise ValueError(f"Unsupported snapshot version {self.version}")
+                self.compressed = bool(flags & FLAG_ZLIB)
+                offset = HEADER.size
+                self.info = json.loads(self._read(offset, info_length))
+                offset += info_length
+
+                if self.version == 1:
+                        self._sections = [(offset, None)]
+                        return
+                section_count, = SECTION_COUNT.unpack(self._read(offset, SECTION_COUNT.size))
+                offset += SECTION_COUNT.size
+                index = self._read(offset, SECTION_ENTRY.size * section_count)
+                self._sections = list(SECTION_ENTRY.iter_unpack(index))
+
+        @property
+        def section_count(self) -> int:
+                return len(self._sections)
+
+        def _read(self, offset: int, length: Optional[int]) -> bytes:
+                end = len(self._prefix) if length is None else offset + length
+                if end <= len(self._prefix) and (length is not None or self._fetch is None):
+                        return self._prefix[offset:end]
+                if self._fetch is None:
+                        raise ValueError("Truncated virtual drive snapshot")
+                return self._fetch(offset, length)
+
+        def section(self, number: int) -> SectionReader:
+                offset, length = self._sections[number]
+                return SectionReader(self._read(offset, length), self.compressed)
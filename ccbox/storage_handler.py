@@ -1,13 +1,39 @@
 from abc import ABC, abstractmethod
-from typing import Union, List, Dict, Optional, Any, ClassVar, Callable
+from typing import Union, List, Dict, Optional, Any, ClassVar, Callable, BinaryIO, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import wraps
+from urllib.parse import quote
+from itertools import count
+import threading
+import fcntl
+import hashlib
+import base64
+import shutil
 import json
 import time
+import os
 
-from azure.storage.blob import BlobServiceClient
+from azure.storage.blob import BlobServiceClient, BlobBlock
 from azure.identity import DefaultAzureCredential
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotFoundError, ResourceExistsError, ResourceModifiedError
+from azure.core.pipeline.transport import RequestsTransport
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+from ccbox.retry import RetryPolicy
+
+
+class VersionConflict(Exception):
+        """A conditional write found the blob changed since the version it was based on"""
 
 
 class StorageHandler(ABC):
+        DEFAULT_BLOCK_SIZE: ClassVar[int] = 4 * 1024 * 1024
+        DEFAULT_BLOCK_CONCURRENCY: ClassVar[int] = 4
+        # Written to to_dict() so storage_handler_from_dict() can pick the class back
+        TYPE: ClassVar[str] = "azure"
     
         @abstractmethod
         def upload_json(self, json_data: Dict, blob_name: str):
@@ -17,10 +43,74 @@ class StorageHandler(ABC):
         def download_json(self, blob_name: str) -> Dict:
                 pass
 
+        @abstractmethod
+        def download_bytes(self, blob_name: str) -> Optional[bytes]:
+                """Download a blob from the handler's container, or None if it does not exist"""
+                pass
+
+        @abstractmethod
+        def download_range(self, blob_name: str, offset: int, length: Optional[int] = None) -> Optional[bytes]:
+                """Download length bytes of a blob starting at offset (to the end if length is None), or None if it does not exist"""
+                pass
+
+        @abstractmethod
+        def blob_version(self, blob_name: str) -> Optional[str]:
+                """The current version (ETag) of a blob, or None if it does not exist"""
+                pass
+
+        @abstractmethod
+        def download_range_versioned(self, blob_name: str, offset: int, length: Optional[int] = None,
+                                     version: Optional[str] = None) -> Tuple[Optional[bytes], Optional[str]]:
+                """
+                download_range, plus the version (ETag) of the blob read. With a version,
+                only that version is read: VersionConflict is raised if the blob changed.
+                """
+                pass
+
         @abstractmethod
         def upload_from_bytes(self, container_name: str, blob_name: str, data: bytes) -> None:
                 pass
+
+        @abstractmethod
+        def upload_from_stream(self, container_name: str, blob_name: str, stream: BinaryIO,
+                               block_size: int = DEFAULT_BLOCK_SIZE,
+                               max_concurrency: int = DEFAULT_BLOCK_CONCURRENCY) -> int:
+                """
+                Upload a blob from a binary stream, block_size bytes at a time.
+                At most max_concurrency blocks are held in memory at once.
+                Returns the number of bytes uploaded.
+                """
+                pass
         
+        @abstractmethod
+        def delete_blob(self, container_name: str, blob_name: str) -> None:
+                pass
+
+        @abstractmethod
+        def download_json_versioned(self, blob_name: str) -> Tuple[Optional[dict], Optional[str]]:
+                """
+                A JSON blob and its version (ETag), or (None, None) if it does not exist.
+                Any other error is raised rather than read as a missing blob.
+                """
+                pass
+
+        @abstractmethod
+        def upload_bytes_versioned(self, data: bytes, blob_name: str, version: Optional[str]) -> str:
+                """
+                Write a blob only if it is still at version (with None, only if it does
+                not exist), else raise VersionConflict. Returns the new version.
+                """
+                pass
+
+        def upload_json_versioned(self, json_data: Dict, blob_name: str, version: Optional[str]) -> str:
+                """upload_bytes_versioned for a JSON blob"""
+                return self.upload_bytes_versioned(json.dumps(json_data).encode('utf-8'), blob_name, version)
+
+        @abstractmethod
+        def delete_blob_if_unmodified(self, container_name: str, blob_name: str, since: float) -> bool:
+                """Delete a blob unless it was written after since (a time.time()); False if it was kept"""
+                pass
+
         @abstractmethod
         def to_dict(self) -> Dict:
                 pass
@@ -32,46 +122,249 @@ class StorageHandler(ABC):
 
 
 
+class AzureClientRegistry:
+        """
+        Process-wide Azure clients, so building a handler per request is cheap.
+        One credential is shared by every client, so the credential chain is
+        probed once and its tokens are cached and refreshed in one place. There
+        is one BlobServiceClient per account URL, each with a connection pool
+        large enough for the upload threads. Containers that were created, or
+        found to exist already, are remembered so create_container is called
+        once per container. The SDK's own retries are turned off: they sleep in
+        the calling thread, while ccbox.retry.RetryPolicy waits off the upload
+        workers and reports what it gave up on. Calls outside the upload
+        pipeline (reads, deletes, staging a block, creating a container) are
+        retried by AzureStorageHandler and here instead.
+
+        Clients must not be carried across a fork: call reset() in the child.
+        """
+        POOL_SIZE: ClassVar[int] = 64
+        RETRY_POLICY: ClassVar[RetryPolicy] = RetryPolicy()
+
+        def __init__(self, pool_size: int = POOL_SIZE):
+                self.pool_size = pool_size
+                self._lock = threading.Lock()
+                self._credential = None
+                self._clients: Dict[str, BlobServiceClient] = {}
+                self._containers: set = set()
+
+        def credential(self):
+                with self._lock:
+                        if self._credential is None:
+                                self._credential = DefaultAzureCredential()
+                        return self._credential
+
+        def _transport(self) -> RequestsTransport:
+                session = Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                return RequestsTransport(session=session, session_owner=False)
+
+        def client(self, account_url: str) -> BlobServiceClient:
+                credential = self.credential()
+                with self._lock:
+                        client = self._clients.get(account_url)
+                        if client is None:
+                                client = BlobServiceClient(account_url=account_url, credential=credential,
+                                                           transport=self._transport(), retry_total=0)
+                                self._clients[account_url] = client
+                        return client
+
+        def ensure_container(self, account_url: str, container_name: str) -> None:
+                key = (account_url, container_name)
+                if key in self._containers:
+                        return
+                try:
+                        self.RETRY_POLICY.call(self.client(account_url).create_container, name=container_name)
+                except ResourceExistsError:
+                        pass
+                except Exception as e:
+                        # Not remembered, so the next handler for this container tries again
+                        print(f'Error: {e}')
+                        return
+                with self._lock:
+                        self._containers.add(key)
+
+        def forget_container(self, account_url: str, container_name: str) -> None:
+                with self._lock:
+                        self._containers.discard((account_url, container_name))
+
+        def reset(self) -> None:
+                """Drop every client, e.g. in a forked worker or between tests"""
+                with self._lock:
+                        self._credential = None
+                        self._clients.clear()
+                        self._containers.clear()
+
+
+azure_clients = AzureClientRegistry()
+
+
+def retried(method: Callable) -> Callable:
+        """Retry transient failures of a handler method with the handler's RETRY_POLICY"""
+        @wraps(method)
+        def call(self, *args, **kwargs):
+                return self.RETRY_POLICY.call(method, self, *args, **kwargs)
+        return call
+
+
 class AzureStorageHandler(StorageHandler):
+        """
+        Blobs in an Azure Storage container. Uploads are retried by the caller
+        (the upload pipeline or Virtual_Drive.RETRY_POLICY); reads and deletes by
+        RETRY_POLICY here, and the blocks of a streamed upload one at a time by
+        BLOCK_RETRY_POLICY, so one failed block does not restart the whole file.
+        """
+        RETRY_POLICY: ClassVar[RetryPolicy] = RetryPolicy()
+        BLOCK_RETRY_POLICY: ClassVar[RetryPolicy] = RetryPolicy(max_attempts=3, base_delay=0.2, max_delay=5.0)
+
         def __init__(self, account_url: str, container_name: str):
                 self.account_url = account_url
                 self.container_name = container_name
-                credential = DefaultAzureCredential()
-                self.blob_service_client = BlobServiceClient(account_url=account_url, credential=credential)
-                self.create_blob_container(self.blob_service_client, container_name)
+                self.blob_service_client = azure_clients.client(account_url)
+                azure_clients.ensure_container(account_url, container_name)
                 self.container_client = self.blob_service_client.get_container_client(container_name)
-                self.container_name = container_name
-        
-        def create_blob_container(self, blob_service_client: BlobServiceClient, container_name: str):
-                try:
-                        container_client = blob_service_client.create_container(name=container_name)
-                except Exception as e:
-                        print(f'Error: {e}')
 
         
         def upload_from_bytes(self, container_name: str, blob_name: str, data: bytes) -> None:
+                # Errors are raised for the caller's RetryPolicy to classify
+                blob_client = self.blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+                blob_client.upload_blob(data, overwrite=True)
+
+        def upload_from_stream(self, container_name: str, blob_name: str, stream: BinaryIO,
+                               block_size: int = StorageHandler.DEFAULT_BLOCK_SIZE,
+                               max_concurrency: int = StorageHandler.DEFAULT_BLOCK_CONCURRENCY) -> int:
+                blob_client = self.blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+                # A slot is taken before a block is read and given back once it is staged,
+                # so no more than max_concurrency blocks are ever buffered.
+                slots = threading.BoundedSemaphore(max_concurrency)
+                failed = threading.Event()
+
+                def block_staged(future):
+                        if future.exception():
+                                failed.set()
+                        slots.release()
+
+                block_list = []
+                futures = []
+                total = 0
+                with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                        while not failed.is_set():
+                                slots.acquire()
+                                chunk = stream.read(block_size)
+                                if not chunk:
+                                        slots.release()
+                                        break
+                                block_id = base64.b64encode(f"{len(block_list):08d}".encode('utf-8')).decode('utf-8')
+                                block_list.append(BlobBlock(block_id=block_id))
+                                total += len(chunk)
+                                future = executor.submit(self.BLOCK_RETRY_POLICY.call, blob_client.stage_block, block_id, chunk)
+                                future.add_done_callback(block_staged)
+                                futures.append(future)
+                                del chunk
+                for future in futures:
+                        future.result()
+                blob_client.commit_block_list(block_list)
+                return total
+                
+
+        @retried
+        def delete_blob(self, container_name: str, blob_name: str) -> None:
                 try:
                         blob_client = self.blob_service_client.get_blob_client(container=container_name, blob=blob_name)
-                        blob_client.upload_blob(data, overwrite=True)
-                except Exception as e:
-                        time.sleep(1)
-                
+                        blob_client.delete_blob()
+                except ResourceNotFoundError:
+                        pass
+
+        @retried
+        def delete_blob_if_unmodified(self, container_name: str, blob_name: str, since: float) -> bool:
+                blob_client = self.blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+                try:
+                        blob_client.delete_blob(if_unmodified_since=datetime.fromtimestamp(since, timezone.utc))
+                except ResourceNotFoundError:
+                        pass
+                except ResourceModifiedError:
+                        return False
+                return True
 
         def upload_json(self, json_data: Dict, blob_name: str) -> None:
                 blob_client = self.container_client.get_blob_client(blob_name)
                 blob_client.upload_blob(json.dumps(json_data), overwrite=True)
                 print(f"Uploaded {blob_name} to Azure Storage")
 
+        @retried
         def download_json(self, blob_name: str) -> dict:
+                # Only a missing blob reads as None; a failed read must not look like an empty one
                 try:
                         blob_client = self.container_client.get_blob_client(blob_name)
                         download_stream = blob_client.download_blob()
                         json_data = json.loads(download_stream.readall())
                         print(f"Downloaded {blob_name} from Azure Storage")
                         return json_data
-                except Exception as e:
-                        print(f'Error: {e}')
+                except ResourceNotFoundError:
+                        return None
+
+        @retried
+        def download_json_versioned(self, blob_name: str) -> Tuple[Optional[dict], Optional[str]]:
+                try:
+                        download_stream = self.container_client.get_blob_client(blob_name).download_blob()
+                        return json.loads(download_stream.readall()), download_stream.properties.etag
+                except ResourceNotFoundError:
+                        return None, None
+
+        def upload_bytes_versioned(self, data: bytes, blob_name: str, version: Optional[str]) -> str:
+                blob_client = self.container_client.get_blob_client(blob_name)
+                try:
+                        if version is None:
+                                result = blob_client.upload_blob(data, overwrite=False)
+                        else:
+                                result = blob_client.upload_blob(data, overwrite=True, etag=version,
+                                                                 match_condition=MatchConditions.IfNotModified)
+                except (ResourceExistsError, ResourceModifiedError) as e:
+                        raise VersionConflict(f"{blob_name} changed since version {version}") from e
+                return result["etag"]
         
+        @retried
+        def download_bytes(self, blob_name: str) -> Optional[bytes]:
+                try:
+                        blob_client = self.container_client.get_blob_client(blob_name)
+                        data = blob_client.download_blob().readall()
+                        print(f"Downloaded {blob_name} from Azure Storage")
+                        return data
+                except ResourceNotFoundError:
+                        return None
+
+        @retried
+        def download_range(self, blob_name: str, offset: int, length: Optional[int] = None) -> Optional[bytes]:
+                try:
+                        blob_client = self.container_client.get_blob_client(blob_name)
+                        return blob_client.download_blob(offset=offset, length=length).readall()
+                except ResourceNotFoundError:
+                        return None
+
+        @retried
+        def blob_version(self, blob_name: str) -> Optional[str]:
+                try:
+                        return self.container_client.get_blob_client(blob_name).get_blob_properties().etag
+                except ResourceNotFoundError:
+                        return None
+
+        @retried
+        def download_range_versioned(self, blob_name: str, offset: int, length: Optional[int] = None,
+                                     version: Optional[str] = None) -> Tuple[Optional[bytes], Optional[str]]:
+                blob_client = self.container_client.get_blob_client(blob_name)
+                conditions = {"etag": version, "match_condition": MatchConditions.IfNotModified} if version else {}
+                try:
+                        download_stream = blob_client.download_blob(offset=offset, length=length, **conditions)
+                        return download_stream.readall(), download_stream.properties.etag
+                except ResourceNotFoundError as e:
+                        if version:
+                                raise VersionConflict(f"{blob_name} was deleted since version {version}") from e
+                        return None, None
+                except ResourceModifiedError as e:
+                        raise VersionConflict(f"{blob_name} changed since version {version}") from e
+
         def to_dict(self) -> dict:
                 return {
                         "account_url" : self.account_url,
@@ -81,4 +374,373 @@ class AzureStorageHandler(StorageHandler):
         @classmethod
         def from_dict(cls, data:dict) -> "StorageHandler":
                 return cls(data["account_url"], data["container_name"])
-        
\ No newline at end of file
+
+
+class LocalFSStorageHandler(StorageHandler):
+        """
+        Stores blobs as files under root/<container>/, for tests, benchmarks and
+        single-machine setups. Blob names are percent-encoded into one flat file
+        name each, so folder marker blobs ("a/b/") and nested names cannot clash.
+
+        Every write goes to a temporary file that is renamed over the blob, so
+        readers see the old or the new blob, never part of one. With fsync_batch
+        set, written blobs are also fsynced: after every write for 1, or every
+        fsync_batch writes (and on flush()) otherwise, which trades the window
+        of writes a crash may lose for far fewer syncs.
+        """
+        TYPE: ClassVar[str] = "local"
+        # Longer encoded names are replaced by their hash to stay within file name limits
+        MAX_FILE_NAME: ClassVar[int] = 200
+        TEMP_DIR: ClassVar[str] = ".tmp"
+        # Taken around conditional writes and deletes, across threads and processes
+        LOCK_FILE: ClassVar[str] = ".lock"
+
+        def __init__(self, root: str, container_name: str, fsync_batch: Optional[int] = None):
+                self.root = root
+                self.container_name = container_name
+                self.fsync_batch = fsync_batch
+                self._unsynced: List[str] = []
+                self._lock = threading.Lock()
+                os.makedirs(os.path.join(root, container_name, self.TEMP_DIR), exist_ok=True)
+
+        def _path(self, container_name: str, blob_name: str) -> str:
+                file_name = quote(blob_name, safe="")
+                if len(file_name) > self.MAX_FILE_NAME or file_name.startswith("."):
+                        file_name = "_" + hashlib.sha256(blob_name.encode('utf-8')).hexdigest()
+                return os.path.join(self.root, container_name, file_name)
+
+        def _write(self, container_name: str, blob_name: str, chunks) -> int:
+                container_dir = os.path.join(self.root, container_name)
+                temp_dir = os.path.join(container_dir, self.TEMP_DIR)
+                os.makedirs(temp_dir, exist_ok=True)
+                temp_path = os.path.join(temp_dir, f"{os.getpid()}-{threading.get_ident()}-{time.monotonic_ns()}")
+                total = 0
+                try:
+                        with open(temp_path, "wb") as temp_file:
+                                for chunk in chunks:
+                                        temp_file.write(chunk)
+                                        total += len(chunk)
+                                if self.fsync_batch == 1:
+                                        temp_file.flush()
+                                        os.fsync(temp_file.fileno())
+                        path = self._path(container_name, blob_name)
+                        os.replace(temp_path, path)
+                except BaseException:
+                        if os.path.exists(temp_path):
+                                os.remove(temp_path)
+                        raise
+                if self.fsync_batch == 1:
+                        self._fsync_dir(container_dir)
+                elif self.fsync_batch:
+                        with self._lock:
+                                self._unsynced.append(path)
+                                due = len(self._unsynced) >= self.fsync_batch
+                        if due:
+                                self.flush()
+                return total
+
+        @staticmethod
+        def _fsync_dir(path: str) -> None:
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                        os.fsync(fd)
+                finally:
+                        os.close(fd)
+
+        def flush(self) -> None:
+                """fsync the blobs written since the last batch, then their directories"""
+                with self._lock:
+                        paths, self._unsynced = self._unsynced, []
+                for path in paths:
+                        try:
+                                fd = os.open(path, os.O_RDONLY)
+                        except FileNotFoundError:
+                                continue
+                        try:
+                                os.fsync(fd)
+                        finally:
+                                os.close(fd)
+                for directory in {os.path.dirname(path) for path in paths}:
+                        self._fsync_dir(directory)
+
+        def _read(self, blob_name: str, offset: int = 0, length: Optional[int] = None) -> Optional[bytes]:
+                try:
+                        with open(self._path(self.container_name, blob_name), "rb") as blob_file:
+                                blob_file.seek(offset)
+                                return blob_file.read() if length is None else blob_file.read(length)
+                except FileNotFoundError:
+                        return None
+
+        def upload_from_bytes(self, container_name: str, blob_name: str, data: bytes) -> None:
+                self._write(container_name, blob_name, [data])
+
+        def upload_from_stream(self, container_name: str, blob_name: str, stream: BinaryIO,
+                               block_size: int = StorageHandler.DEFAULT_BLOCK_SIZE,
+                               max_concurrency: int = StorageHandler.DEFAULT_BLOCK_CONCURRENCY) -> int:
+                return self._write(container_name, blob_name, iter(lambda: stream.read(block_size), b""))
+
+        def delete_blob(self, container_name: str, blob_name: str) -> None:
+                try:
+                        os.remove(self._path(container_name, blob_name))
+                except FileNotFoundError:
+                        pass
+
+        @staticmethod
+        def _version(stat: os.stat_result) -> str:
+                # Every write renames a new file into place, so the inode changes with the content
+                return f"{stat.st_ino}-{stat.st_mtime_ns}-{stat.st_size}"
+
+        def _exclusive(self, container_name: str):
+                """A context manager holding the container's lock file"""
+                lock_file = open(os.path.join(self.root, container_name, self.TEMP_DIR, self.LOCK_FILE), "a")
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                # Closing the file releases the lock
+                return lock_file
+
+        def delete_blob_if_unmodified(self, container_name: str, blob_name: str, since: float) -> bool:
+                path = self._path(container_name, blob_name)
+                with self._exclusive(container_name):
+                        try:
+                                if os.stat(path).st_mtime_ns > since * 1e9:
+                                        return False
+                                os.remove(path)
+                        except FileNotFoundError:
+                                pass
+                return True
+
+        def upload_json(self, json_data: Dict, blob_name: str) -> None:
+                self.upload_from_bytes(self.container_name, blob_name, json.dumps(json_data).encode('utf-8'))
+
+        def download_json(self, blob_name: str) -> Optional[dict]:
+                data = self._read(blob_name)
+                return json.loads(data) if data is not None else None
+
+        def download_json_versioned(self, blob_name: str) -> Tuple[Optional[dict], Optional[str]]:
+                try:
+                        with open(self._path(self.container_name, blob_name), "rb") as blob_file:
+                                # The version of the file actually read, even if it is replaced meanwhile
+                                return json.loads(blob_file.read()), self._version(os.fstat(blob_file.fileno()))
+                except FileNotFoundError:
+                        return None, None
+
+        def upload_bytes_versioned(self, data: bytes, blob_name: str, version: Optional[str]) -> str:
+                path = self._path(self.container_name, blob_name)
+                with self._exclusive(self.container_name):
+                        try:
+                                current = self._version(os.stat(path))
+                        except FileNotFoundError:
+                                current = None
+                        if current != version:
+                                raise VersionConflict(f"{blob_name} changed since version {version}")
+                        self.upload_from_bytes(self.container_name, blob_name, data)
+                        return self._version(os.stat(path))
+
+        def download_bytes(self, blob_name: str) -> Optional[bytes]:
+                return self._read(blob_name)
+
+        def download_range(self, blob_name: str, offset: int, length: Optional[int] = None) -> Optional[bytes]:
+                return self._read(blob_name, offset, length)
+
+        def blob_version(self, blob_name: str) -> Optional[str]:
+                try:
+                        return self._version(os.stat(self._path(self.container_name, blob_name)))
+                except FileNotFoundError:
+                        return None
+
+        def download_range_versioned(self, blob_name: str, offset: int, length: Optional[int] = None,
+                                     version: Optional[str] = None) -> Tuple[Optional[bytes], Optional[str]]:
+                try:
+                        blob_file = open(self._path(self.container_name, blob_name), "rb")
+                except FileNotFoundError:
+                        if version:
+                                raise VersionConflict(f"{blob_name} was deleted since version {version}")
+                        return None, None
+                with blob_file:
+                        # An open file keeps the content it was opened with, even once replaced
+                        current = self._version(os.fstat(blob_file.fileno()))
+                        if version and current != version:
+                                raise VersionConflict(f"{blob_name} changed since version {version}")
+                        blob_file.seek(offset)
+                        return (blob_file.read() if length is None else blob_file.read(length)), current
+
+        def to_dict(self) -> dict:
+                return {
+                        "type": self.TYPE,
+                        "root": self.root,
+                        "container_name": self.container_name,
+                        "fsync_batch": self.fsync_batch
+                }
+
+        @classmethod
+        def from_dict(cls, data: dict) -> "StorageHandler":
+                return cls(data["root"], data["container_name"], data.get("fsync_batch"))
+
+
+class InMemoryStorageHandler(StorageHandler):
+        """
+        Keeps blobs in a process-wide dict of containers, so handlers rebuilt
+        with from_dict see the same data. latency (seconds per request) and
+        bandwidth (bytes per second) are simulated with sleeps, to load-test the
+        upload and snapshot paths against a remote-like store without one.
+        """
+        TYPE: ClassVar[str] = "memory"
+        _containers: ClassVar[Dict[str, Dict[str, bytes]]] = {}
+        # (container, blob name) -> (version, time written)
+        _stamps: ClassVar[Dict[Tuple[str, str], Tuple[str, float]]] = {}
+        _versions: ClassVar[count] = count(1)
+        _containers_lock: ClassVar[threading.Lock] = threading.Lock()
+
+        def __init__(self, container_name: str, latency: float = 0.0, bandwidth: Optional[float] = None):
+                self.container_name = container_name
+                self.latency = latency
+                self.bandwidth = bandwidth
+                self._container(container_name)
+
+        @classmethod
+        def _container(cls, container_name: str) -> Dict[str, bytes]:
+                with cls._containers_lock:
+                        return cls._containers.setdefault(container_name, {})
+
+        @classmethod
+        def clear(cls, container_name: Optional[str] = None) -> None:
+                with cls._containers_lock:
+                        if container_name is None:
+                                cls._containers.clear()
+                                cls._stamps.clear()
+                        else:
+                                cls._containers.pop(container_name, None)
+                                for key in [key for key in cls._stamps if key[0] == container_name]:
+                                        del cls._stamps[key]
+
+        def blob_names(self) -> List[str]:
+                return list(self._container(self.container_name))
+
+        def _transfer(self, size: int) -> None:
+                delay = self.latency + (size / self.bandwidth if self.bandwidth else 0.0)
+                if delay > 0:
+                        time.sleep(delay)
+
+        def _read(self, blob_name: str, offset: int = 0, length: Optional[int] = None) -> Optional[bytes]:
+                data = self._container(self.container_name).get(blob_name)
+                if data is not None:
+                        data = data[offset:] if length is None else data[offset:offset + length]
+                self._transfer(len(data) if data else 0)
+                return data
+
+        def upload_from_bytes(self, container_name: str, blob_name: str, data: bytes) -> None:
+                self._transfer(len(data))
+                self._store(container_name, blob_name, data)
+
+        @classmethod
+        def _store(cls, container_name: str, blob_name: str, data: bytes) -> str:
+                container = cls._container(container_name)
+                with cls._containers_lock:
+                        version = str(next(cls._versions))
+                        container[blob_name] = bytes(data)
+                        cls._stamps[(container_name, blob_name)] = (version, time.time())
+                return version
+
+        def upload_from_stream(self, container_name: str, blob_name: str, stream: BinaryIO,
+                               block_size: int = StorageHandler.DEFAULT_BLOCK_SIZE,
+                               max_concurrency: int = StorageHandler.DEFAULT_BLOCK_CONCURRENCY) -> int:
+                data = b"".join(iter(lambda: stream.read(block_size), b""))
+                self.upload_from_bytes(container_name, blob_name, data)
+                return len(data)
+
+        def delete_blob(self, container_name: str, blob_name: str) -> None:
+                self._transfer(0)
+                container = self._container(container_name)
+                with self._containers_lock:
+                        container.pop(blob_name, None)
+                        self._stamps.pop((container_name, blob_name), None)
+
+        def delete_blob_if_unmodified(self, container_name: str, blob_name: str, since: float) -> bool:
+                self._transfer(0)
+                container = self._container(container_name)
+                with self._containers_lock:
+                        stamp = self._stamps.get((container_name, blob_name))
+                        if stamp is not None and stamp[1] > since:
+                                return False
+                        container.pop(blob_name, None)
+                        self._stamps.pop((container_name, blob_name), None)
+                return True
+
+        def upload_json(self, json_data: Dict, blob_name: str) -> None:
+                self.upload_from_bytes(self.container_name, blob_name, json.dumps(json_data).encode('utf-8'))
+
+        def download_json(self, blob_name: str) -> Optional[dict]:
+                data = self._read(blob_name)
+                return json.loads(data) if data is not None else None
+
+        def download_json_versioned(self, blob_name: str) -> Tuple[Optional[dict], Optional[str]]:
+                container = self._container(self.container_name)
+                with self._containers_lock:
+                        data = container.get(blob_name)
+                        stamp = self._stamps.get((self.container_name, blob_name))
+                self._transfer(len(data) if data else 0)
+                if data is None:
+                        return None, None
+                return json.loads(data), stamp[0]
+
+        def upload_bytes_versioned(self, data: bytes, blob_name: str, version: Optional[str]) -> str:
+                self._transfer(len(data))
+                container = self._container(self.container_name)
+                with self._containers_lock:
+                        stamp = self._stamps.get((self.container_name, blob_name))
+                        if (stamp[0] if stamp else None) != version:
+                                raise VersionConflict(f"{blob_name} changed since version {version}")
+                        new_version = str(next(self._versions))
+                        container[blob_name] = bytes(data)
+                        self._stamps[(self.container_name, blob_name)] = (new_version, time.time())
+                return new_version
+
+        def download_bytes(self, blob_name: str) -> Optional[bytes]:
+                return self._read(blob_name)
+
+        def download_range(self, blob_name: str, offset: int, length: Optional[int] = None) -> Optional[bytes]:
+                return self._read(blob_name, offset, length)
+
+        def blob_version(self, blob_name: str) -> Optional[str]:
+                self._transfer(0)
+                with self._containers_lock:
+                        stamp = self._stamps.get((self.container_name, blob_name))
+                return stamp[0] if stamp else None
+
+        def download_range_versioned(self, blob_name: str, offset: int, length: Optional[int] = None,
+                                     version: Optional[str] = None) -> Tuple[Optional[bytes], Optional[str]]:
+                container = self._container(self.container_name)
+                with self._containers_lock:
+                        data = container.get(blob_name)
+                        stamp = self._stamps.get((self.container_name, blob_name))
+                current = stamp[0] if data is not None and stamp else None
+                if version and current != version:
+                        raise VersionConflict(f"{blob_name} changed since version {version}")
+                if data is not None:
+                        data = data[offset:] if length is None else data[offset:offset + length]
+                self._transfer(len(data) if data else 0)
+                return data, current
+
+        def to_dict(self) -> dict:
+                return {
+                        "type": self.TYPE,
+                        "container_name": self.container_name,
+                        "latency": self.latency,
+                        "bandwidth": self.bandwidth
+                }
+
+        @classmethod
+        def from_dict(cls, data: dict) -> "StorageHandler":
+                return cls(data["container_name"], data.get("latency", 0.0), data.get("bandwidth"))
+
+
+STORAGE_HANDLERS: Dict[str, type] = {
+        handler.TYPE: handler for handler in (AzureStorageHandler, LocalFSStorageHandler, InMemoryStorageHandler)
+}
+
+
+def storage_handler_from_dict(data: dict) -> StorageHandler:
+        """Rebuild a handler saved with to_dict(); dicts without a type are Azure ones"""
+        handler_type = data.get("type", AzureStorageHandler.TYPE)
+        if handler_type not in STORAGE_HANDLERS:
+                raise ValueError(f"Unknown storage handler type {handler_type}")
+        return STORAGE_HANDLERS[handler_type].from_dict(data)
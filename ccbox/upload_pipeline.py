@@ -0,0 +1,366 @@
+from typing import Union, List, Dict, Optional, Any, ClassVar, Callable, Set
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor, Future
+import threading
+import time
+import os
+
+from ccbox.storage_handler import StorageHandler
+from ccbox.manifest import Manifest, ManifestEntry, hash_bytes
+from ccbox.retry import RetryPolicy
+from ccbox.content_store import ContentStore
+from ccbox.chunking import Chunker
+
+
+@dataclass
+class FailedUpload:
+        """A blob given up on, kept so the upload can be driven again later"""
+        blob_name: str
+        path: Optional[str]
+        error: str
+        attempts: int
+        data: bytes = field(default=b"", repr=False)
+
+        def to_dict(self) -> dict:
+                return {"blob_name": self.blob_name, "path": self.path, "error": self.error, "attempts": self.attempts}
+
+
+@dataclass
+class UploadStats:
+        """Class for keeping track of the throughput of an upload run"""
+        files: int = 0
+        bytes: int = 0
+        failed: int = 0
+        skipped: int = 0
+        deleted: int = 0
+        retried: int = 0
+        deduplicated: int = 0
+        deduplicated_bytes: int = 0
+        elapsed: float = 0.0
+        dead_letters: List[FailedUpload] = field(default_factory=list, repr=False)
+
+        @property
+        def files_per_sec(self) -> float:
+                return self.files / self.elapsed if self.elapsed else 0.0
+
+        @property
+        def mb_per_sec(self) -> float:
+                return self.bytes / (1024 * 1024) / self.elapsed if self.elapsed else 0.0
+
+        def to_dict(self) -> dict:
+                return {
+                "files": self.files,
+                "bytes": self.bytes,
+                "failed": self.failed,
+                "skipped": self.skipped,
+                "deleted": self.deleted,
+                "retried": self.retried,
+                "deduplicated": self.deduplicated,
+                "deduplicated_bytes": self.deduplicated_bytes,
+                "elapsed": round(self.elapsed, 3),
+                "files_per_sec": round(self.files_per_sec, 2),
+                "mb_per_sec": round(self.mb_per_sec, 2),
+                "dead_letters": [failure.to_dict() for failure in self.dead_letters]
+                }
+
+        def __str__(self) -> str:
+                failures = f", {self.failed} failed after {self.retried} retries" if self.failed else ""
+                duplicates = f", {self.deduplicated} already stored" if self.deduplicated else ""
+                return (f"{self.files} files, {self.bytes} bytes, {self.skipped} unchanged{duplicates}{failures} in {self.elapsed:.2f}s "
+                        f"({self.files_per_sec:.2f} files/s, {self.mb_per_sec:.2f} MB/s)")
+
+
+def upload_path(storage_handler: StorageHandler, container_name: str, blob_name: str, path: str,
+                block_size: int = StorageHandler.DEFAULT_BLOCK_SIZE,
+                block_concurrency: int = StorageHandler.DEFAULT_BLOCK_CONCURRENCY) -> int:
+        """Upload a local file, streaming it in blocks when it is larger than one block"""
+        with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size <= block_size:
+                        data = f.read()
+                        storage_handler.upload_from_bytes(container_name, blob_name, data)
+                        return len(data)
+                return storage_handler.upload_from_stream(container_name, blob_name, f, block_size, block_concurrency)
+
+
+class UploadPipeline:
+        """
+        Uploads blobs through a pool of worker threads.
+
+        At most max_in_flight uploads are queued or running at any time;
+        submit() blocks the producer until a slot frees up, so memory stays
+        flat however large the tree being uploaded is. Files bigger than
+        block_size are streamed block by block instead of read whole.
+
+        With a manifest, files whose size and mtime match the last upload are
+        skipped without being read; the rest are hashed and only uploaded if
+        their content actually changed. Every blob name submitted is collected
+        in seen, for pruning what the manifest has beyond them.
+
+        Failed uploads are retried as retry_policy allows. The wait happens on
+        a timer, not a worker, so other uploads keep going, while the blob
+        keeps its in-flight slot, so a throttled run slows its producer down
+        rather than piling up work. Blobs given up on are counted as failed and
+        listed in stats.dead_letters for redrive().
+
+        With a content_store, files are stored once per distinct content (see
+        ccbox.content_store) instead of under their blob name, which is then
+        only the manifest key: content the store already has is referenced
+        rather than uploaded. With a chunker as well, files of at least
+        chunker.threshold bytes are stored as content-defined chunks instead,
+        so a modified file only sends the chunks the store does not have.
+        """
+        DEFAULT_WORKERS: ClassVar[int] = 8
+        DEFAULT_MAX_IN_FLIGHT: ClassVar[int] = 64
+
+        def __init__(self, storage_handler: StorageHandler, container_name: str,
+                     workers: int = DEFAULT_WORKERS, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                     block_size: int = StorageHandler.DEFAULT_BLOCK_SIZE,
+                     block_concurrency: int = StorageHandler.DEFAULT_BLOCK_CONCURRENCY,
+                     manifest: Optional[Manifest] = None,
+                     progress: Optional[Callable[[Optional[str], int], None]] = None,
+                     retry_policy: Optional[RetryPolicy] = None,
+                     content_store: Optional[ContentStore] = None,
+                     chunker: Optional[Chunker] = None):
+                self.storage_handler = storage_handler
+                self.content_store = content_store
+                self.chunker = chunker
+                self.retry_policy = retry_policy or RetryPolicy()
+                self.manifest = manifest
+                # Called with (local path or None, size) for every blob uploaded or found up to date
+                self.progress = progress
+                self.container_name = container_name
+                self.block_size = block_size
+                self.block_concurrency = block_concurrency
+                self.stats = UploadStats()
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ccbox-upload")
+                self._slots = threading.BoundedSemaphore(max_in_flight)
+                self._lock = threading.Lock()
+                # Uploads submitted and not yet finished, including those waiting to be retried
+                self._pending = 0
+                self._idle = threading.Condition(self._lock)
+                self.seen: Set[str] = set()
+                self._started = time.perf_counter()
+
+        def submit(self, blob_name: str, path: Optional[str] = None, data: bytes = b"",
+                   file_entry: Any = None) -> Optional[Future]:
+                """
+                Queue a blob for upload, either from a local file path or from raw bytes.
+                Returns None when the manifest shows the blob is already up to date.
+                file_entry (the tree's FileEntry for path) gets its sha256 and the
+                name of the blob holding its content, or its chunks, filled in.
+                """
+                if self.manifest is not None:
+                        with self._lock:
+                                self.seen.add(blob_name)
+                        if path is not None:
+                                unchanged = self.manifest.is_unchanged(blob_name, path)
+                                if unchanged:
+                                        # Uploaded before the drive switched to the content-addressed layout
+                                        if not self._in_store(blob_name):
+                                                unchanged = False
+                                        else:
+                                                self._resolved(file_entry, blob_name, self.manifest.entries[blob_name])
+                        else:
+                                unchanged = self.manifest.has_content(blob_name, hash_bytes(data))
+                        if unchanged:
+                                with self._lock:
+                                        self.stats.skipped += 1
+                                self._report(path, self.manifest.entries[blob_name].size if path is not None else len(data))
+                                return None
+                self._slots.acquire()
+                result = Future()
+                with self._lock:
+                        self._pending += 1
+                try:
+                        self._executor.submit(self._upload, result, blob_name, path, data, file_entry)
+                except Exception:
+                        self._finish(result)
+                        raise
+                return result
+
+        def redrive(self, failures: List[FailedUpload],
+                    resolve: Optional[Callable[[str], Any]] = None) -> List[Future]:
+                """
+                Submit the dead letters of an earlier run again. resolve looks up the
+                tree's FileEntry of a blob name, to be filled in as by submit().
+                """
+                return [self.submit(failure.blob_name, failure.path, failure.data,
+                                    resolve(failure.blob_name) if resolve is not None and failure.path is not None else None)
+                        for failure in failures]
+
+        def _finish(self, result: Future, error: Optional[BaseException] = None) -> None:
+                with self._lock:
+                        self._pending -= 1
+                        if self._pending == 0:
+                                self._idle.notify_all()
+                self._slots.release()
+                if error is None:
+                        result.set_result(None)
+                else:
+                        result.set_exception(error)
+
+        def _upload(self, result: Future, blob_name: str, path: Optional[str], data: bytes,
+                    file_entry: Any = None, attempt: int = 1) -> None:
+                try:
+                        entry = None
+                        if (self.manifest is not None or self.content_store is not None) and path is not None:
+                                # Touched but not modified: only the mtime needs refreshing
+                                entry = ManifestEntry.from_path(path)
+                                if (self.manifest is not None and self.manifest.has_content(blob_name, entry.sha256)
+                                    and self._in_store(blob_name)):
+                                        entry.chunks = self.manifest.entries[blob_name].chunks
+                                        self.manifest.record(blob_name, entry)
+                                        self._resolved(file_entry, blob_name, entry)
+                                        with self._lock:
+                                                self.stats.skipped += 1
+                                        self._report(path, entry.size)
+                                        self._finish(result)
+                                        return
+                        uploaded = True
+                        if path is None:
+                                self.storage_handler.upload_from_bytes(self.container_name, blob_name, data)
+                                size = sent = len(data)
+                                entry = ManifestEntry.from_bytes(data)
+                        elif self.content_store is not None:
+                                size = entry.size
+                                if self.chunker is not None and size >= self.chunker.threshold:
+                                        sent = self._upload_chunks(blob_name, entry)
+                                        # Every chunk was already stored
+                                        uploaded = sent > 0
+                                else:
+                                        uploaded = self._upload_content(blob_name, entry)
+                                        sent = size if uploaded else 0
+                        else:
+                                size = sent = upload_path(self.storage_handler, self.container_name, blob_name, path,
+                                                          self.block_size, self.block_concurrency)
+                        if self.manifest is not None:
+                                self.manifest.record(blob_name, entry)
+                        if entry is not None and path is not None:
+                                self._resolved(file_entry, blob_name, entry)
+                except Exception as e:
+                        if self.retry_policy.should_retry(e, attempt):
+                                self._retry_later(result, blob_name, path, data, attempt, e, file_entry)
+                                return
+                        print(f'Error: failed to upload {blob_name} after {attempt} attempts: {e}')
+                        with self._lock:
+                                self.stats.failed += 1
+                                self.stats.dead_letters.append(FailedUpload(blob_name, path, str(e), attempt, data))
+                        self._finish(result, e)
+                        return
+                with self._lock:
+                        if uploaded:
+                                self.stats.files += 1
+                                self.stats.bytes += sent
+                                self.stats.deduplicated_bytes += size - sent
+                        else:
+                                self.stats.deduplicated += 1
+                                self.stats.deduplicated_bytes += size
+                self._report(path, size)
+                self._finish(result)
+
+        def _upload_content(self, blob_name: str, entry: ManifestEntry) -> bool:
+                """
+                Point blob_name at the content of entry.path in the content store, uploading
+                it only if the store does not have it yet. Returns whether it was uploaded.
+                """
+                store = self.content_store
+                uploaded = not store.add_ref(entry.sha256)
+                if uploaded:
+                        upload_path(store.storage_handler, store.container_name, store.blob_name(entry.sha256), entry.path,
+                                    self.block_size, self.block_concurrency)
+                        store.add_stored(entry.sha256, entry.size)
+                self._replace_previous(blob_name, entry)
+                return uploaded
+
+        def _upload_chunks(self, blob_name: str, entry: ManifestEntry) -> int:
+                """
+                Store entry.path as content-defined chunks, uploading only the chunks the
+                content store does not have, and set entry.chunks. Returns the bytes sent.
+                """
+                store = self.content_store
+                digests = []
+                sent = 0
+                try:
+                        for chunk in self.chunker.iter_file(entry.path):
+                                digest = hash_bytes(chunk)
+                                if not store.add_ref(digest):
+                                        store.storage_handler.upload_from_bytes(store.container_name, store.blob_name(digest),
+                                                                                bytes(chunk))
+                                        store.add_stored(digest, len(chunk))
+                                        sent += len(chunk)
+                                digests.append(digest)
+                except Exception:
+                        # A retry starts over, so give back the references taken so far
+                        for digest in digests:
+                                store.release(digest)
+                        raise
+                entry.chunks = digests
+                self._replace_previous(blob_name, entry)
+                return sent
+
+        def _replace_previous(self, blob_name: str, entry: ManifestEntry) -> None:
+                """Drop what blob_name pointed at before entry, now that entry's content is referenced"""
+                previous = self.manifest.entries.get(blob_name) if self.manifest is not None else None
+                if previous is None:
+                        return
+                # The old content loses its references (unless it was never in the store)
+                if previous.chunks is not None or previous.sha256 != entry.sha256:
+                        for digest in previous.content_digests():
+                                self.content_store.release(digest)
+                # and a blob left under this name by the path layout is no longer needed
+                self.storage_handler.delete_blob(self.container_name, blob_name)
+
+        def _in_store(self, blob_name: str) -> bool:
+                """Whether the content last recorded for blob_name is in the content store, if there is one"""
+                if self.content_store is None:
+                        return True
+                entry = self.manifest.entries[blob_name]
+                # Chunks are recorded only once all of them are stored
+                return entry.chunks is not None or self.content_store.contains(entry.sha256)
+
+        def _resolved(self, file_entry: Any, blob_name: str, entry: ManifestEntry) -> None:
+                if file_entry is None:
+                        return
+                file_entry.sha256 = entry.sha256
+                file_entry.chunks = entry.chunks
+                if entry.chunks is not None:
+                        # No single blob holds a chunked file
+                        file_entry.blob_name = None
+                elif self.content_store is not None:
+                        file_entry.blob_name = self.content_store.blob_name(entry.sha256)
+                else:
+                        file_entry.blob_name = blob_name
+
+        def _retry_later(self, result: Future, blob_name: str, path: Optional[str], data: bytes,
+                         attempt: int, error: BaseException, file_entry: Any = None) -> None:
+                with self._lock:
+                        self.stats.retried += 1
+
+                def resubmit():
+                        try:
+                                self._executor.submit(self._upload, result, blob_name, path, data, file_entry, attempt + 1)
+                        except Exception as e:
+                                self._finish(result, e)
+
+                timer = threading.Timer(self.retry_policy.delay(attempt, error), resubmit)
+                timer.daemon = True
+                timer.start()
+
+        def _report(self, path: Optional[str], size: int) -> None:
+                if self.progress is not None:
+                        self.progress(path, size)
+
+        def close(self) -> UploadStats:
+                """Wait for every queued upload, and its retries, to finish and return the run's stats"""
+                with self._lock:
+                        while self._pending:
+                                self._idle.wait()
+                self._executor.shutdown(wait=True)
+                self.stats.elapsed = time.perf_counter() - self._started
+                return self.stats
+
+        def __enter__(self) -> "UploadPipeline":
+                return self
+
+        def __exit__(self, exc_type, exc_value, traceback) -> None:
+                self.close()
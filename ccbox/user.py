@@ -2,10 +2,15 @@ from typing import Union, List, Dict, Optional, Any, ClassVar
 from dataclasses import dataclass, field, asdict
 import string
 from itertools import count
+from concurrent.futures import Future
+import threading
 import sqlite3
+import queue
 import json
+import os
 
 from ccbox.virtual_drive import Virtual_Drive, Folder
+from ccbox.cache import LRUCache, CacheStats
 
 
 @dataclass
@@ -27,19 +32,99 @@ class User:
         def from_dict(cls, data: dict) -> 'User':
 
                 user = cls(username=data["username"], _id=data["_id"])
-                user.virtual_drive = Virtual_Drive(_id=data["virtual_drive_id"], _from_dict=True).load_from_remote(f"virtual_drive_{data["virtual_drive_id"]}.json")
+                virtual_drive = Virtual_Drive(_id=data["virtual_drive_id"], _from_dict=True)
+                virtual_drive.add_remote(Virtual_Drive.default_remote(data["virtual_drive_id"]))
+                user.virtual_drive = virtual_drive.load_from_remote(lazy=True)
                 return user
 
 
+@dataclass(frozen=True)
+class UserRecord:
+        """A user's database row without their drive; cheap to fetch, e.g. to authenticate"""
+        username: str
+        _id: int
+        virtual_drive_id: int
+
+        def to_dict(self) -> dict:
+                return {
+                "username": self.username,
+                "_id": self._id,
+                "virtual_drive_id": self.virtual_drive_id
+                }
+
+
+@dataclass(frozen=True)
+class Credentials:
+        """A user's stored password hash, with the salt and hashing parameters it was made with"""
+        username: str
+        salt: str
+        hash: str
+        params: Dict[str, Any] = field(default_factory=dict)
+
+
 class UserDatabase:
-        """Class for interacting with the user database"""
-        
-        def __init__(self, db_path: str):
+        """
+        Class for interacting with the user database.
+
+        Hydrated users (and their drives) are kept in an LRU cache so repeated
+        requests for the same user do not reload the drive snapshot; the cache
+        is bounded by cache_size entries and cache_ttl seconds. When other
+        processes may save the same drives, set verify_cached: a cached drive
+        is then only used while its snapshot has not been saved since.
+
+        Ids are assigned by SQLite when a user is inserted, so processes that
+        share the database never hand out the same one.
+
+        Every thread gets its own connection (and with it its own statement
+        cache) to a WAL-mode database, so readers never wait on each other or
+        on a writer. New users are inserted by a single writer thread that
+        commits whatever has queued up in one transaction.
+        """
+        DEFAULT_CACHE_SIZE: ClassVar[int] = 256
+        DEFAULT_CACHE_TTL: ClassVar[Optional[float]] = 300.0
+        # Seconds a connection waits for the write lock before giving up
+        BUSY_TIMEOUT: ClassVar[float] = 30.0
+        MAX_WRITE_BATCH: ClassVar[int] = 1000
+        # The next drive id is taken inside the insert, under SQLite's write lock
+        INSERT_USER_SQL: ClassVar[str] = (
+                'INSERT INTO users (username, virtual_drive_id) '
+                'VALUES (?, (SELECT COALESCE(MAX(virtual_drive_id), 0) + 1 FROM users))')
+
+        def __init__(self, db_path: str, cache_size: int = DEFAULT_CACHE_SIZE,
+                     cache_ttl: Optional[float] = DEFAULT_CACHE_TTL, legacy_credentials_path: Optional[str] = None):
                 self.db_path = db_path
-                self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
-                self.cursor = self.connection.cursor()
+                self.cache = LRUCache(cache_size, cache_ttl)
+                self.verify_cached = False
+                self._local = threading.local()
+                self._connections = []
+                self._connections_lock = threading.Lock()
+                self._writes = queue.Queue()
+                self._writer = None
                 self._create_tables()
                 self._initialize_counters()
+                if legacy_credentials_path:
+                        self.migrate_credentials(legacy_credentials_path)
+
+        def _thread_connection(self) -> tuple:
+                """The calling thread's connection and cursor, opened on first use"""
+                local = self._local
+                if getattr(local, "connection", None) is None:
+                        connection = sqlite3.connect(self.db_path, timeout=self.BUSY_TIMEOUT, cached_statements=256,
+                                                     check_same_thread=False)
+                        connection.execute('PRAGMA journal_mode=WAL')
+                        connection.execute('PRAGMA synchronous=NORMAL')
+                        local.connection, local.cursor = connection, connection.cursor()
+                        with self._connections_lock:
+                                self._connections.append(connection)
+                return local.connection, local.cursor
+
+        @property
+        def connection(self) -> sqlite3.Connection:
+                return self._thread_connection()[0]
+
+        @property
+        def cursor(self) -> sqlite3.Cursor:
+                return self._thread_connection()[1]
 
         def _initialize_counters(self):
                 self.cursor.execute('SELECT MAX(id) FROM users')
@@ -63,31 +148,228 @@ class UserDatabase:
                         virtual_drive_id INTEGER NOT NULL
                 )
                 ''')
+                self.cursor.execute('''
+                CREATE TABLE IF NOT EXISTS credentials (
+                        username TEXT PRIMARY KEY,
+                        salt TEXT NOT NULL,
+                        hash TEXT NOT NULL,
+                        params TEXT NOT NULL
+                ) WITHOUT ROWID
+                ''')
+                self.cursor.execute('''
+                CREATE TABLE IF NOT EXISTS migrations (
+                        name TEXT PRIMARY KEY
+                )
+                ''')
+                self.cursor.execute('''
+                CREATE TABLE IF NOT EXISTS mount_jobs (
+                        id TEXT PRIMARY KEY,
+                        status TEXT NOT NULL,
+                        state TEXT NOT NULL
+                ) WITHOUT ROWID
+                ''')
                 self.connection.commit()
 
-        def add_user_to_db(self, user_obj: User) -> None:
-                user_data = user_obj.to_dict()
-                try:
+        def migrate_credentials(self, path: str) -> int:
+                """
+                One-time import of a legacy users.txt ("<username> <sha256>" per line)
+                into the credentials table. Returns the number of users imported.
+                """
+                self.cursor.execute('SELECT 1 FROM migrations WHERE name = ?', ("users.txt",))
+                if self.cursor.fetchone() is not None or not os.path.exists(path):
+                        return 0
+                rows = []
+                with open(path, "r") as f:
+                        for line in f:
+                                items = line.split()
+                                if len(items) == 2:
+                                        # Legacy hashes are unsalted SHA-256 of the password
+                                        rows.append((items[0], "", items[1], json.dumps({"algorithm": "sha256"})))
+                with self.connection:
+                        self.cursor.executemany('''
+                                INSERT OR IGNORE INTO credentials (username, salt, hash, params) VALUES (?, ?, ?, ?)
+                        ''', rows)
+                        self.cursor.execute('INSERT INTO migrations (name) VALUES (?)', ("users.txt",))
+                return len(rows)
+
+        SAVE_CREDENTIALS_SQL: ClassVar[str] = (
+                'INSERT OR REPLACE INTO credentials (username, salt, hash, params) VALUES (?, ?, ?, ?)')
+
+        def save_credentials(self, credentials: Credentials) -> None:
+                with self.connection:
+                        self.cursor.execute(self.SAVE_CREDENTIALS_SQL, (credentials.username, credentials.salt,
+                                                                        credentials.hash, json.dumps(credentials.params)))
+
+        def get_credentials(self, username: str) -> Optional[Credentials]:
+                self.cursor.execute('''
+                SELECT username, salt, hash, params FROM credentials WHERE username = ?
+                ''', (username,))
+                row = self.cursor.fetchone()
+                if row:
+                        return Credentials(username=row[0], salt=row[1], hash=row[2], params=json.loads(row[3]))
+                return None
+
+        def save_job(self, job_id: str, status: str, state: dict) -> None:
+                with self.connection:
                         self.cursor.execute('''
-                                INSERT INTO users (id, username, virtual_drive_id) VALUES (?, ?, ?)
-                        ''', (user_data['_id'], user_data['username'], user_data['virtual_drive_id']))
-                        self.connection.commit()
-                except sqlite3.IntegrityError as error:
-                        print(error)
+                                INSERT OR REPLACE INTO mount_jobs (id, status, state) VALUES (?, ?, ?)
+                        ''', (job_id, status, json.dumps(state)))
 
-        def get_user_from_db(self, username: str) -> Optional[User]:
+        def get_job(self, job_id: str) -> Optional[dict]:
+                self.cursor.execute('SELECT state FROM mount_jobs WHERE id = ?', (job_id,))
+                row = self.cursor.fetchone()
+                return json.loads(row[0]) if row else None
+
+        def jobs_with_status(self, statuses: List[str]) -> List[dict]:
+                placeholders = ", ".join("?" * len(statuses))
+                self.cursor.execute(f'SELECT state FROM mount_jobs WHERE status IN ({placeholders})', statuses)
+                return [json.loads(row[0]) for row in self.cursor.fetchall()]
+
+        def add_user_to_db(self, user_obj: User, wait: bool = True,
+                           credentials: Optional[Credentials] = None) -> Future:
+                """
+                Queue a user for insertion by the writer thread, with their credentials
+                in the same transaction if given. The user's ids are assigned by the
+                database and set on user_obj and its drive. The returned future resolves
+                to False if the username is taken, in which case the credentials are not
+                saved either. With wait, block until the batch holding the user is committed.
+                """
+                future = Future()
+                self._start_writer()
+                self._writes.put((user_obj, future, credentials))
+                if wait:
+                        future.result()
+                return future
+
+        def _start_writer(self) -> None:
+                with self._connections_lock:
+                        if self._writer is None:
+                                self._writer = threading.Thread(target=self._write_loop, name="ccbox-db-writer", daemon=True)
+                                self._writer.start()
+
+        def _write_loop(self) -> None:
+                stopping = False
+                while not stopping:
+                        batch = [self._writes.get()]
+                        # Group commit: everything queued while the last batch was written goes in this one
+                        while len(batch) < self.MAX_WRITE_BATCH:
+                                try:
+                                        batch.append(self._writes.get_nowait())
+                                except queue.Empty:
+                                        break
+                        if None in batch:
+                                stopping = True
+                                batch = [item for item in batch if item is not None]
+                        self._write_batch(batch)
+
+        def _write_batch(self, batch: List[tuple]) -> None:
+                results = []
+                try:
+                        with self.connection:
+                                for user_obj, future, credentials in batch:
+                                        try:
+                                                row = self.cursor.execute(self.INSERT_USER_SQL + ' RETURNING id, virtual_drive_id',
+                                                                          (user_obj.username,)).fetchone()
+                                        except sqlite3.IntegrityError as error:
+                                                print(error)
+                                                row = None
+                                        if row is not None and credentials is not None:
+                                                self.cursor.execute(self.SAVE_CREDENTIALS_SQL, (
+                                                        credentials.username, credentials.salt, credentials.hash,
+                                                        json.dumps(credentials.params)))
+                                        results.append(row)
+                except Exception as e:
+                        for _, future, _ in batch:
+                                future.set_exception(e)
+                        return
+                for (user_obj, future, _), row in zip(batch, results):
+                        if row is not None:
+                                user_obj._id, user_obj.virtual_drive._id = row
+                        future.set_result(row is not None)
+
+        def add_users_bulk(self, usernames: List[str], credentials: List[Credentials]) -> int:
+                """
+                Insert users and their credentials with executemany in a single
+                transaction, with ids assigned by the database. Usernames that
+                already exist are left untouched. Returns the number of users inserted.
+                """
+                with self.connection:
+                        self.cursor.executemany('''
+                                INSERT OR IGNORE INTO credentials (username, salt, hash, params) VALUES (?, ?, ?, ?)
+                        ''', [(c.username, c.salt, c.hash, json.dumps(c.params)) for c in credentials])
+                        self.cursor.executemany(self.INSERT_USER_SQL.replace('INSERT', 'INSERT OR IGNORE', 1),
+                                                [(username,) for username in usernames])
+                        return self.cursor.rowcount
+
+        def existing_usernames(self, usernames: List[str]) -> set:
+                existing = set()
+                # Stay below SQLite's default limit on bound parameters
+                for start in range(0, len(usernames), 500):
+                        chunk = usernames[start:start + 500]
+                        self.cursor.execute(f'SELECT username FROM users WHERE username IN ({", ".join("?" * len(chunk))})',
+                                            chunk)
+                        existing.update(row[0] for row in self.cursor.fetchall())
+                return existing
+
+        def user_exists(self, username: str) -> bool:
+                self.cursor.execute('''
+                SELECT 1 FROM users WHERE username = ?
+                ''', (username,))
+                return self.cursor.fetchone() is not None
+
+        def get_user_record(self, username: str) -> Optional[UserRecord]:
+                """Look up a user without loading their drive"""
                 self.cursor.execute('''
-                SELECT * FROM users WHERE username = ?
+                SELECT id, username, virtual_drive_id FROM users WHERE username = ?
                 ''', (username,))
                 row = self.cursor.fetchone()
                 if row:
-                        virtual_drive_id = row[2]
-                        return User.from_dict({
-                                "username": row[1],
-                                "_id": row[0],
-                                "virtual_drive_id": virtual_drive_id
-                        })
+                        return UserRecord(username=row[1], _id=row[0], virtual_drive_id=row[2])
+                return None
+
+        def get_user_from_db(self, username: str) -> Optional[User]:
+                """Look up a user together with their drive, from the cache when possible"""
+                user = self.cache.get(username)
+                if user is not None:
+                        if not self.verify_cached or not user.virtual_drive.snapshot_changed():
+                                return user
+                        self.cache.invalidate(username)
+                record = self.get_user_record(username)
+                if record:
+                        user = User.from_dict(record.to_dict())
+                        # Another thread may have loaded the same user meanwhile; share one instance
+                        return self.cache.setdefault(username, user)
                 return None
+
+        def invalidate_user(self, username: str) -> None:
+                """Drop a cached user so the next lookup reloads it, e.g. after its drive was saved"""
+                self.cache.invalidate(username)
+
+        def cache_stats(self) -> CacheStats:
+                return self.cache.stats()
         
+        def reset(self) -> None:
+                """
+                Forget connections, queued writes and cached users without touching
+                them, e.g. in a freshly forked worker process: SQLite connections must
+                not be used across a fork, so each process opens its own.
+                """
+                self._local = threading.local()
+                self._connections = []
+                self._connections_lock = threading.Lock()
+                self._writes = queue.Queue()
+                self._writer = None
+                self.cache.clear()
+
         def close(self):
-                self.connection.close()
\ No newline at end of file
+                """Flush queued writes and close every thread's connection"""
+                with self._connections_lock:
+                        writer, self._writer = self._writer, None
+                if writer is not None:
+                        self._writes.put(None)
+                        writer.join()
+                with self._connections_lock:
+                        connections, self._connections = self._connections, []
+                for connection in connections:
+                        connection.close()
+                self._local = threading.local()
\ No newline at end of file
@@ -1,39 +1,207 @@
-from typing import Union, List, Dict, Optional, Any, ClassVar, Callable
+from typing import Union, List, Dict, Optional, Any, ClassVar, Callable, Iterator
 from dataclasses import dataclass, field
 from itertools import count
+from functools import partial
+from bisect import bisect_right
+import threading
+import json
 import os
 
-from ccbox.storage_handler import StorageHandler, AzureStorageHandler
-from ccbox.helper import NamedTextIOWrapper
+from ccbox.storage_handler import StorageHandler, AzureStorageHandler, VersionConflict, storage_handler_from_dict
+from ccbox.upload_pipeline import UploadPipeline, UploadStats, FailedUpload, upload_path
+from ccbox.retry import RetryPolicy
+from ccbox.content_store import ContentStore
+from ccbox.manifest import Manifest
+from ccbox.scanner import ScannedDirectory, scan_tree
+from ccbox.snapshot import (SnapshotWriter, SectionWriter, SnapshotReader, KIND_ROOT, KIND_FOLDER, KIND_FILE,
+                            KIND_STRING, KIND_SECTION, KIND_CHUNK, NO_PARENT, BLOB_NONE, BLOB_DERIVED, PREFETCH_SIZE)
+from ccbox.chunking import Chunker, default_chunker
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Streamed JSON is written out in pieces of about this many characters
+JSON_CHUNK_SIZE = 64 * 1024
+# Times a lazy folder reopens a snapshot that keeps being replaced while it is read
+MAX_SNAPSHOT_REOPENS = 3
+
+
+def encode_cursor(name: str) -> str:
+        # Hex rather than base64: no '/', '+' or '=' to escape in URLs, and no whitespace to split TCP commands on
+        return name.encode('utf-8').hex()
+
+
+def decode_cursor(cursor: str) -> str:
+        try:
+                return bytes.fromhex(cursor).decode('utf-8')
+        except ValueError:
+                raise ValueError(f"Invalid cursor {cursor!r}")
+
+class FileEntry:
+        """
+        Lazy reference to a mounted file. Only metadata is kept in the tree;
+        the file itself is opened at upload or read time. A file stored as
+        content-defined chunks has no blob_name but the digests of its chunks.
+        """
+        __slots__ = ("_name", "path", "size", "mtime_ns", "sha256", "blob_name", "chunks")
+
+        def __init__(self, _name: str, path: str, size: int = 0, mtime_ns: int = 0,
+                     sha256: Optional[str] = None, blob_name: Optional[str] = None,
+                     chunks: Optional[List[str]] = None):
+                self._name = _name
+                self.path = path
+                self.size = size
+                self.mtime_ns = mtime_ns
+                self.sha256 = sha256
+                self.blob_name = blob_name
+                self.chunks = chunks
+
+        @classmethod
+        def from_path(cls, path: str) -> "FileEntry":
+                stat = os.stat(path)
+                return cls(os.path.basename(path), path, stat.st_size, stat.st_mtime_ns)
+
+        def open(self, mode: str = "rb"):
+                return open(self.path, mode)
+
+        def read(self) -> bytes:
+                with self.open() as f:
+                        return f.read()
+
+        def to_dict(self) -> dict:
+                return {
+                "type": "file",
+                "_name": self._name,
+                "path": self.path,
+                "size": self.size,
+                "mtime_ns": self.mtime_ns,
+                "sha256": self.sha256,
+                "blob_name": self.blob_name,
+                "chunks": self.chunks
+                }
+
+        @classmethod
+        def from_dict(cls, data: dict) -> "FileEntry":
+                return cls(data["_name"], data["path"], data["size"], data["mtime_ns"],
+                           data.get("sha256"), data.get("blob_name"), data.get("chunks"))
+
+        def __eq__(self, other) -> bool:
+                if not isinstance(other, FileEntry):
+                        return NotImplemented
+                return all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+
+        def __repr__(self):
+                return f'FileEntry(\'{self._name}\', \'{self.path}\', {self.size})'
+
+
+def _item_to_dict(item: Union["Folder", FileEntry, str], depth: Optional[int] = None) -> Union[dict, str]:
+        if isinstance(item, Folder):
+                return item.to_dict(depth)
+        if isinstance(item, FileEntry):
+                return item.to_dict()
+        return str(item)
+
+
+def node_from_dict(data: Any, parent_dir=None) -> Union["Folder", FileEntry, str]:
+        """Rebuild a contents entry; plain strings are left as-is for older snapshots"""
+        if not isinstance(data, dict):
+                return data
+        if data.get("type") == "file":
+                return FileEntry.from_dict(data)
+        return Folder.from_dict(data, parent_dir=parent_dir)
+
 
 @dataclass
 class FileSystemObject:
         _name: str
         folders: Dict[str, "Folder"] = field(default_factory=lambda: {})
-        contents: List[Union[object, "Folder"]] = field(default_factory=list)
+        contents: List[Union[FileEntry, "Folder"]] = field(default_factory=list)
         metadata:Dict[str, Any] = field(default_factory=lambda: {})
+        # Name index over contents (folders and files), kept in sync by the add/remove methods
+        children: Dict[str, Union[FileEntry, "Folder"]] = field(default_factory=lambda: {}, repr=False, compare=False)
 
         def add_folder(self, name: str, folder_obj: Optional["Folder"] = None) -> Union["Folder", None]:
-                for item in self.contents:
-                        if type(item).__name__ == "Folder":
-                                if item._name == name:
-                                        raise Exception(f"A folder with the name {name} already exists.")
-                                        return
+                existing = self.children.get(name)
+                if existing is not None:
+                        kind = "folder" if isinstance(existing, Folder) else "file"
+                        raise Exception(f"A {kind} with the name {name} already exists.")
                 if folder_obj:
                         curr_folder = folder_obj
                 else:
                         curr_folder = Folder(name, parent_dir=self)
                 self.contents.append(curr_folder)
                 self.folders[curr_folder._name] = curr_folder
+                self.children[curr_folder._name] = curr_folder
                 return curr_folder
         
-        def add_file(self, obj: object) -> None:
+        def remove_folder(self, name: str) -> Optional["Folder"]:
+                folder = self.folders.pop(name, None)
+                if folder is not None:
+                        del self.children[name]
+                        self.contents = [item for item in self.contents if item is not folder]
+                return folder
+
+        def add_file(self, obj: FileEntry) -> None:
+                existing = self.children.get(obj._name)
+                if existing is not None:
+                        kind = "folder" if isinstance(existing, Folder) else "file"
+                        raise Exception(f"A {kind} with the name {obj._name} already exists.")
                 self.contents.append(obj)
+                self.children[obj._name] = obj
+
+        def replace_folder(self, folder: "Folder") -> Optional["Folder"]:
+                """
+                Put folder in place of the folder with its name, or add it; returns the
+                folder replaced. The indexes are swapped for updated copies rather than
+                changed in place, so a reader walking them meanwhile sees either the old
+                folder or the new one.
+                """
+                existing = self.children.get(folder._name)
+                if existing is not None and not isinstance(existing, Folder):
+                        raise Exception(f"A file with the name {folder._name} already exists.")
+                folders, children = dict(self.folders), dict(self.children)
+                folders[folder._name] = children[folder._name] = folder
+                if existing is None:
+                        contents = self.contents + [folder]
+                else:
+                        contents = [folder if item is existing else item for item in self.contents]
+                self.folders, self.children, self.contents = folders, children, contents
+                return existing
+
+        def index_children(self) -> None:
+                """Rebuild folders and children from contents, e.g. after loading a snapshot"""
+                self.children = {item._name: item for item in self.contents if isinstance(item, (Folder, FileEntry))}
+                self.folders = {name: item for name, item in self.children.items() if isinstance(item, Folder)}
+
+        def resolve(self, path: str) -> Optional[Union[FileEntry, "Folder", "FileSystemObject"]]:
+                """Look up a descendant by a slash-separated path such as "a/b/c", one dict lookup per level"""
+                node = self
+                for part in path.split("/"):
+                        if part in ("", "."):
+                                continue
+                        if not isinstance(node, FileSystemObject):
+                                return None
+                        if part == "..":
+                                node = getattr(node, "parent_dir", None) or node
+                                continue
+                        node = node.children.get(part)
+                        if node is None:
+                                return None
+                return node
+        
+        def walk_files(self) -> Iterator[FileEntry]:
+                """Every file below this folder, depth first"""
+                stack = [self]
+                while stack:
+                        folder = stack.pop()
+                        for item in folder.contents:
+                                if isinstance(item, FileEntry):
+                                        yield item
+                                elif isinstance(item, FileSystemObject):
+                                        stack.append(item)
         
         def change_directory(self, folder_name) -> "FileSystemObject":
-                curr_directory = None
-                if folder_name in self.folders:
-                        curr_directory = self.folders.get(folder_name)
+                curr_directory = self.children.get(folder_name)
+                if isinstance(curr_directory, Folder):
                         return curr_directory
                 elif folder_name == "..":
                         try:
@@ -44,36 +212,112 @@ class FileSystemObject:
                 else: 
                         print("Invalid Folder name.")
 
-        def mount_directory(self, dir_path:str) -> None:
+        def mount_directory(self, dir_path:str, scan_workers: int = 0) -> "Folder":
+                return self.add_folder(os.path.basename(dir_path), self.scan_directory(dir_path, scan_workers))
+
+        def scan_directory(self, dir_path: str, scan_workers: int = 0) -> "Folder":
+                """A folder for dir_path with this one as its parent, not yet added to it"""
                 try: 
-                        dir_list = os.listdir(dir_path)
-                except:
+                        scanned = scan_tree(dir_path, scan_workers)
+                except OSError:
                         raise ValueError("Invalid Path")
-                        return
 
-                mount_folder = self.add_folder(os.path.basename(dir_path))
+                mount_folder = Folder(os.path.basename(dir_path), parent_dir=self)
+                mount_folder.metadata["mounted_from"] = os.path.abspath(dir_path)
+                mount_folder.add_scanned(scanned)
+                return mount_folder
 
-                for item in dir_list:
-                        if os.path.isdir(dir_path + "/" + item):
-                                mount_folder.mount_directory(dir_path + "/" + item)
-                        elif os.path.isfile(dir_path + "/" + item):
-                                with open(dir_path + "/" + item) as new_file:
-                                        new_file = NamedTextIOWrapper(new_file, item)
-                                        mount_folder.contents.append(new_file)
+        def add_scanned(self, scanned: ScannedDirectory) -> None:
+                for name, path, size, mtime_ns in scanned.files:
+                        self.add_file(FileEntry(name, path, size, mtime_ns))
+                for subdirectory in scanned.subdirectories:
+                        self.add_folder(subdirectory.name).add_scanned(subdirectory)
 
-        def to_dict(self) -> dict:
+        def list_contents(self, path: str = "", depth: Optional[int] = 1, limit: int = DEFAULT_PAGE_SIZE,
+                          cursor: Optional[str] = None) -> Optional[dict]:
+                """
+                One page of the entries of the folder at path, ordered by name. Each entry
+                is serialized depth levels deep (1 lists subfolders without their contents,
+                None in full). next_cursor is passed back to get the following page; it is
+                None on the last one. Only the folders on path are loaded from a lazy
+                drive. None if path does not exist.
+                """
+                node = self.resolve(path) if path else self
+                if node is None:
+                        return None
+                if isinstance(node, FileEntry):
+                        return {"path": path, "total": 1, "items": [node.to_dict()], "next_cursor": None}
+                names = sorted(node.children)
+                start = bisect_right(names, decode_cursor(cursor)) if cursor else 0
+                page = names[start:start + limit]
+                child_depth = None if depth is None else depth - 1
+                return {
+                "path": path,
+                "total": len(names),
+                "items": [_item_to_dict(node.children[name], child_depth) for name in page],
+                "next_cursor": encode_cursor(page[-1]) if page and start + limit < len(names) else None
+                }
+
+        def iter_json(self, depth: Optional[int] = None, chunk_size: int = JSON_CHUNK_SIZE) -> Iterator[str]:
+                """
+                The JSON of to_dict(depth), produced a folder at a time and yielded in
+                chunks of about chunk_size characters, so a full dump can be streamed
+                without holding the whole dict or document in memory.
+                """
+                buffer, buffered = [], 0
+                for part in self._json_parts(depth):
+                        buffer.append(part)
+                        buffered += len(part)
+                        if buffered >= chunk_size:
+                                yield "".join(buffer)
+                                buffer, buffered = [], 0
+                if buffer:
+                        yield "".join(buffer)
+
+        def _json_parts(self, depth: Optional[int]) -> Iterator[str]:
+                if depth is not None and depth <= 0:
+                        yield json.dumps(self.to_dict(depth))
+                        return
+                yield from self._json_members(None if depth is None else depth - 1,
+                                              {"_name": self._name}, {"metadata": self.metadata})
+
+        def _json_members(self, child_depth: Optional[int], before: dict, after: dict) -> Iterator[str]:
+                # Same layout and separators as json.dumps(to_dict()), members in the same order
+                yield json.dumps(before)[:-1] + ', "folders": {'
+                for i, (name, folder) in enumerate(self.folders.items()):
+                        yield (", " if i else "") + json.dumps(name) + ": "
+                        yield from folder._json_parts(child_depth)
+                yield '}, "contents": ['
+                for i, item in enumerate(self.contents):
+                        if i:
+                                yield ", "
+                        if isinstance(item, Folder):
+                                yield from item._json_parts(child_depth)
+                        else:
+                                yield json.dumps(_item_to_dict(item))
+                yield '], ' + json.dumps(after)[1:]
+
+        def to_dict(self, depth: Optional[int] = None) -> dict:
+                """
+                Serialize the tree. With a depth, folders more than depth levels down
+                are left out and the folders at the cut-off are marked "truncated",
+                so a lazily loaded drive is not materialized just to be listed.
+                """
+                if depth is not None and depth <= 0:
+                        return {"_name": self._name, "folders": {}, "contents": [], "metadata": self.metadata, "truncated": True}
+                child_depth = None if depth is None else depth - 1
                 return {
                 "_name": self._name,
-                "folders": {name: f.to_dict() for name, f in self.folders.items()},
-                "contents": [f.to_dict() if isinstance(f, Folder) else str(f) for f in self.contents],
+                "folders": {name: f.to_dict(child_depth) for name, f in self.folders.items()},
+                "contents": [_item_to_dict(f, child_depth) for f in self.contents],
                 "metadata": self.metadata
                 }
         
         @classmethod
         def from_dict(cls, data: dict) -> "FileSystemObject":
                 obj = cls(_name=data["_name"])
-                obj.contents = [Folder.from_dict(f) if isinstance(f, dict) else f for f in data["contents"]]
-                obj.folders = {name: Folder.from_dict(f) for name, f in data["folders"].items()}
+                obj.contents = [node_from_dict(f, parent_dir=obj) for f in data["contents"]]
+                obj.index_children()
                 obj.metadata = data["metadata"]
                 return obj
 
@@ -99,26 +343,178 @@ class Folder(FileSystemObject):
         @classmethod
         def from_dict(cls, data: dict, parent_dir=None) -> "Folder":
                 folder = Folder(_name=data["_name"], parent_dir=parent_dir)
-                folder.contents = [cls.from_dict(data=f, parent_dir=folder) if isinstance(f, dict) else f for f in data["contents"]]
-                folder.folders = {name: cls.from_dict(data=f, parent_dir=folder) for name, f in data["folders"].items()}
+                folder.contents = [node_from_dict(f, parent_dir=folder) for f in data["contents"]]
+                folder.index_children()
                 folder.metadata = data["metadata"]
                 return folder
 
 
+def _lazy_field(name: str) -> property:
+        attr = f"_lazy_{name}"
+
+        def getter(self):
+                if self._loader is not None:
+                        self._materialize()
+                return self.__dict__[attr]
+
+        def setter(self, value):
+                self.__dict__[attr] = value
+
+        return property(getter, setter)
+
+
+class LazyFolder(Folder):
+        """
+        Folder whose subtree is decoded on first access to its contents.
+        loader(folder) fills the given empty folder, e.g. from a snapshot section.
+        """
+        folders = _lazy_field("folders")
+        contents = _lazy_field("contents")
+        children = _lazy_field("children")
+
+        def __init__(self, _name: str, parent_dir: Union["Virtual_Drive", Folder], loader: Callable[[Folder], None]):
+                self._loader = loader
+                self._lock = threading.Lock()
+                super().__init__(_name, parent_dir=parent_dir)
+
+        @property
+        def loaded(self) -> bool:
+                return self._loader is None
+
+        def _materialize(self) -> None:
+                with self._lock:
+                        if self._loader is None:
+                                return
+                        # Decode into a scratch folder so readers never see a half-built subtree
+                        loaded = Folder(self._name, parent_dir=self.parent_dir)
+                        self._loader(loaded)
+                        for item in loaded.contents:
+                                if isinstance(item, Folder):
+                                        item.parent_dir = self
+                        self.__dict__.update(_lazy_folders=loaded.folders, _lazy_contents=loaded.contents,
+                                             _lazy_children=loaded.children)
+                        self._loader = None
+
+
+def decode_section(reader: SnapshotReader, number: int, target: FileSystemObject, lazy: bool = False,
+                   reopen: Optional[Callable[[], Optional[SnapshotReader]]] = None) -> None:
+        """
+        Decode one snapshot section into target: the drive for section 0, the
+        matching top-level folder otherwise. Top-level folders found in section 0
+        are decoded right away, or left as LazyFolders when lazy is set; see
+        decode_lazy_section for reopen.
+        """
+        section = reader.section(number)
+        strings, hashes = section.strings, section.hashes
+        nodes = []
+        folder_paths = {}
+        for kind, parent, name, dir_or_metadata, path, blob, digest, size, mtime_ns in section.nodes():
+                index = len(nodes)
+                if parent == NO_PARENT:
+                        if kind == KIND_ROOT:
+                                target._name = strings[name]
+                                target.metadata = json.loads(strings[dir_or_metadata])
+                                folder_paths[index] = ""
+                        else:
+                                folder_paths[index] = strings[name]
+                        nodes.append(target)
+                        continue
+
+                parent_obj = nodes[parent]
+                if kind == KIND_FOLDER or kind == KIND_SECTION:
+                        if kind == KIND_SECTION and lazy:
+                                node = LazyFolder(strings[name], parent_obj, partial(decode_lazy_section, reader, path, reopen))
+                        else:
+                                node = Folder(strings[name], parent_dir=parent_obj)
+                        if strings[dir_or_metadata] != "{}":
+                                node.metadata = json.loads(strings[dir_or_metadata])
+                        parent_obj.add_folder(node._name, node)
+                        if kind == KIND_SECTION and not lazy:
+                                decode_section(reader, path, node)
+                        parent_path = folder_paths[parent]
+                        folder_paths[index] = f"{parent_path}/{node._name}" if parent_path else node._name
+                elif kind == KIND_FILE:
+                        file_name = strings[name]
+                        local_path = strings[path - 1] if path else strings[dir_or_metadata] + file_name
+                        if blob == BLOB_NONE:
+                                blob_name = None
+                        elif blob == BLOB_DERIVED:
+                                parent_path = folder_paths[parent]
+                                blob_name = f"{parent_path}/{file_name}" if parent_path else file_name
+                        else:
+                                blob_name = strings[blob - 2]
+                        node = FileEntry(file_name, local_path, size, mtime_ns,
+                                         hashes[digest - 1] if digest else None, blob_name)
+                        parent_obj.add_file(node)
+                elif kind == KIND_CHUNK:
+                        if parent_obj.chunks is None:
+                                parent_obj.chunks = []
+                        parent_obj.chunks.append(hashes[digest - 1])
+                        node = None
+                else:
+                        node = strings[name]
+                        parent_obj.contents.append(node)
+                nodes.append(node)
+
+
+def top_level_section(reader: SnapshotReader, name: str) -> Optional[int]:
+        """The section holding the top-level folder called name, if the snapshot has one"""
+        section = reader.section(0)
+        for kind, parent, name_index, _, path, *_ in section.nodes():
+                if kind == KIND_SECTION and parent == 0 and section.strings[name_index] == name:
+                        return path
+        return None
+
+
+def decode_lazy_section(reader: SnapshotReader, number: int, reopen: Optional[Callable[[], Optional[SnapshotReader]]],
+                        target: Folder) -> None:
+        """
+        Decode the section of a LazyFolder. Range reads of a remote snapshot are
+        pinned to the version that was opened; once it has been saved again,
+        its offsets no longer apply, so reopen() gives a reader for the
+        snapshot as it is now and the folder of the same name is decoded from
+        that instead (or left empty if it is gone).
+        """
+        for attempt in range(MAX_SNAPSHOT_REOPENS + 1):
+                try:
+                        if attempt:
+                                reader = reopen()
+                                number = top_level_section(reader, target._name) if reader is not None else None
+                                if number is None:
+                                        return
+                        decode_section(reader, number, target)
+                        return
+                except VersionConflict:
+                        if reopen is None or attempt == MAX_SNAPSHOT_REOPENS:
+                                raise
+
 
 @dataclass(kw_only=True)
 class Virtual_Drive(FileSystemObject):
+        DEFAULT_ACCOUNT_URL: ClassVar[str] = 'https://saccbox.blob.core.windows.net'
+        SNAPSHOT_FORMAT: ClassVar[str] = "binary"
+        # For uploads and for the snapshot and manifest writes outside the pipeline
+        RETRY_POLICY: ClassVar[RetryPolicy] = RetryPolicy()
+        # Times a snapshot or manifest write is redone on top of another writer's
+        MAX_SAVE_ATTEMPTS: ClassVar[int] = 10
+        # Splits large files into chunks for delta uploads, in the content-addressed layout only.
+        # Off without numpy: the pure Python loop would make large uploads CPU-bound
+        CHUNKER: ClassVar[Optional[Chunker]] = default_chunker()
+
         _name: str = "VD"
         id_counter: count = count()
         _id: int =  field(default_factory=lambda: next(Virtual_Drive.id_counter))
         _from_dict: bool = False
         storage_handler: StorageHandler = None
+        manifest: Optional[Manifest] = field(default=None, repr=False, compare=False)
+        # Set by use_content_store: files are then stored by content instead of by path
+        content_store: Optional[ContentStore] = field(default=None, repr=False, compare=False)
+        # (blob name, version) of the snapshot last loaded or saved, see snapshot_changed()
+        snapshot_version: Optional[tuple] = field(default=None, repr=False, compare=False)
 
         def __post_init__(self):
                 if not self._from_dict:
-                        default_folder = Folder(_name="default", parent_dir=self)
-                        self.folders['default'] = default_folder 
-                        self.contents.append(default_folder)
+                        self.add_folder("default")
         
         
         def show_contents(self) -> None:
@@ -131,71 +527,413 @@ class Virtual_Drive(FileSystemObject):
                                 print(item._name)
         
         
-        def upload_contents(self) -> None:
+        def mount_directory(self, dir_path: str, scan_workers: int = 0) -> Folder:
+                # Re-mounting a directory replaces the previous scan of it
+                mount_folder = self.scan_directory(dir_path, scan_workers)
+                self.check_remount(mount_folder)
+                self.replace_folder(mount_folder)
+                return mount_folder
+
+        def check_remount(self, mount_folder: Folder) -> None:
+                """
+                Raise unless mount_folder may replace the top-level folder with its
+                name: only a previous mount of the same directory is replaced, a
+                different directory with the same basename would lose its blobs.
+                """
+                existing = self.children.get(mount_folder._name)
+                if existing is None:
+                        return
+                source = mount_folder.metadata["mounted_from"]
+                if not isinstance(existing, Folder):
+                        raise ValueError(f"A file with the name {mount_folder._name} already exists.")
+                mounted_from = existing.metadata.get("mounted_from")
+                if mounted_from is None:
+                        # Mounted before the source was recorded: tell by where its files are
+                        paths = [entry.path for entry in existing.walk_files()]
+                        if paths and all(os.path.abspath(path).startswith(source + os.sep) for path in paths):
+                                return
+                elif mounted_from == source:
+                        return
+                raise ValueError(f"{mount_folder._name} is already mounted from {mounted_from or 'elsewhere'}.")
+
+        def use_content_store(self, storage_handler: Optional[StorageHandler] = None) -> ContentStore:
+                """
+                Switch the drive to the content-addressed layout, in the container of
+                storage_handler (by default the drive's own; give a shared one to
+                deduplicate across drives). Files already uploaded by path are moved
+                over the next time they are synced.
+                """
+                self.content_store = ContentStore.open(storage_handler or self.storage_handler)
+                return self.content_store
+
+        def upload_contents(self, workers: int = UploadPipeline.DEFAULT_WORKERS,
+                            max_in_flight: int = UploadPipeline.DEFAULT_MAX_IN_FLIGHT,
+                            folders: Optional[List[Folder]] = None,
+                            progress: Optional[Callable[[Optional[str], int], None]] = None) -> UploadStats:
+                """
+                Upload the drive incrementally against its manifest: unchanged files are
+                skipped and blobs of files that disappeared are deleted. When folders is
+                given only those top-level folders are uploaded and pruned. progress is
+                passed on to the UploadPipeline.
+                """
                 container_name = self.storage_handler.container_name
-                for item in self.contents:
-                        if isinstance(item, Folder):
-                                self.upload_folder(item, container_name)
-                        else:
-                                self.upload_file(item, container_name)
+                manifest = self.load_manifest()
+                items = self.contents if folders is None else folders
+                with UploadPipeline(self.storage_handler, container_name, workers, max_in_flight,
+                                    manifest=manifest, progress=progress, retry_policy=self.RETRY_POLICY,
+                                    content_store=self.content_store, chunker=self.CHUNKER) as pipeline:
+                        for item in items:
+                                if isinstance(item, Folder):
+                                        self.upload_folder(item, container_name, pipeline=pipeline)
+                                elif isinstance(item, FileEntry):
+                                        self.upload_file(item, container_name, pipeline=pipeline)
 
-        def upload_folder(self, folder: Folder, container_name: str, parent_name: Optional[str] = None) -> None:
+                prefixes = None if folders is None else [f"{folder._name}/" for folder in folders]
+                for blob_name in manifest.unseen(pipeline.seen, prefixes):
+                        if self.content_store is not None:
+                                for digest in manifest.entries[blob_name].content_digests():
+                                        self.content_store.release(digest)
+                        self.storage_handler.delete_blob(container_name, blob_name)
+                        manifest.remove(blob_name)
+                        pipeline.stats.deleted += 1
+                # The manifest goes first: references saved without it would be taken again on the next sync
+                self.save_manifest()
+                if self.content_store is not None:
+                        self.RETRY_POLICY.call(self.content_store.delete_orphans)
+                return pipeline.stats
+
+        def redrive_uploads(self, failures: List[FailedUpload],
+                            workers: int = UploadPipeline.DEFAULT_WORKERS) -> UploadStats:
+                """
+                Upload the dead letters of an earlier run again, in the drive's layout, and
+                save the drive; whatever still fails is in the returned stats.
+                """
+                with UploadPipeline(self.storage_handler, self.storage_handler.container_name, workers,
+                                    manifest=self.load_manifest(), retry_policy=self.RETRY_POLICY,
+                                    content_store=self.content_store, chunker=self.CHUNKER) as pipeline:
+                        pipeline.redrive(failures, self.resolve)
+                self.save_manifest()
+                self.save_to_remote()
+                return pipeline.stats
+
+        def sync_directory(self, dir_path: str, workers: int = UploadPipeline.DEFAULT_WORKERS,
+                           max_in_flight: int = UploadPipeline.DEFAULT_MAX_IN_FLIGHT,
+                           scan_workers: int = 0,
+                           on_mounted: Optional[Callable[[Folder], None]] = None,
+                           progress: Optional[Callable[[Optional[str], int], None]] = None) -> UploadStats:
+                """
+                Mount (or re-mount) a directory, upload only what changed and save the drive.
+                The directory is scanned and uploaded into a new folder that only replaces
+                the previous mount once the upload is done, so readers of the drive never
+                see a half-built mount. on_mounted is called with the scanned folder before
+                the upload starts. Raises ValueError if another directory with the same
+                name is mounted.
+                """
+                mount_folder = self.scan_directory(dir_path, scan_workers)
+                self.check_remount(mount_folder)
+                if on_mounted is not None:
+                        on_mounted(mount_folder)
+                upload_stats = self.upload_contents(workers, max_in_flight, folders=[mount_folder], progress=progress)
+                for attempt in range(self.MAX_SAVE_ATTEMPTS):
+                        self.replace_folder(mount_folder)
+                        try:
+                                self.save_to_remote()
+                                return upload_stats
+                        except VersionConflict:
+                                # Saved by another process meanwhile (e.g. with a mount of its own): mount on top of that
+                                self.reload_from_remote()
+                                self.check_remount(mount_folder)
+                raise VersionConflict(f"Drive {self._id} kept changing, gave up after {self.MAX_SAVE_ATTEMPTS} attempts")
+
+        def upload_folder(self, folder: Folder, container_name: str, parent_name: Optional[str] = None,
+                          pipeline: Optional[UploadPipeline] = None) -> None:
                 # Create a blob for the folder and upload its contents recursively
                 if parent_name:
                         folder_path = f"{parent_name}/{folder._name}"
                 else:
                         folder_path = folder._name
                 folder_path_name = f"{folder_path}/"
-                self.storage_handler.upload_from_bytes(
-                container_name, folder_path_name, b""
-                )  # Create a blob for the folder
+                # In the content-addressed layout folders only exist in the snapshot
+                if self.content_store is None:
+                        if pipeline:
+                                pipeline.submit(folder_path_name, data=b"")
+                        else:
+                                self.storage_handler.upload_from_bytes(
+                                container_name, folder_path_name, b""
+                                )  # Create a blob for the folder
                 for item in folder.contents:
                         if isinstance(item, Folder):
-                                self.upload_folder(item, container_name, folder_path)
-                        else:
-                                self.upload_file(item, container_name, folder_path)
+                                self.upload_folder(item, container_name, folder_path, pipeline)
+                        elif isinstance(item, FileEntry):
+                                self.upload_file(item, container_name, folder_path, pipeline)
 
-        def upload_file(self, file_obj: object, container_name: str, folder_name: Optional[str] = None) -> None:
+        def upload_file(self, file_obj: FileEntry, container_name: str, folder_name: Optional[str] = None,
+                        pipeline: Optional[UploadPipeline] = None) -> None:
                 # Upload a file to Azure Blob Storage
-                file_name = file_obj._name if hasattr(file_obj, "_name") else ""
-                blob_name = f"{folder_name}/{file_name}" if folder_name else file_name
-                with open(file_obj.name, "rb") as f:
-                        self.storage_handler.upload_from_bytes(container_name, blob_name, f.read())
+                blob_name = f"{folder_name}/{file_obj._name}" if folder_name else file_obj._name
+                file_obj.blob_name = blob_name
+                if pipeline:
+                        pipeline.submit(blob_name, path=file_obj.path, file_entry=file_obj)
+                        return
+                upload_path(self.storage_handler, container_name, blob_name, file_obj.path)
 
         def add_remote(self, storage_handler: StorageHandler) -> None:
                 self.storage_handler = storage_handler
+
+        @classmethod
+        def default_remote(cls, drive_id: int) -> StorageHandler:
+                return AzureStorageHandler(cls.DEFAULT_ACCOUNT_URL, container_name=f'virtual-drive-{drive_id}')
         
-        def save_to_remote(self) -> None:
+        @staticmethod
+        def snapshot_name(drive_id: int, snapshot_format: str) -> str:
+                extension = "ccbx" if snapshot_format == "binary" else "json"
+                return f'virtual_drive_{drive_id}.{extension}'
+
+        def save_to_remote(self, snapshot_format: Optional[str] = None) -> None:
+                """
+                Save a snapshot of the drive in the given format ("binary" or "json").
+                A snapshot this drive was loaded from or saved as is only replaced if
+                nobody saved it since; otherwise VersionConflict is raised, see
+                reload_from_remote().
+                """
                 if self.storage_handler:
-                        object_name = f'virtual_drive_{self._id}.json'
-                        vd_dict = self.to_dict()
-                        self.storage_handler.upload_json(vd_dict, object_name)
+                        snapshot_format = snapshot_format or self.SNAPSHOT_FORMAT
+                        object_name = self.snapshot_name(self._id, snapshot_format)
+                        known = self.snapshot_version is not None and self.snapshot_version[0] == object_name
+                        if snapshot_format == "binary":
+                                data = self.to_bytes()
+                                if known:
+                                        version = self.RETRY_POLICY.call(self.storage_handler.upload_bytes_versioned, data,
+                                                                         object_name, self.snapshot_version[1])
+                                else:
+                                        self.RETRY_POLICY.call(self.storage_handler.upload_from_bytes,
+                                                               self.storage_handler.container_name, object_name, data)
+                        else:
+                                vd_dict = self.to_dict()
+                                if known:
+                                        version = self.RETRY_POLICY.call(self.storage_handler.upload_json_versioned, vd_dict,
+                                                                         object_name, self.snapshot_version[1])
+                                else:
+                                        self.RETRY_POLICY.call(self.storage_handler.upload_json, vd_dict, object_name)
+                        if not known:
+                                version = self.storage_handler.blob_version(object_name)
+                        self.snapshot_version = (object_name, version)
                 else:
                         print("Storage handler not configured.")
 
-        def load_from_remote(self, object_name: str) -> None:
+        def reload_from_remote(self) -> "Virtual_Drive":
+                """Load the drive's snapshot again, keeping its remote, manifest and content store"""
+                kept = self.storage_handler, self.manifest, self.content_store
+                self.load_from_remote(self.snapshot_version[0] if self.snapshot_version else None)
+                self.storage_handler, self.manifest, self.content_store = kept
+                return self
+
+        def load_from_remote(self, object_name: Optional[str] = None, lazy: bool = False) -> "Virtual_Drive":
+                """
+                Load a snapshot into this drive. Without an object name the configured
+                snapshot format is tried first, then the other one. With lazy, a binary
+                snapshot is read with range requests: only the first level is loaded and
+                each top-level folder is fetched and decoded when first accessed.
+                """
                 if self.storage_handler:
-                        vd_dict = self.storage_handler.download_json(object_name)
-                        loaded_vd = Virtual_Drive.from_dict(vd_dict)
-                        self.__dict__.update(loaded_vd.__dict__)
+                        if object_name is None:
+                                formats = [self.SNAPSHOT_FORMAT] + [f for f in ("binary", "json") if f != self.SNAPSHOT_FORMAT]
+                                object_names = [self.snapshot_name(self._id, f) for f in formats]
+                        else:
+                                object_names = [object_name]
+                        snapshot_version = (object_names[0], None)
+                        for name in object_names:
+                                # Read first, so a save during the download shows up as a change later
+                                version = self.storage_handler.blob_version(name)
+                                loaded_vd = self._download_snapshot(name, lazy)
+                                if loaded_vd is not None:
+                                        self.__dict__.update(loaded_vd.__dict__)
+                                        snapshot_version = (name, version)
+                                        break
+                        self.snapshot_version = snapshot_version
                 else:
                         print("Storage handler not configured.")
+                return self
+
+        def snapshot_changed(self) -> bool:
+                """Whether the snapshot was saved since this drive loaded or saved it, e.g. by another process"""
+                if self.storage_handler is None or self.snapshot_version is None:
+                        return False
+                name, version = self.snapshot_version
+                return self.storage_handler.blob_version(name) != version
+
+        def _download_snapshot(self, object_name: str, lazy: bool = False) -> Optional["Virtual_Drive"]:
+                if object_name.endswith(".ccbx"):
+                        if lazy:
+                                reopen = partial(self._open_snapshot, object_name)
+                                reader = reopen()
+                                return Virtual_Drive.from_snapshot(reader, lazy=True, reopen=reopen) if reader else None
+                        data = self.storage_handler.download_bytes(object_name)
+                        return Virtual_Drive.from_bytes(data) if data else None
+                vd_dict = self.storage_handler.download_json(object_name)
+                return Virtual_Drive.from_dict(vd_dict) if vd_dict else None
+
+        def _open_snapshot(self, object_name: str) -> Optional[SnapshotReader]:
+                """A reader for the current version of a binary snapshot, whose later range reads stay on that version"""
+                storage_handler = self.storage_handler
+                prefix, version = storage_handler.download_range_versioned(object_name, 0, PREFETCH_SIZE)
+                if not prefix:
+                        return None
+
+                def fetch(offset: int, length: Optional[int]) -> bytes:
+                        data, _ = storage_handler.download_range_versioned(object_name, offset, length, version)
+                        return data
+
+                return SnapshotReader(prefix, fetch)
+
+        def load_manifest(self) -> Manifest:
+                if self.manifest is None:
+                        self.manifest = Manifest.from_dict(*self.RETRY_POLICY.call(
+                                self.storage_handler.download_json_versioned, Manifest.object_name(self._id)))
+                return self.manifest
+
+        def save_manifest(self) -> None:
+                """
+                Write the manifest unless another writer saved it meanwhile, in which
+                case its changes are merged in first (see Manifest.rebase), then save
+                the content store's reference changes.
+                """
+                if self.manifest is not None:
+                        object_name = Manifest.object_name(self._id)
+                        with self.manifest.saving:
+                                for attempt in range(self.MAX_SAVE_ATTEMPTS):
+                                        data, entries = self.manifest.snapshot()
+                                        try:
+                                                version = self.RETRY_POLICY.call(self.storage_handler.upload_json_versioned,
+                                                                                 data, object_name, self.manifest.version)
+                                        except VersionConflict:
+                                                remote = Manifest.from_dict(*self.RETRY_POLICY.call(
+                                                        self.storage_handler.download_json_versioned, object_name))
+                                                self._settle(self.manifest.rebase(remote))
+                                                continue
+                                        self.manifest.stored(version, entries)
+                                        break
+                                else:
+                                        raise VersionConflict(f"{object_name} kept changing, gave up after "
+                                                              f"{self.MAX_SAVE_ATTEMPTS} attempts")
+                if self.content_store is not None:
+                        self.RETRY_POLICY.call(self.content_store.save)
+
+        def _settle(self, both_changed: List[tuple]) -> None:
+                """
+                Undo what another writer did to blobs this drive changed too, now that
+                this drive's entries are kept: its reference on its own entry is dropped
+                and the one it dropped on the entry both started from is taken back.
+                """
+                for blob_name, theirs, base in both_changed:
+                        if self.content_store is not None:
+                                for digest in theirs.content_digests() if theirs is not None else ():
+                                        self.content_store.release(digest)
+                                for digest in base.content_digests() if base is not None else ():
+                                        record = self.content_store.records.get(digest)
+                                        self.content_store.add_stored(digest, record.size if record else base.size)
+                        elif theirs is not None and blob_name not in self.manifest.entries:
+                                # Uploaded by the other writer, deleted by this one
+                                self.storage_handler.delete_blob(self.storage_handler.container_name, blob_name)
         
-        def to_dict(self) -> dict:
+        def to_dict(self, depth: Optional[int] = None) -> dict:
+                child_depth = None if depth is None else depth - 1
                 return {
                 "_id": self._id,
                 "_name": self._name,
-                "folders": {name: f.to_dict() for name, f in self.folders.items()},
-                "contents": [f.to_dict() if isinstance(f, Folder) else str(f) for f in self.contents],
+                "folders": {name: f.to_dict(child_depth) for name, f in self.folders.items()},
+                "contents": [_item_to_dict(f, child_depth) for f in self.contents],
                 "metadata": self.metadata,
-                "storage_handler": self.storage_handler.to_dict()
+                "storage_handler": self.storage_handler.to_dict() if self.storage_handler else None,
+                "content_store": self.content_store.storage_handler.to_dict() if self.content_store else None
                 }
         
+        def _json_parts(self, depth: Optional[int]) -> Iterator[str]:
+                yield from self._json_members(None if depth is None else depth - 1,
+                                              {"_id": self._id, "_name": self._name},
+                                              {"metadata": self.metadata,
+                                               "storage_handler": self.storage_handler.to_dict() if self.storage_handler else None,
+                                               "content_store": self.content_store.storage_handler.to_dict() if self.content_store else None})
+
         @classmethod
         def from_dict(cls, data:dict) -> "Virtual_Drive":
                 obj = super().from_dict(data)
-                obj.add_remote(storage_handler=AzureStorageHandler.from_dict({
-                        "account_url" : data["storage_handler"]["account_url"],
-                        "container_name" : data["storage_handler"]["container_name"]
-                }))
+                obj._id = data["_id"]
+                if data["storage_handler"]:
+                        obj.add_remote(storage_handler=storage_handler_from_dict(data["storage_handler"]))
+                if data.get("content_store"):
+                        obj.use_content_store(storage_handler_from_dict(data["content_store"]))
+                return obj
+
+        def to_bytes(self, compress: bool = True) -> bytes:
+                """
+                Encode the drive in the binary snapshot format described in ccbox.snapshot,
+                with every top-level folder in its own section.
+                """
+                writer = SnapshotWriter({
+                        "_id": self._id,
+                        "storage_handler": self.storage_handler.to_dict() if self.storage_handler else None,
+                        "content_store": self.content_store.storage_handler.to_dict() if self.content_store else None
+                })
+                root_section = writer.sections[0]
+                root = root_section.add_node(KIND_ROOT, NO_PARENT, root_section.intern(self._name),
+                                             root_section.intern(json.dumps(self.metadata)))
+                for item in self.contents:
+                        if isinstance(item, Folder):
+                                number = writer.new_section()
+                                metadata = json.dumps(item.metadata) if item.metadata else "{}"
+                                root_section.add_node(KIND_SECTION, root, root_section.intern(item._name),
+                                                      root_section.intern(metadata), number)
+                                self._encode_subtree(writer.sections[number], item, NO_PARENT)
+                        else:
+                                self._encode_subtree(root_section, item, root)
+                return writer.to_bytes(compress)
+
+        @staticmethod
+        def _encode_subtree(section: SectionWriter, top: Union[Folder, FileEntry, str], parent: int) -> None:
+                stack = [(top, parent, "")]
+                while stack:
+                        item, parent, folder_path = stack.pop()
+                        if isinstance(item, Folder):
+                                metadata = json.dumps(item.metadata) if item.metadata else "{}"
+                                index = section.add_node(KIND_FOLDER, parent, section.intern(item._name), section.intern(metadata))
+                                path = f"{folder_path}/{item._name}" if folder_path else item._name
+                                stack.extend((child, index, path) for child in reversed(item.contents))
+                        elif isinstance(item, FileEntry):
+                                if item.path.endswith(item._name):
+                                        directory, path = section.intern(item.path[:len(item.path) - len(item._name)]), 0
+                                else:
+                                        directory, path = 0, section.intern(item.path) + 1
+                                derived_blob_name = f"{folder_path}/{item._name}" if folder_path else item._name
+                                if item.blob_name is None:
+                                        blob = BLOB_NONE
+                                elif item.blob_name == derived_blob_name:
+                                        blob = BLOB_DERIVED
+                                else:
+                                        blob = section.intern(item.blob_name) + 2
+                                index = section.add_node(KIND_FILE, parent, section.intern(item._name), directory, path,
+                                                         blob, section.intern_hash(item.sha256), item.size, item.mtime_ns)
+                                for chunk in item.chunks or ():
+                                        section.add_node(KIND_CHUNK, index, 0, digest=section.intern_hash(chunk))
+                        else:
+                                section.add_node(KIND_STRING, parent, section.intern(str(item)))
+
+        @classmethod
+        def from_bytes(cls, data: bytes, lazy: bool = False) -> "Virtual_Drive":
+                return cls.from_snapshot(SnapshotReader(data), lazy)
+
+        @classmethod
+        def from_snapshot(cls, reader: SnapshotReader, lazy: bool = False,
+                          reopen: Optional[Callable[[], Optional[SnapshotReader]]] = None) -> "Virtual_Drive":
+                """
+                Build a drive from a snapshot; lazily decodes top-level folders on first
+                access if lazy. reopen reads the snapshot again if it changed meanwhile
+                (see decode_lazy_section).
+                """
+                obj = cls(_id=reader.info["_id"], _from_dict=True)
+                decode_section(reader, 0, obj, lazy, reopen)
+                if reader.info["storage_handler"]:
+                        obj.add_remote(storage_handler=storage_handler_from_dict(reader.info["storage_handler"]))
+                if reader.info.get("content_store"):
+                        obj.use_content_store(storage_handler_from_dict(reader.info["content_store"]))
                 return obj
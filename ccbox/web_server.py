@@ -1,14 +1,131 @@
+from typing import Union, List, Dict, Optional, Any, ClassVar, Tuple, Iterable, Iterator, Callable
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, request, jsonify
-from tornado.wsgi import WSGIContainer
 from tornado.httpserver import HTTPServer
 from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+from tornado.process import fork_processes
+from tornado.web import Application, RequestHandler, HTTPError
 import threading
 import logging
+import json
 
-from ccbox.virtual_drive import Virtual_Drive, Folder
+from ccbox.virtual_drive import Virtual_Drive, Folder, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 from ccbox.user import User, UserDatabase
 from ccbox.authentication import Authentication
-from ccbox.storage_handler import AzureStorageHandler
+from ccbox.storage_handler import AzureStorageHandler, azure_clients
+from ccbox.jobs import mount_jobs
+from ccbox.content_store import ContentStore
+
+# The routes below are plain blocking functions returning (JSON body, status);
+# the Flask app and the native Tornado handlers are both thin layers over them.
+Response = Tuple[dict, int]
+
+
+def register_user(username: Optional[str], password: Optional[str]) -> Response:
+        if not username or not password:
+                return {'error': 'Username and password are required'}, 400
+
+        authenticated_user = Authentication.register(username, password)
+        if authenticated_user:
+                return {'message': 'User created and logged in successfully'}, 200
+        else:
+                return {'error': 'Failed to create user'}, 400
+
+def register_users_bulk(users: Iterable[dict]) -> Response:
+        result = Authentication.register_bulk((user.get('username'), user.get('password')) for user in users)
+        logging.info(f"Bulk registration: {result}")
+        return result.to_dict(), 200
+
+def parse_users(body: bytes, ndjson: bool) -> List[dict]:
+        """
+        The users of a bulk registration body: {"users": [...]}, or one JSON user
+        per line with ndjson. ValueError, naming the line, if it is malformed.
+        """
+        if ndjson:
+                users = []
+                for number, line in enumerate(body.splitlines(), 1):
+                        if not line.strip():
+                                continue
+                        try:
+                                user = json.loads(line)
+                        except ValueError:
+                                raise ValueError(f"Invalid JSON on line {number}")
+                        if not isinstance(user, dict):
+                                raise ValueError(f"Line {number} is not a JSON object")
+                        users.append(user)
+                return users
+        try:
+                users = json.loads(body or b"{}").get('users', [])
+        except (ValueError, AttributeError):
+                raise ValueError("Expected a JSON object with a list of users")
+        if not isinstance(users, list) or not all(isinstance(user, dict) for user in users):
+                raise ValueError("Expected a list of JSON objects as users")
+        return users
+
+def register_users_from_body(body: bytes, ndjson: bool) -> Response:
+        try:
+                users = parse_users(body, ndjson)
+        except ValueError as e:
+                return {'error': str(e)}, 400
+        return register_users_bulk(users)
+
+def login_user(username: Optional[str], password: Optional[str]) -> Response:
+        if not username or not password:
+                return {'error': 'Username and password are required'}, 400
+
+        authenticated_user = Authentication.login(username, password)
+        if authenticated_user:
+                return {'message': 'Login successful'}, 200
+        else:
+                return {'error': 'Incorrect username or password'}, 401
+
+def mount_user_directory(username: Optional[str], dir_path: Optional[str]) -> Response:
+        if not username or not dir_path:
+                return {'error': 'Username and dir_path are required'}, 400
+
+        # Scan and upload in the background; the client polls /jobs/<job_id>
+        job = mount_jobs.submit_mount(username, dir_path)
+        if not job:
+                return {'error': 'User not found'}, 404
+
+        return {'message': 'Mount started', 'job_id': job.id, 'job': job.to_dict()}, 202
+
+def mount_job(job_id: str) -> Response:
+        job = mount_jobs.get(job_id)
+        if not job:
+                return {'error': 'Job not found'}, 404
+
+        return job.to_dict(), 200
+
+def virtual_drive_json(username: str, depth: Optional[int] = None) -> Optional[Iterator[str]]:
+        """Chunks of the drive's JSON, optionally only the first few levels; None if the user does not exist"""
+        user = Authentication.user_database.get_user_from_db(username)
+        if not user:
+                return None
+
+        return user.virtual_drive.iter_json(depth)
+
+def list_virtual_drive(username: str, path: str = "", depth: Optional[int] = 1,
+                       limit: Optional[int] = None, cursor: Optional[str] = None) -> Response:
+        user = Authentication.user_database.get_user_from_db(username)
+        if not user:
+                return {'error': 'User not found'}, 404
+
+        # One page of one folder, so browsing does not serialize the whole drive
+        limit = min(max(limit or DEFAULT_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+        try:
+                listing = user.virtual_drive.list_contents(path, depth, limit, cursor)
+        except ValueError as e:
+                return {'error': str(e)}, 400
+        if listing is None:
+                return {'error': 'Path not found'}, 404
+
+        return listing, 200
+
+def cache_stats() -> Response:
+        return Authentication.user_database.cache_stats().to_dict(), 200
+
 
 app = Flask(__name__)
 
@@ -16,90 +133,216 @@ app = Flask(__name__)
 @app.route('/register', methods=['POST'])
 def register():
         data = request.get_json()
-        username = data.get('username')
-        password = data.get('password')
-        if not username or not password:
-                return jsonify({'error': 'Username and password are required'}), 400
-        
-        authenticated_user = Authentication.register(username, password)
-        if authenticated_user:
-                return jsonify({'message': 'User created and logged in successfully'})
-        else:
-                return jsonify({'error': 'Failed to create user'}), 400
+        body, status = register_user(data.get('username'), data.get('password'))
+        return jsonify(body), status
+
+# Route for registering many users at once, from {"users": [...]} or one JSON user per line
+@app.route('/register/bulk', methods=['POST'])
+def register_bulk():
+        body, status = register_users_from_body(request.get_data(), request.mimetype == 'application/x-ndjson')
+        return jsonify(body), status
 
 # Route for logging in a user
 @app.route('/login', methods=['POST'])
 def login():
         data = request.get_json()
-        username = data.get('username')
-        password = data.get('password')
-        if not username or not password:
-                return jsonify({'error': 'Username and password are required'}), 400
-        
-        authenticated_user = Authentication.login(username, password)
-        if authenticated_user:
-                return jsonify({'message': 'Login successful'})
-        else:
-                return jsonify({'error': 'Incorrect username or password'}), 401
+        body, status = login_user(data.get('username'), data.get('password'))
+        return jsonify(body), status
 
 # Route for mounting a directory to virtual drive
 @app.route('/mount', methods=['POST'])
 def mount_directory():
         data = request.get_json()
-        username = data.get('username')
-        dir_path = data.get('dir_path')
-        
-        # Get user from database
-        user = Authentication.user_database.get_user_from_db(username)
-        if not user:
-                return jsonify({'error': 'User not found'}), 404
-        
-        # Create Azure Storage Handler
-        account_url = 'https://saccbox.blob.core.windows.net'
-        container_name = f'virtual-drive-{user.virtual_drive._id}'
-        azure_storage = AzureStorageHandler(account_url, container_name=container_name)
-        
-        # Mount directory to virtual drive
-        user.virtual_drive.add_remote(azure_storage)
-        user.virtual_drive.mount_directory(dir_path)
-        
-        # Upload contents to Azure Storage
-        user.virtual_drive.upload_contents()
-        
-        return jsonify({'message': 'Directory mounted successfully'})
-
-# Route for accessing virtual drive contents
+        body, status = mount_user_directory(data.get('username'), data.get('dir_path'))
+        return jsonify(body), status
+
+# Route for polling a mount job
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_mount_job(job_id):
+        body, status = mount_job(job_id)
+        return jsonify(body), status
+
+# Route for accessing virtual drive contents, streamed as it is serialized
 @app.route('/virtual_drive/<username>/contents', methods=['GET'])
 def get_virtual_drive_contents(username):
-        # Get user from database
-        user = Authentication.user_database.get_user_from_db(username)
-        if not user:
+        chunks = virtual_drive_json(username, request.args.get('depth', type=int))
+        if chunks is None:
                 return jsonify({'error': 'User not found'}), 404
-        
-        # Serialize virtual drive contents to JSON
-        virtual_drive_contents = user.virtual_drive.to_dict()
-        return jsonify(virtual_drive_contents)
+        return app.response_class(chunks, mimetype='application/json')
+
+# Route for listing one folder of a virtual drive a page at a time
+@app.route('/virtual_drive/<username>/list', methods=['GET'])
+def get_virtual_drive_listing(username):
+        body, status = list_virtual_drive(username, request.args.get('path', ''), request.args.get('depth', 1, type=int),
+                                          request.args.get('limit', type=int), request.args.get('cursor'))
+        return jsonify(body), status
+
+# Route for sizing the user cache
+@app.route('/stats/cache', methods=['GET'])
+def get_cache_stats():
+        body, status = cache_stats()
+        return jsonify(body), status
+
+
+class ApiHandler(RequestHandler):
+        """
+        Base for the native Tornado handlers: the blocking route functions run
+        on an executor so the IOLoop keeps serving other requests meanwhile.
+        """
+
+        def initialize(self, executor: ThreadPoolExecutor) -> None:
+                self.executor = executor
+
+        def json_body(self) -> dict:
+                try:
+                        return json.loads(self.request.body or b"{}")
+                except ValueError:
+                        return {}
+
+        def int_argument(self, name: str, default: Optional[int] = None) -> Optional[int]:
+                """The query argument name as an int; a 400 is answered if it is not one"""
+                value = self.get_query_argument(name, None)
+                if value is None:
+                        return default
+                try:
+                        return int(value)
+                except ValueError:
+                        raise HTTPError(400, reason=f"Invalid {name} {value!r}")
+
+        def write_error(self, status_code: int, **kwargs) -> None:
+                self.finish({'error': self._reason})
+
+        async def respond(self, route: Callable[..., Response], *args) -> None:
+                body, status = await IOLoop.current().run_in_executor(self.executor, route, *args)
+                self.set_status(status)
+                self.write(body)
+
+
+class RegisterHandler(ApiHandler):
+        async def post(self):
+                data = self.json_body()
+                await self.respond(register_user, data.get('username'), data.get('password'))
+
+
+class RegisterBulkHandler(ApiHandler):
+        async def post(self):
+                # Parsed on the executor too: a large import must not hold up the IOLoop
+                ndjson = self.request.headers.get('Content-Type', '').startswith('application/x-ndjson')
+                await self.respond(register_users_from_body, self.request.body, ndjson)
+
+
+class LoginHandler(ApiHandler):
+        async def post(self):
+                data = self.json_body()
+                await self.respond(login_user, data.get('username'), data.get('password'))
+
+
+class MountHandler(ApiHandler):
+        async def post(self):
+                data = self.json_body()
+                await self.respond(mount_user_directory, data.get('username'), data.get('dir_path'))
+
+
+class JobHandler(ApiHandler):
+        async def get(self, job_id):
+                await self.respond(mount_job, job_id)
+
+
+class ContentsHandler(ApiHandler):
+        async def get(self, username):
+                depth = self.int_argument('depth')
+                loop = IOLoop.current()
+                chunks = await loop.run_in_executor(self.executor, virtual_drive_json, username, depth)
+                if chunks is None:
+                        self.set_status(404)
+                        self.write({'error': 'User not found'})
+                        return
+                self.set_header('Content-Type', 'application/json; charset=UTF-8')
+                # Serialize on the executor (lazy folders may be fetched) and send each chunk as it is made
+                while True:
+                        chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+                        if chunk is None:
+                                break
+                        self.write(chunk)
+                        await self.flush()
+
+
+class ListHandler(ApiHandler):
+        async def get(self, username):
+                await self.respond(list_virtual_drive, username, self.get_query_argument('path', ''),
+                                   self.int_argument('depth', 1), self.int_argument('limit'),
+                                   self.get_query_argument('cursor', None))
+
+
+class CacheStatsHandler(ApiHandler):
+        async def get(self):
+                await self.respond(cache_stats)
+
+
+def make_app(executor: ThreadPoolExecutor) -> Application:
+        """
+        The web API as a native Tornado application. Mounts only queue a job
+        here; the scans and uploads run on the job scheduler's own pool.
+        """
+        options = dict(executor=executor)
+        return Application([
+                (r'/register', RegisterHandler, options),
+                (r'/register/bulk', RegisterBulkHandler, options),
+                (r'/login', LoginHandler, options),
+                (r'/mount', MountHandler, options),
+                (r'/jobs/([0-9a-f]+)', JobHandler, options),
+                (r'/virtual_drive/([^/]+)/contents', ContentsHandler, options),
+                (r'/virtual_drive/([^/]+)/list', ListHandler, options),
+                (r'/stats/cache', CacheStatsHandler, options),
+        ])
 
 
 class TornadoServer:
-        def __init__(self, flask_app, port):
-                self.flask_app = flask_app
+        """
+        Serves the web API with native async handlers. With processes other
+        than 1 the listening socket is bound once and shared by that many
+        forked workers (0 means one per CPU), each with its own IOLoop,
+        executors and database connections. mount_workers bounds the mount
+        jobs each process runs at once; only the first process resumes the
+        jobs an earlier run left unfinished.
+        """
+        DEFAULT_WORKERS: ClassVar[int] = 16
+        DEFAULT_MOUNT_WORKERS: ClassVar[int] = 4
+
+        def __init__(self, port: int, processes: int = 1, workers: int = DEFAULT_WORKERS,
+                     mount_workers: int = DEFAULT_MOUNT_WORKERS, address: str = ""):
                 self.port = port
-                self.http_server = HTTPServer(WSGIContainer(self.flask_app))
-                self.server_thread = threading.Thread(target=self.start_server)
-                self.server_thread.daemon = False
-                self.server_thread.start()
+                self.processes = processes
+                self.workers = workers
+                self.mount_workers = mount_workers
+                self.address = address
 
         def start_server(self):
                 try:
                         logging.info(f"Starting Tornado server on port {self.port}")
-                        self.http_server.listen(self.port)
-                        IOLoop.instance().start()
+                        sockets = bind_sockets(self.port, self.address)
+                        task_id = 0
+                        if self.processes != 1:
+                                task_id = fork_processes(self.processes)
+                                # Connections, clients and queued writes must not be shared with the parent
+                                Authentication.user_database.reset()
+                                Authentication.hasher.reset()
+                                # Drives cached here may be saved by the other workers
+                                Authentication.user_database.verify_cached = True
+                                azure_clients.reset()
+                                ContentStore.close_all()
+                        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ccbox-web")
+                        mount_jobs.max_concurrent = self.mount_workers
+                        if task_id == 0:
+                                mount_jobs.resume()
+                        http_server = HTTPServer(make_app(executor))
+                        http_server.add_sockets(sockets)
+                        IOLoop.current().start()
                 except Exception as e:
                         logging.error(f"Failed to start Tornado server: {e}")
 
 
 if __name__ == '__main__':
         logging.basicConfig(level=logging.ERROR)
-        tornado_server = TornadoServer(app, port=5000)  
-
+        tornado_server = TornadoServer(port=5000, processes=0)
+        tornado_server.start_server()
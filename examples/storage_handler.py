@@ -26,7 +26,7 @@ if __name__ == "__main__":
                 container_name = f'virtual-drive-0'
                 azure_storage = AzureStorageHandler(account_url, container_name=container_name)
                 vd.add_remote(azure_storage)
-                vd.load_from_remote('virtual_drive_0.json')  # Load from Azure Storage
+                vd.load_from_remote()  # Load the saved snapshot, binary or JSON, from Azure Storage
                 print(vd.to_dict())
         
         retrieve_vd()
\ No newline at end of file
@@ -12,4 +12,8 @@ setup(
     install_requires=[
         'requests',
     ],
+    extras_require={
+        # Vectorized content-defined chunking
+        'fast': ['numpy'],
+    },
 )
\ No newline at end of file
@@ -0,0 +1,162 @@
+import pytest
+import asyncio
+import json
+import threading
+import time
+from unittest.mock import MagicMock
+from ccbox.api_server import ApiServer, ApiCommands
+from ccbox.authentication import Authentication
+from ccbox.virtual_drive import Virtual_Drive
+from ccbox.protocol import FramedClient, encode_frame, read_frame
+
+
+@pytest.fixture
+def api_server(mocker):
+        mocker.patch('ccbox.api_server.Logger')
+        return ApiServer('127.0.0.1', 0, workers=2)
+
+async def read_welcome(reader):
+        await reader.readline()
+        await reader.readline()
+
+def test_execute_command(mocker):
+        mocker.patch.object(Authentication, 'login', return_value=MagicMock())
+        commands = ApiCommands(MagicMock())
+
+        assert commands.execute_command("login alice secret") == "Login successful\n\r"
+        assert commands.execute_command("login alice") == "Invalid command\n\r"
+        assert commands.execute_command("help").startswith("Available commands")
+
+def test_list_command(mocker):
+        user = MagicMock()
+        user.virtual_drive = Virtual_Drive()
+        mocker.patch.object(Authentication.user_database, 'get_user_from_db', return_value=user)
+        commands = ApiCommands(MagicMock())
+
+        listing = json.loads(commands.execute_command("list alice / limit=1"))
+        assert [item["_name"] for item in listing["items"]] == ["default"]
+        assert commands.execute_command("contents alice deep") == "Invalid depth\n\r"
+        assert json.loads("".join(commands.execute_command("contents alice"))) == user.virtual_drive.to_dict()
+        assert commands.execute_command("list alice missing") == "Path not found\n\r"
+
+def test_only_the_command_word_is_case_insensitive(mocker):
+        user = MagicMock()
+        user.virtual_drive = Virtual_Drive()
+        user.virtual_drive.folders['default'].add_folder('Documents')
+        get_user = mocker.patch.object(Authentication.user_database, 'get_user_from_db', return_value=user)
+        commands = ApiCommands(MagicMock())
+
+        listing = json.loads(commands.execute_command("LIST Alice default/Documents"))
+        assert listing["path"] == "default/Documents"
+        get_user.assert_called_once_with("Alice")
+
+def test_commands_run_off_the_event_loop(api_server, mocker):
+        threads = []
+
+        def login(username, password):
+                threads.append(threading.current_thread().name)
+                return MagicMock()
+
+        mocker.patch.object(Authentication, 'login', side_effect=login)
+
+        async def scenario():
+                await api_server.start()
+                reader, writer = await asyncio.open_connection('127.0.0.1', api_server.port)
+                await read_welcome(reader)
+                writer.write(b"login alice secret\n")
+                response = await reader.readline()
+                writer.write(b"quit\n")
+                goodbye = await reader.readline()
+                closed = await reader.read()
+                writer.close()
+                await api_server.close()
+                return response, goodbye, closed
+
+        response, goodbye, closed = asyncio.run(scenario())
+
+        # Responses end in "\n\r", so every line after the first starts with the previous "\r"
+        assert response.strip() == b"Login successful"
+        assert goodbye.strip().startswith(b"Closing connection")
+        assert closed.strip() == b""
+        assert threads[0].startswith("ccbox-api")
+
+def test_connection_closed_on_eof(api_server):
+        async def scenario():
+                await api_server.start()
+                connections = [await asyncio.open_connection('127.0.0.1', api_server.port) for _ in range(50)]
+                for reader, _ in connections:
+                        await read_welcome(reader)
+                assert len(api_server._writers) == 50
+                for _, writer in connections:
+                        writer.write_eof()
+                for reader, _ in connections:
+                        assert (await reader.read()).strip() == b""
+                await asyncio.sleep(0)
+                remaining = len(api_server._writers)
+                for _, writer in connections:
+                        writer.close()
+                await api_server.close()
+                return remaining
+
+        assert asyncio.run(scenario()) == 0
+
+def test_framed_protocol_pipelines_out_of_order(api_server, mocker):
+        def contents(username, depth=None):
+                # The first request finishes last
+                if username == "slow":
+                        time.sleep(0.2)
+                return f"{username}\n\r"
+
+        mocker.patch.object(ApiCommands, 'get_virtual_drive_contents', side_effect=contents)
+        thread = api_server.start_in_thread()
+
+        with FramedClient('127.0.0.1', api_server.port) as client:
+                slow = client.send("contents slow")
+                fast = client.send("contents fast")
+                first_id, first = client.receive()
+                assert (first_id, first) == (fast, "fast")
+                assert client.wait(slow) == "slow"
+
+                assert client.call_many([f"contents user{i}" for i in range(100)], window=8) == \
+                        [f"user{i}" for i in range(100)]
+                assert client.call("quit").startswith("Closing connection")
+
+def test_failed_framed_request_is_answered(api_server, mocker):
+        def contents(username, depth=None):
+                if username == "broken":
+                        raise RuntimeError("snapshot unreadable")
+                yield "{"
+                yield "}"
+                # Fails after pieces were sent
+                raise RuntimeError("lost the drive")
+
+        mocker.patch.object(ApiCommands, 'execute_command', side_effect=lambda command: contents(command.split()[1]))
+        thread = api_server.start_in_thread()
+
+        with FramedClient('127.0.0.1', api_server.port, timeout=10) as client:
+                assert client.call("contents broken") == "Error: snapshot unreadable"
+                assert client.call("contents alice") == "{}Error: lost the drive"
+
+def test_large_responses_are_streamed_in_frames(api_server, mocker):
+        mocker.patch('ccbox.protocol.MAX_FRAME_SIZE', 64)
+        mocker.patch.object(ApiCommands, 'get_virtual_drive_contents',
+                            return_value=iter(["é" * 50, "b" * 10, "c" * 100, "\n\r"]))
+        thread = api_server.start_in_thread()
+
+        with FramedClient('127.0.0.1', api_server.port, timeout=10) as client:
+                request_id = client.send("contents alice")
+                pieces = list(client.pieces(request_id))
+                assert "".join(text for text, _ in pieces) == "é" * 50 + "b" * 10 + "c" * 100
+                # Split at the frame limit, even inside a character
+                assert len(pieces) == 6
+                assert [last for _, last in pieces] == [False] * 5 + [True]
+                assert client.call("nonsense") == "Invalid command"
+
+def test_frames_round_trip():
+        async def read_all():
+                reader = asyncio.StreamReader()
+                reader.feed_data(encode_frame(7, "contents alice"))
+                reader.feed_eof()
+                return await read_frame(reader), await read_frame(reader)
+
+        assert asyncio.run(read_all()) == ((7, b"contents alice"), None)
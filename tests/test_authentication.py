@@ -1,6 +1,8 @@
 import pytest
 from unittest.mock import patch, Mock, MagicMock
 from ccbox.authentication import Authentication
+from ccbox.user import Credentials, User, UserDatabase
+from ccbox.password_hasher import PasswordHasher
 import hashlib
 
 
@@ -10,6 +12,12 @@ def mock_user_database(mocker):
         Authentication.user_database = mock_db
         return mock_db
 
+@pytest.fixture(autouse=True)
+def hasher(mocker):
+        hasher = PasswordHasher({"algorithm": "scrypt", "n": 16, "r": 1, "p": 1}, workers=0)
+        mocker.patch.object(Authentication, 'hasher', hasher)
+        return hasher
+
 def test_generate_password(mocker):
         mocker.patch('secrets.choice', return_value='a')
         password = Authentication.generate_password(12)
@@ -44,8 +52,83 @@ def test_login(mock_user_database, mocker):
 def test_login_non_existing_user(mock_user_database):
         username = "non_existing_user"
         password = "test_password"
+        mock_user_database.get_credentials.return_value = None
         with patch.object(Authentication, 'user_database', mock_user_database):
                 # Execute
                 authenticated_user = Authentication.login(username, password)
                 # Assert
                 assert authenticated_user is None
+
+
+def test_login_does_not_load_drive(mock_user_database, mocker):
+        mocker.patch.object(Authentication, 'authenticate_user', return_value=True)
+        mock_user_database.user_exists.return_value = True
+
+        authenticated_user = Authentication.login('username', 'password')
+
+        assert authenticated_user is mock_user_database.get_user_record.return_value
+        mock_user_database.get_user_from_db.assert_not_called()
+
+def test_authenticate_user_checks_salted_hash(mock_user_database):
+        salt = "salt"
+        mock_user_database.get_credentials.return_value = Credentials(
+                "username", salt, hashlib.sha256(b"salttest_password").hexdigest(), {"algorithm": "sha256"})
+
+        assert Authentication.authenticate_user("username", "test_password")
+        assert not Authentication.authenticate_user("username", "wrong_password")
+        mock_user_database.get_credentials.return_value = None
+        assert not Authentication.authenticate_user("username", "test_password")
+
+def test_authenticate_legacy_unsalted_hash(mock_user_database):
+        mock_user_database.get_credentials.return_value = Credentials(
+                "username", "", hashlib.sha256(b"test_password").hexdigest(), {"algorithm": "sha256"})
+        assert Authentication.authenticate_user("username", "test_password")
+
+def test_authenticate_rehashes_outdated_credentials(mock_user_database, hasher):
+        mock_user_database.get_credentials.return_value = Credentials(
+                "username", "", hashlib.sha256(b"test_password").hexdigest(), {"algorithm": "sha256"})
+
+        assert Authentication.authenticate_user("username", "test_password")
+
+        rehashed = mock_user_database.save_credentials.call_args.args[0]
+        assert rehashed.params == hasher.params
+        assert hasher.verify("test_password", rehashed)
+
+def test_authenticate_keeps_current_credentials(mock_user_database, hasher):
+        mock_user_database.get_credentials.return_value = hasher.new_credentials("username", "test_password")
+        assert Authentication.authenticate_user("username", "test_password")
+        mock_user_database.save_credentials.assert_not_called()
+
+def test_register_bulk(tmp_path, mocker, hasher):
+        user_database = UserDatabase(str(tmp_path / "users.db"))
+        mocker.patch.object(Authentication, 'user_database', user_database)
+        user_database.add_user_to_db(User(username="existing"))
+        users = [(f"user{i}", "password123") for i in range(25)] + [("existing", "password123"), ("short", "pwd"),
+                                                                   ("user0", "password123")]
+
+        result = Authentication.register_bulk(iter(users), batch_size=10)
+
+        assert (result.created, result.existing, result.invalid) == (25, 2, 1)
+        assert user_database.user_exists("user24")
+        assert Authentication.authenticate_user("user24", "password123")
+        user_database.close()
+
+def test_save_user_keeps_the_password_of_whoever_got_the_username(tmp_path, mocker, hasher):
+        user_database = UserDatabase(str(tmp_path / "users.db"))
+        mocker.patch.object(Authentication, 'user_database', user_database)
+
+        assert Authentication.save_user("alice", "password123")
+        assert not Authentication.save_user("alice", "other_password")
+        assert Authentication.authenticate_user("alice", "password123")
+        assert not Authentication.authenticate_user("alice", "other_password")
+        user_database.close()
+
+def test_save_user_does_not_take_the_username_when_hashing_fails(tmp_path, mocker, hasher):
+        user_database = UserDatabase(str(tmp_path / "users.db"))
+        mocker.patch.object(Authentication, 'user_database', user_database)
+        mocker.patch.object(hasher, 'new_credentials', side_effect=RuntimeError("hashing failed"))
+
+        with pytest.raises(RuntimeError):
+                Authentication.save_user("alice", "password123")
+        assert not user_database.user_exists("alice")
+        user_database.close()
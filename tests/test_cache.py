@@ -0,0 +1,75 @@
+import pytest
+from unittest.mock import MagicMock
+from ccbox.cache import LRUCache
+from ccbox.user import User, UserDatabase
+
+
+class FakeClock:
+        def __init__(self):
+                self.now = 0.0
+
+        def __call__(self):
+                return self.now
+
+def test_lru_evicts_least_recently_used():
+        cache = LRUCache(max_size=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        assert cache.get("a") == 1
+        cache.put("c", 3)
+
+        assert "b" not in cache
+        assert cache.get("a") == 1 and cache.get("c") == 3
+        stats = cache.stats()
+        assert stats.evictions == 1
+        assert stats.hits == 3
+        assert stats.size == 2
+
+def test_lru_expires_entries_after_ttl():
+        clock = FakeClock()
+        cache = LRUCache(max_size=10, ttl=5, clock=clock)
+        cache.put("a", 1)
+        clock.now = 4
+        assert cache.get("a") == 1
+        clock.now = 10
+        assert cache.get("a") is None
+
+        stats = cache.stats()
+        assert stats.expirations == 1
+        assert stats.misses == 1
+        assert stats.hit_rate == 0.5
+
+def test_lru_invalidate_and_disabled_cache():
+        cache = LRUCache(max_size=2)
+        cache.put("a", 1)
+        assert cache.invalidate("a")
+        assert not cache.invalidate("a")
+        assert cache.stats().invalidations == 1
+
+        disabled = LRUCache(max_size=0)
+        disabled.put("a", 1)
+        assert disabled.get("a") is None
+
+def test_setdefault_keeps_existing_entry():
+        cache = LRUCache(max_size=2)
+        assert cache.setdefault("a", 1) == 1
+        assert cache.setdefault("a", 2) == 1
+
+@pytest.fixture
+def user_database(tmp_path, mocker):
+        mocker.patch.object(User, 'from_dict', side_effect=lambda data: MagicMock(username=data["username"]))
+        database = UserDatabase(str(tmp_path / "users.db"), cache_size=2)
+        database.cursor.execute('INSERT INTO users (id, username, virtual_drive_id) VALUES (1, "alice", 1)')
+        yield database
+        database.close()
+
+def test_get_user_from_db_is_cached(user_database):
+        first = user_database.get_user_from_db("alice")
+        assert user_database.get_user_from_db("alice") is first
+        assert User.from_dict.call_count == 1
+        assert user_database.get_user_from_db("bob") is None
+
+        user_database.invalidate_user("alice")
+        assert user_database.get_user_from_db("alice") is not first
+        assert User.from_dict.call_count == 2
+        assert user_database.cache_stats().hits == 1
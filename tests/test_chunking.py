@@ -0,0 +1,120 @@
+import io
+import random
+import pytest
+from ccbox import chunking
+from ccbox.chunking import Chunker
+from ccbox.content_store import ContentStore
+from ccbox.storage_handler import InMemoryStorageHandler
+from ccbox.virtual_drive import Virtual_Drive
+
+SIZES = dict(min_size=256, avg_size=1024, max_size=4096)
+needs_numpy = pytest.mark.skipif(chunking.np is None, reason="numpy is not installed")
+
+
+def random_bytes(size, seed=0):
+        return random.Random(seed).randbytes(size)
+
+@pytest.fixture
+def shared():
+        yield InMemoryStorageHandler("content")
+        InMemoryStorageHandler.clear()
+        ContentStore.close_all()
+
+def test_chunks_cover_the_data_within_bounds():
+        data = random_bytes(200_000)
+        chunks = Chunker(vectorized=False, **SIZES).split(data)
+
+        assert b"".join(chunks) == data
+        assert all(256 <= len(chunk) <= 4096 for chunk in chunks[:-1])
+        assert 0 < len(chunks[-1]) <= 4096
+        # Normalized chunking keeps the average close to avg_size
+        assert 700 < len(data) / len(chunks) < 1500
+
+@needs_numpy
+@pytest.mark.parametrize("size", [0, 100, 256, 257, 4097, 300_000])
+def test_vectorized_cut_points_match_python(size):
+        data = random_bytes(size, seed=size)
+        assert (Chunker(vectorized=True, **SIZES).cut_points(data)
+                == Chunker(vectorized=False, **SIZES).cut_points(data))
+
+@needs_numpy
+def test_vectorized_cut_points_match_python_across_segments():
+        data = random_bytes(3 * chunking.SEGMENT_SIZE + 12345)
+        sizes = dict(min_size=16 * 1024, avg_size=64 * 1024, max_size=256 * 1024)
+        assert Chunker(vectorized=True, **sizes).cut_points(data) == Chunker(vectorized=False, **sizes).cut_points(data)
+
+def test_streaming_matches_split():
+        data = random_bytes(100_000)
+        chunker = Chunker(buffer_size=1, **SIZES)
+        assert chunker.buffer_size == 8192
+
+        streamed = [bytes(chunk) for chunk in chunker.iter_chunks(io.BytesIO(data))]
+
+        assert streamed == [bytes(chunk) for chunk in chunker.split(data)]
+
+def test_edit_only_changes_nearby_chunks():
+        chunker = Chunker(**SIZES)
+        data = random_bytes(200_000)
+        edited = data[:100_000] + b"inserted" + data[100_000:]
+
+        before = {bytes(chunk) for chunk in chunker.split(data)}
+        after = [bytes(chunk) for chunk in chunker.split(edited)]
+
+        assert len([chunk for chunk in after if chunk not in before]) <= 2
+
+@pytest.mark.parametrize("sizes", [
+        dict(min_size=256, avg_size=1000, max_size=4096),
+        dict(min_size=2048, avg_size=1024, max_size=4096),
+        dict(min_size=256, avg_size=1024, max_size=1024),
+        dict(min_size=4, avg_size=1024, max_size=4096),
+])
+def test_invalid_sizes(sizes):
+        with pytest.raises(ValueError):
+                Chunker(**sizes)
+
+def test_modified_large_file_uploads_only_changed_chunks(tmp_path, shared, monkeypatch):
+        monkeypatch.setattr(ContentStore, "ORPHAN_GRACE", 0)
+        monkeypatch.setattr(Virtual_Drive, "CHUNKER", Chunker(threshold=8192, **SIZES))
+        root = tmp_path / "data"
+        root.mkdir()
+        data = random_bytes(200_000)
+        (root / "big.bin").write_bytes(data)
+        (root / "small.txt").write_bytes(b"small")
+        virtual_drive = Virtual_Drive()
+        virtual_drive.add_remote(InMemoryStorageHandler("alice"))
+        virtual_drive.use_content_store(shared)
+
+        first = virtual_drive.sync_directory(str(root))
+        edited = data[:50_000] + b"edit" + data[50_004:]
+        (root / "big.bin").write_bytes(edited)
+        second = virtual_drive.sync_directory(str(root))
+
+        assert first.bytes == 200_005
+        assert (second.files, second.skipped) == (1, 1)
+        assert 0 < second.bytes <= 2 * 4096
+        assert second.deduplicated_bytes == 200_000 - second.bytes
+        entry = virtual_drive.resolve("data/big.bin")
+        assert entry.blob_name is None
+        assert b"".join(shared.download_bytes(ContentStore.blob_name(digest)) for digest in entry.chunks) == edited
+        # Chunks only the old version had are gone
+        store = ContentStore.open(shared)
+        assert store.stats()["blobs"] == len(set(entry.chunks)) + 1
+        assert store.stats()["bytes"] == sum(store.records[digest].size for digest in set(entry.chunks)) + 5
+        assert sum(store.records[digest].size for digest in entry.chunks) == len(edited)
+
+        loaded = Virtual_Drive.from_bytes(virtual_drive.to_bytes())
+        assert loaded.resolve("data/big.bin").chunks == entry.chunks
+        assert Virtual_Drive.from_dict(virtual_drive.to_dict()).resolve("data/big.bin").chunks == entry.chunks
+
+        (root / "big.bin").unlink()
+        third = virtual_drive.sync_directory(str(root))
+        assert third.deleted == 1
+        assert store.stats()["blobs"] == 1
+
+def test_default_chunker_stores_files_whole_without_numpy(monkeypatch):
+        monkeypatch.setattr(chunking, "np", None)
+        assert chunking.default_chunker() is None
+
+@needs_numpy
+def test_default_chunker_is_vectorized():
+        assert chunking.default_chunker().vectorized
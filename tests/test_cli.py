@@ -0,0 +1,45 @@
+import pytest
+import io
+from ccbox.api_server import ApiServer, ApiCommands
+from ccbox.cli import run_batch, read_commands
+
+
+@pytest.fixture
+def api_server(mocker):
+        mocker.patch('ccbox.api_server.Logger')
+        mocker.patch.object(ApiCommands, 'get_virtual_drive_contents',
+                            side_effect=lambda username, depth=None: f"{username} {'x' * 100000}\n\r")
+        server = ApiServer('127.0.0.1', 0, workers=4)
+        server.start_in_thread()
+        return server
+
+def test_read_commands_skips_comments_and_stops_at_quit():
+        lines = ["# setup\n", "\n", "contents alice\n", "quit\n", "contents bob\n"]
+        assert list(read_commands(lines)) == ["contents alice", "quit"]
+
+def test_run_batch_over_one_connection(api_server, mocker):
+        connections = mocker.spy(api_server, 'serve_frames')
+        out = io.StringIO()
+        lines = [f"contents user{i}\n" for i in range(200)]
+
+        assert run_batch(lines, '127.0.0.1', api_server.port, window=16, out=out) == 200
+
+        responses = out.getvalue().splitlines()
+        assert [response.split()[0] for response in responses] == [f"user{i}" for i in range(200)]
+        # Large responses arrive whole instead of being cut at the first recv
+        assert all(len(response) > 100000 for response in responses)
+        assert connections.call_count == 1
+
+def test_run_batch_writes_responses_spanning_frames(api_server, mocker):
+        mocker.patch('ccbox.protocol.MAX_FRAME_SIZE', 1024)
+        writes = []
+        out = io.StringIO()
+        mocker.patch.object(out, 'write', side_effect=lambda text: writes.append(text))
+
+        assert run_batch(["contents alice\n", "contents bob\n"], '127.0.0.1', api_server.port, out=out) == 2
+
+        responses = "".join(writes).splitlines()
+        assert [response.split()[0] for response in responses] == ["alice", "bob"]
+        assert [len(response) for response in responses] == [len("alice ") + 100000, len("bob ") + 100000]
+        # Written a frame at a time, not once per response
+        assert len(writes) > 100
@@ -0,0 +1,228 @@
+import time
+import pytest
+from ccbox.content_store import ContentStore
+from ccbox.storage_handler import InMemoryStorageHandler
+from ccbox.virtual_drive import Virtual_Drive
+from ccbox.upload_pipeline import FailedUpload
+from ccbox.manifest import hash_bytes
+
+
+@pytest.fixture
+def shared():
+        yield InMemoryStorageHandler("content")
+        InMemoryStorageHandler.clear()
+        ContentStore.close_all()
+
+def make_drive(name):
+        virtual_drive = Virtual_Drive()
+        virtual_drive.add_remote(InMemoryStorageHandler(name))
+        return virtual_drive
+
+def write_tree(root, files):
+        for relative, data in files.items():
+                path = root / relative
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_bytes(data)
+        return str(root)
+
+def content_blobs(handler):
+        return sorted(name for name in handler.blob_names() if name.startswith("sha256/"))
+
+def test_duplicates_are_uploaded_once(tmp_path, shared):
+        source = write_tree(tmp_path / "data", {"a.txt": b"same", "sub/b.txt": b"same", "c.txt": b"other"})
+        alice, bob = make_drive("alice"), make_drive("bob")
+        alice.use_content_store(shared)
+        bob.use_content_store(shared)
+
+        first = alice.sync_directory(source)
+        second = bob.sync_directory(source)
+
+        assert (first.files, first.deduplicated) == (2, 1)
+        assert (second.files, second.deduplicated) == (0, 3)
+        assert len(content_blobs(shared)) == 2
+        store = ContentStore.open(shared)
+        assert store.stats() == {"blobs": 2, "bytes": 9, "refs": 6}
+        entry = alice.resolve("data/sub/b.txt")
+        assert entry.blob_name == ContentStore.blob_name(entry.sha256)
+        assert shared.download_bytes(entry.blob_name) == b"same"
+        # No path-named blobs or folder markers
+        assert not [name for name in alice.storage_handler.blob_names() if name.startswith("data/")]
+
+def test_released_content_is_deleted(tmp_path, shared, monkeypatch):
+        monkeypatch.setattr(ContentStore, "ORPHAN_GRACE", 0)
+        root = tmp_path / "data"
+        source = write_tree(root, {"a.txt": b"one", "b.txt": b"two"})
+        virtual_drive = make_drive("alice")
+        virtual_drive.use_content_store(shared)
+        virtual_drive.sync_directory(source)
+
+        (root / "a.txt").write_bytes(b"changed")
+        (root / "b.txt").unlink()
+        stats = virtual_drive.sync_directory(source)
+
+        assert (stats.files, stats.deleted) == (1, 1)
+        assert [shared.download_bytes(name) for name in content_blobs(shared)] == [b"changed"]
+        assert ContentStore.open(shared).stats()["refs"] == 1
+        # The index is saved with the manifest
+        assert len(ContentStore(shared).records) == 1
+
+def test_released_content_is_kept_for_a_grace_period(shared):
+        store = ContentStore(shared)
+        shared.upload_from_bytes("content", ContentStore.blob_name("aa"), b"one")
+        store.add_stored("aa", 3)
+        store.release("aa")
+
+        assert store.delete_orphans() == 0
+        assert shared.download_bytes(ContentStore.blob_name("aa")) == b"one"
+        assert not store.contains("aa")
+        # Not trusted to outlive the grace period: it is uploaded again
+        assert not store.add_ref("aa")
+        assert ContentStore(shared).records["aa"].refs == 0
+
+def test_reuploaded_content_is_not_deleted(shared, monkeypatch):
+        monkeypatch.setattr(ContentStore, "ORPHAN_GRACE", 0)
+        store, other = ContentStore(shared), ContentStore(shared)
+        store.add_stored("aa", 3)
+        store.release("aa")
+        store.save()
+        time.sleep(0.01)
+        # Another process uploads the same content again but has not saved its reference yet
+        shared.upload_from_bytes("content", ContentStore.blob_name("aa"), b"one")
+
+        assert store.delete_orphans() == 0
+        assert shared.download_bytes(ContentStore.blob_name("aa")) == b"one"
+        other.add_stored("aa", 3)
+        other.save()
+        assert ContentStore(shared).records["aa"].refs == 1
+
+def test_stores_in_different_processes_merge_their_references(shared):
+        # One store per process: each only sees the index as it was when it last saved
+        first, second = ContentStore(shared), ContentStore(shared)
+        first.add_stored("aa", 3)
+        second.add_stored("bb", 4)
+        second.add_stored("aa", 3)
+        first.save()
+        second.save()
+        first.release("aa")
+        first.save()
+
+        index = ContentStore(shared).records
+        assert (index["aa"].refs, index["bb"].refs) == (1, 1)
+        # Saving refreshes the view with what the others wrote
+        assert first.contains("bb")
+
+def test_index_read_errors_are_not_an_empty_index(shared, monkeypatch):
+        store = ContentStore(shared)
+        store.add_stored("aa", 3)
+        store.save()
+
+        def failing(blob_name):
+                raise ConnectionError("timed out")
+
+        monkeypatch.setattr(shared, "download_json_versioned", failing)
+        store.release("aa")
+        with pytest.raises(ConnectionError):
+                store.save()
+        with pytest.raises(ConnectionError):
+                ContentStore(shared)
+        monkeypatch.undo()
+        # The change is kept for the next save
+        store.save()
+        assert "aa" not in [digest for digest, record in ContentStore(shared).records.items() if record.refs]
+
+def test_path_layout_is_moved_over(tmp_path, shared):
+        source = write_tree(tmp_path / "data", {"a.txt": b"one"})
+        virtual_drive = make_drive("alice")
+        virtual_drive.sync_directory(source)
+        assert virtual_drive.storage_handler.download_bytes("data/a.txt") == b"one"
+
+        virtual_drive.use_content_store(shared)
+        stats = virtual_drive.sync_directory(source)
+
+        assert stats.files == 1
+        assert content_blobs(shared) == [virtual_drive.resolve("data/a.txt").blob_name]
+        assert virtual_drive.storage_handler.download_bytes("data/") is None
+        assert virtual_drive.storage_handler.download_bytes("data/a.txt") is None
+
+def test_layout_survives_snapshots(tmp_path, shared):
+        source = write_tree(tmp_path / "data", {"a.txt": b"one"})
+        virtual_drive = make_drive("alice")
+        virtual_drive.use_content_store(shared)
+        virtual_drive.sync_directory(source)
+
+        loaded = Virtual_Drive(_id=virtual_drive._id, _from_dict=True)
+        loaded.add_remote(virtual_drive.storage_handler)
+        loaded.load_from_remote()
+        from_json = Virtual_Drive.from_dict(virtual_drive.to_dict())
+
+        assert loaded.content_store is ContentStore.open(shared)
+        assert from_json.content_store is ContentStore.open(shared)
+        assert loaded.resolve("data/a.txt").blob_name == virtual_drive.resolve("data/a.txt").blob_name
+
+def test_redrive_stores_by_content(tmp_path, shared):
+        source = write_tree(tmp_path / "data", {"a.txt": b"retried"})
+        virtual_drive = make_drive("alice")
+        virtual_drive.use_content_store(shared)
+        virtual_drive.mount_directory(source)
+        failure = FailedUpload("data/a.txt", str(tmp_path / "data" / "a.txt"), "throttled", 5)
+
+        stats = virtual_drive.redrive_uploads([failure])
+
+        entry = virtual_drive.resolve("data/a.txt")
+        assert stats.files == 1
+        assert entry.sha256 == hash_bytes(b"retried")
+        assert content_blobs(shared) == [ContentStore.blob_name(entry.sha256)]
+        assert "data/a.txt" not in virtual_drive.storage_handler.blob_names()
+        # The snapshot is saved with the resolved entry
+        loaded = Virtual_Drive(_id=virtual_drive._id, _from_dict=True)
+        loaded.add_remote(InMemoryStorageHandler("alice"))
+        loaded.load_from_remote()
+        assert loaded.resolve("data/a.txt").blob_name == ContentStore.blob_name(entry.sha256)
+
+def test_drive_synced_by_two_processes_keeps_both_mounts(tmp_path, shared):
+        write_tree(tmp_path / "a", {"a.txt": b"a"})
+        write_tree(tmp_path / "b", {"b.txt": b"b"})
+        make_drive("alice").save_to_remote()
+        drive_id = next(Virtual_Drive.id_counter) - 1
+
+        def open_drive():
+                # As loaded by another server process, with a content store of its own
+                virtual_drive = Virtual_Drive(_id=drive_id, _from_dict=True)
+                virtual_drive.add_remote(InMemoryStorageHandler("alice"))
+                virtual_drive.load_from_remote()
+                virtual_drive.content_store = ContentStore(shared)
+                return virtual_drive
+
+        first, second = open_drive(), open_drive()
+        first.sync_directory(str(tmp_path / "a"))
+        second.sync_directory(str(tmp_path / "b"))
+
+        loaded = open_drive()
+        assert loaded.resolve("a/a.txt") is not None and loaded.resolve("b/b.txt") is not None
+        assert sorted(loaded.load_manifest().entries) == ["a/a.txt", "b/b.txt"]
+        assert {digest: record.refs for digest, record in ContentStore(shared).records.items()} == {
+                hash_bytes(b"a"): 1, hash_bytes(b"b"): 1}
+
+def test_same_change_synced_by_two_processes_is_counted_once(tmp_path, shared):
+        source = write_tree(tmp_path / "data", {"a.txt": b"old"})
+        virtual_drive = make_drive("alice")
+        virtual_drive.content_store = ContentStore(shared)
+        virtual_drive.sync_directory(source)
+
+        def open_drive():
+                loaded = Virtual_Drive(_id=virtual_drive._id, _from_dict=True)
+                loaded.add_remote(InMemoryStorageHandler("alice"))
+                loaded.load_from_remote()
+                loaded.load_manifest()
+                return loaded
+
+        # Both start from the same manifest and each uploads the new content
+        first, second = open_drive(), open_drive()
+        write_tree(tmp_path / "data", {"a.txt": b"new"})
+        for loaded in (first, second):
+                loaded.content_store = ContentStore(shared)
+                loaded.sync_directory(source)
+
+        records = ContentStore(shared).records
+        assert (records[hash_bytes(b"new")].refs, records[hash_bytes(b"old")].refs) == (1, 0)
+        assert open_drive().resolve("data/a.txt").sha256 == hash_bytes(b"new")
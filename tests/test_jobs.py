@@ -0,0 +1,151 @@
+import pytest
+import threading
+from unittest.mock import MagicMock
+from ccbox.jobs import JobScheduler, MountJob, QUEUED, RUNNING, DONE, FAILED
+from ccbox.user import User, UserDatabase
+from ccbox.virtual_drive import Virtual_Drive, Folder, FileEntry
+from ccbox.storage_handler import InMemoryStorageHandler
+from ccbox.content_store import ContentStore
+
+
+@pytest.fixture
+def store(tmp_path, mocker):
+        mocker.patch.object(User, 'from_dict')
+        database = UserDatabase(str(tmp_path / "users.db"))
+        database.cursor.execute('INSERT INTO users (id, username, virtual_drive_id) VALUES (1, "alice", 7)')
+        yield database
+        database.close()
+
+def test_rate_and_eta():
+        job = MountJob("alice", "/data", status=RUNNING, started=100.0, bytes_total=1000)
+        job.advance("/data/a", 250)
+        job.advance(None, 0)
+        job.finished = 110.0
+
+        assert (job.files_done, job.bytes_done) == (1, 250)
+        assert job.rate == 25.0
+        assert job.eta == 30.0
+        assert MountJob.from_dict(job.to_dict()) == job
+
+def test_submit_runs_in_background(store):
+        release = threading.Event()
+        started = threading.Event()
+
+        def runner(scheduler, job):
+                started.set()
+                release.wait(5)
+
+        scheduler = JobScheduler(store, runner=runner)
+        job = scheduler.submit_mount("alice", "/data")
+        started.wait(5)
+
+        assert scheduler.get(job.id).status == RUNNING
+        assert scheduler.submit_mount("bob", "/data") is None
+
+        release.set()
+        scheduler.shutdown()
+        assert scheduler.get(job.id).status == DONE
+        assert store.jobs_with_status([QUEUED, RUNNING]) == []
+
+def test_concurrency_is_bounded(store):
+        store.cursor.execute('INSERT INTO users (id, username, virtual_drive_id) VALUES (2, "bob", 8), (3, "carol", 9)')
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def runner(scheduler, job):
+                with lock:
+                        running[0] += 1
+                        running[1] = max(running)
+                threading.Event().wait(0.02)
+                with lock:
+                        running[0] -= 1
+
+        scheduler = JobScheduler(store, max_concurrent=2, runner=runner)
+        users = ["alice", "bob", "carol"]
+        jobs = [scheduler.submit_mount(users[i % 3], f"/data/{i}") for i in range(9)]
+        scheduler.shutdown()
+
+        assert running[1] == 2
+        assert all(scheduler.get(job.id).status == DONE for job in jobs)
+
+def test_jobs_of_a_user_run_one_at_a_time(store):
+        lock = threading.Lock()
+        running = [0, 0]
+        ran = []
+
+        def runner(scheduler, job):
+                with lock:
+                        running[0] += 1
+                        running[1] = max(running)
+                threading.Event().wait(0.02)
+                with lock:
+                        running[0] -= 1
+                        ran.append(job.dir_path)
+
+        scheduler = JobScheduler(store, max_concurrent=4, runner=runner)
+        jobs = [scheduler.submit_mount("alice", f"/data/{i}") for i in range(4)]
+        assert [job.status for job in jobs[1:]] == [QUEUED] * 3
+        scheduler.shutdown()
+
+        assert running[1] == 1
+        assert ran == [f"/data/{i}" for i in range(4)]
+        assert all(scheduler.get(job.id).status == DONE for job in jobs)
+
+def test_failed_job_keeps_error(store):
+        def runner(scheduler, job):
+                raise OSError("disk gone")
+
+        scheduler = JobScheduler(store, runner=runner)
+        job = scheduler.submit_mount("alice", "/data")
+        scheduler.shutdown()
+
+        saved = scheduler.get(job.id)
+        assert (saved.status, saved.error) == (FAILED, "disk gone")
+
+def test_resume_requeues_unfinished_jobs(store):
+        interrupted = MountJob("alice", "/data", status=RUNNING, started=1.0, files_done=3, bytes_done=30)
+        store.save_job(interrupted.id, interrupted.status, interrupted.to_dict())
+        finished = MountJob("alice", "/old", status=DONE)
+        store.save_job(finished.id, finished.status, finished.to_dict())
+        ran = []
+
+        scheduler = JobScheduler(store, runner=lambda scheduler, job: ran.append(job.dir_path))
+        resumed = scheduler.resume()
+        scheduler.shutdown()
+
+        assert [job.id for job in resumed] == [interrupted.id]
+        assert ran == ["/data"]
+        job = scheduler.get(interrupted.id)
+        assert (job.status, job.resumed, job.files_done) == (DONE, 1, 0)
+
+def test_progress_saves_manifest_and_job(store):
+        drive = MagicMock(spec=Virtual_Drive)
+        scheduler = JobScheduler(store, persist_interval=0)
+        job = MountJob("alice", "/data")
+        folder = Folder(_name="data", parent_dir=None)
+        folder.add_file(FileEntry("a", "/data/a", 10))
+        folder.add_file(FileEntry("b", "/data/b", 20))
+
+        scheduler._sized(job, folder)
+        scheduler._progress(job, drive)("/data/a", 10)
+
+        assert (job.files_total, job.bytes_total) == (2, 30)
+        drive.save_manifest.assert_called_once()
+        assert store.get_job(job.id)["bytes_done"] == 10
+
+def test_run_mount_uses_the_drive_storage(store, tmp_path, mocker):
+        (tmp_path / "data").mkdir()
+        (tmp_path / "data" / "a.txt").write_bytes(b"a")
+        drive = Virtual_Drive()
+        drive.add_remote(InMemoryStorageHandler("drive"))
+        mocker.patch.object(store, 'get_user_from_db', return_value=User("alice", virtual_drive=drive))
+        scheduler = JobScheduler(store, content_container="shared")
+        try:
+                scheduler.run_mount(MountJob("alice", str(tmp_path / "data")))
+
+                assert isinstance(drive.storage_handler, InMemoryStorageHandler)
+                assert drive.content_store.storage_handler.to_dict() == InMemoryStorageHandler("shared").to_dict()
+                assert any(name.startswith("sha256/") for name in InMemoryStorageHandler("shared").blob_names())
+        finally:
+                InMemoryStorageHandler.clear()
+                ContentStore.close_all()
@@ -0,0 +1,166 @@
+import pytest
+import os
+from unittest.mock import MagicMock
+from ccbox.manifest import Manifest, ManifestEntry, hash_bytes
+from ccbox.virtual_drive import Virtual_Drive
+from ccbox.storage_handler import VersionConflict
+
+
+@pytest.fixture
+def storage_handler():
+        remote_json = {}
+        handler = MagicMock()
+        handler.container_name = "fake_container"
+        handler.upload_json.side_effect = lambda data, name: remote_json.__setitem__(name, data)
+        handler.download_json.side_effect = lambda name: remote_json.get(name)
+        versions = {}
+
+        def upload_json_versioned(data, name, version):
+                if versions.get(name) != version:
+                        raise VersionConflict(name)
+                remote_json[name] = data
+                versions[name] = str(int(version or 0) + 1)
+                return versions[name]
+
+        handler.upload_json_versioned.side_effect = upload_json_versioned
+        handler.upload_bytes_versioned.side_effect = lambda data, name, version: upload_json_versioned(data, name, version)
+        handler.download_json_versioned.side_effect = lambda name: (remote_json.get(name), versions.get(name))
+        handler.blob_version.side_effect = lambda name: versions.get(name)
+        handler.to_dict.return_value = {"account_url": "http://fake_account_url", "container_name": "fake_container"}
+        return handler
+
+@pytest.fixture
+def mount_dir(tmp_path):
+        mount_dir = tmp_path / "mnt"
+        (mount_dir / "sub").mkdir(parents=True)
+        (mount_dir / "file1.txt").write_bytes(b"one")
+        (mount_dir / "sub" / "file2.txt").write_bytes(b"two")
+        return mount_dir
+
+def uploaded_blobs(storage_handler):
+        # Ignore the drive snapshot saved at the end of every sync
+        return {c.args[1] for c in storage_handler.upload_from_bytes.call_args_list if not c.args[1].endswith(".ccbx")}
+
+def test_manifest_round_trip(tmp_path):
+        file_path = tmp_path / "file1.txt"
+        file_path.write_bytes(b"one")
+        manifest = Manifest()
+        manifest.record("mnt/file1.txt", ManifestEntry.from_path(str(file_path)))
+
+        loaded = Manifest.from_dict(manifest.to_dict())
+        assert loaded.entries["mnt/file1.txt"].sha256 == hash_bytes(b"one")
+        assert loaded.is_unchanged("mnt/file1.txt", str(file_path))
+        assert Manifest.from_dict(None).entries == {}
+
+def test_manifest_unseen_respects_prefixes():
+        manifest = Manifest({
+                "a/x": ManifestEntry.from_bytes(b"x"),
+                "b/y": ManifestEntry.from_bytes(b"y"),
+        })
+        assert sorted(manifest.unseen(set())) == ["a/x", "b/y"]
+        assert manifest.unseen(set(), ["a/"]) == ["a/x"]
+        assert manifest.unseen({"a/x"}, ["a/"]) == []
+
+def test_remount_uploads_only_changes(storage_handler, mount_dir):
+        virtual_drive = Virtual_Drive()
+        virtual_drive.add_remote(storage_handler)
+
+        first = virtual_drive.sync_directory(str(mount_dir))
+        assert uploaded_blobs(storage_handler) == {"mnt/", "mnt/file1.txt", "mnt/sub/", "mnt/sub/file2.txt"}
+        assert first.files == 4
+
+        storage_handler.upload_from_bytes.reset_mock()
+        second = virtual_drive.sync_directory(str(mount_dir))
+        assert uploaded_blobs(storage_handler) == set()
+        assert second.skipped == 4
+
+        (mount_dir / "file1.txt").write_bytes(b"changed")
+        os.remove(mount_dir / "sub" / "file2.txt")
+        third = virtual_drive.sync_directory(str(mount_dir))
+        assert uploaded_blobs(storage_handler) == {"mnt/file1.txt"}
+        storage_handler.delete_blob.assert_called_once_with("fake_container", "mnt/sub/file2.txt")
+        assert third.deleted == 1
+        assert "mnt/sub/file2.txt" not in virtual_drive.manifest.entries
+
+def test_touched_file_is_hashed_not_uploaded(storage_handler, mount_dir):
+        virtual_drive = Virtual_Drive()
+        virtual_drive.add_remote(storage_handler)
+        virtual_drive.sync_directory(str(mount_dir))
+        storage_handler.upload_from_bytes.reset_mock()
+
+        stat = os.stat(mount_dir / "file1.txt")
+        os.utime(mount_dir / "file1.txt", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        stats = virtual_drive.sync_directory(str(mount_dir))
+
+        assert uploaded_blobs(storage_handler) == set()
+        assert stats.skipped == 4
+        assert virtual_drive.manifest.entries["mnt/file1.txt"].mtime_ns == stat.st_mtime_ns + 10**9
+
+def test_manifest_is_persisted_next_to_snapshot(storage_handler, mount_dir):
+        virtual_drive = Virtual_Drive()
+        virtual_drive.add_remote(storage_handler)
+        virtual_drive.sync_directory(str(mount_dir))
+
+        saved = [c.args[1] for c in storage_handler.upload_json_versioned.call_args_list]
+        assert Manifest.object_name(virtual_drive._id) in saved
+        snapshots = [c.args[1] for c in storage_handler.upload_from_bytes.call_args_list]
+        assert Virtual_Drive.snapshot_name(virtual_drive._id, Virtual_Drive.SNAPSHOT_FORMAT) in snapshots
+
+def test_overlapping_syncs_do_not_prune_each_other(storage_handler, tmp_path):
+        for name in ("a", "b"):
+                (tmp_path / name).mkdir()
+                for i in range(3):
+                        (tmp_path / name / f"file{i}.txt").write_bytes(name.encode())
+        virtual_drive = Virtual_Drive()
+        virtual_drive.add_remote(storage_handler)
+        started = []
+
+        def progress(path, size):
+                # While "a" is uploading, sync "b" on the same drive, as a second mount job would
+                if not started:
+                        started.append(path)
+                        virtual_drive.sync_directory(str(tmp_path / "b"), workers=1)
+
+        virtual_drive.sync_directory(str(tmp_path / "a"), workers=1, progress=progress)
+
+        storage_handler.delete_blob.assert_not_called()
+        assert {name.split("/")[0] for name in virtual_drive.manifest.entries} == {"a", "b"}
+        assert len(virtual_drive.manifest.entries) == 8
+        assert sorted(virtual_drive.folders) == ["a", "b", "default"]
+
+def test_sync_swaps_the_mount_in_when_done(storage_handler, mount_dir):
+        virtual_drive = Virtual_Drive()
+        virtual_drive.add_remote(storage_handler)
+        virtual_drive.sync_directory(str(mount_dir))
+        old = virtual_drive.folders["mnt"]
+        seen = []
+
+        def on_mounted(folder):
+                seen.append(virtual_drive.folders["mnt"])
+
+        virtual_drive.sync_directory(str(mount_dir), on_mounted=on_mounted)
+
+        assert seen == [old]
+        assert virtual_drive.folders["mnt"] is not old
+        assert [item for item in virtual_drive.contents if getattr(item, "_name", None) == "mnt"] == [virtual_drive.folders["mnt"]]
+
+def test_mount_with_the_same_name_does_not_replace_another_directory(storage_handler, tmp_path):
+        for parent in ("x", "y"):
+                (tmp_path / parent / "data").mkdir(parents=True)
+                (tmp_path / parent / "data" / f"{parent}.txt").write_bytes(parent.encode())
+        virtual_drive = Virtual_Drive()
+        virtual_drive.add_remote(storage_handler)
+        virtual_drive.sync_directory(str(tmp_path / "x" / "data"))
+
+        with pytest.raises(ValueError):
+                virtual_drive.sync_directory(str(tmp_path / "y" / "data"))
+        with pytest.raises(ValueError):
+                virtual_drive.mount_directory(str(tmp_path / "y" / "data"))
+
+        storage_handler.delete_blob.assert_not_called()
+        assert virtual_drive.resolve("data/x.txt") is not None
+        assert "data/x.txt" in virtual_drive.manifest.entries
+        # The same directory is re-mounted in place, also on a drive saved before the source was recorded
+        del virtual_drive.folders["data"].metadata["mounted_from"]
+        virtual_drive.mount_directory(str(tmp_path / "x" / "data"))
+        assert virtual_drive.folders["data"].metadata["mounted_from"] == str(tmp_path / "x" / "data")
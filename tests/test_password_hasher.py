@@ -0,0 +1,46 @@
+import pytest
+import hashlib
+from ccbox.password_hasher import PasswordHasher, derive_key
+from ccbox.user import Credentials
+
+
+FAST_SCRYPT = {"algorithm": "scrypt", "n": 16, "r": 1, "p": 1}
+
+def test_derive_key_algorithms():
+        assert derive_key("pwd", "salt", {"algorithm": "sha256"}) == hashlib.sha256(b"saltpwd").hexdigest()
+        assert derive_key("pwd", "salt", {"algorithm": "pbkdf2_sha256", "iterations": 10}) == \
+                hashlib.pbkdf2_hmac("sha256", b"pwd", b"salt", 10).hex()
+        assert derive_key("pwd", "salt", FAST_SCRYPT) != derive_key("pwd", "other", FAST_SCRYPT)
+        with pytest.raises(ValueError):
+                derive_key("pwd", "salt", {"algorithm": "md5"})
+
+def test_new_credentials_verify_inline():
+        hasher = PasswordHasher(FAST_SCRYPT, workers=0)
+        credentials = hasher.new_credentials("alice", "secret")
+
+        assert credentials.params == FAST_SCRYPT
+        assert hasher.verify("secret", credentials)
+        assert not hasher.verify("wrong", credentials)
+        assert not hasher.needs_rehash(credentials)
+        assert hasher.needs_rehash(Credentials("alice", "", "x", {"algorithm": "sha256"}))
+
+def test_hashing_on_process_pool():
+        hasher = PasswordHasher(FAST_SCRYPT, workers=2)
+        try:
+                futures = [hasher.submit(f"pwd{i}", "salt") for i in range(4)]
+                assert [f.result() for f in futures] == [derive_key(f"pwd{i}", "salt", FAST_SCRYPT) for i in range(4)]
+                # Workers are not forked from the (threaded) server
+                assert hasher._executor._mp_context.get_start_method() == "forkserver"
+        finally:
+                hasher.shutdown()
+
+def test_reset_forgets_the_pool():
+        hasher = PasswordHasher(FAST_SCRYPT, workers=1)
+        pool = hasher._pool()
+        try:
+                hasher.reset()
+                assert hasher._executor is None
+                assert hasher.hash("pwd", "salt") == derive_key("pwd", "salt", FAST_SCRYPT)
+        finally:
+                hasher.shutdown()
+                pool.shutdown()
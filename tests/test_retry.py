@@ -0,0 +1,45 @@
+import pytest
+from unittest.mock import MagicMock
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError, ServiceRequestError
+from ccbox.retry import RetryPolicy, NO_RETRY
+
+
+def http_error(status, headers=None):
+        response = MagicMock(status_code=status, headers=headers or {}, reason="")
+        return HttpResponseError(response=response)
+
+def test_classifies_errors():
+        policy = RetryPolicy()
+        assert policy.is_retryable(http_error(503))
+        assert policy.is_retryable(http_error(429))
+        assert policy.is_retryable(ServiceRequestError("connection reset"))
+        assert policy.is_retryable(TimeoutError())
+        assert not policy.is_retryable(http_error(403))
+        assert not policy.is_retryable(ResourceNotFoundError("gone"))
+        assert not policy.is_retryable(FileNotFoundError())
+        assert not NO_RETRY.should_retry(http_error(503), 1)
+
+def test_exponential_backoff_with_jitter():
+        policy = RetryPolicy(base_delay=1.0, max_delay=5.0, jitter=False)
+        assert [policy.delay(attempt) for attempt in range(1, 6)] == [1.0, 2.0, 4.0, 5.0, 5.0]
+
+        jittered = RetryPolicy(base_delay=1.0, max_delay=5.0)
+        assert all(0 <= jittered.delay(3) <= 4.0 for _ in range(100))
+
+def test_honours_retry_after():
+        policy = RetryPolicy(base_delay=0.1, max_delay=10.0, jitter=False)
+        assert policy.delay(1, http_error(503, {"Retry-After": "3"})) == 3.0
+        assert policy.delay(1, http_error(503, {"Retry-After": "60"})) == 10.0
+
+def test_call_retries_then_gives_up(mocker):
+        sleep = mocker.patch('ccbox.retry.time.sleep')
+        policy = RetryPolicy(max_attempts=3, jitter=False)
+        func = MagicMock(side_effect=[http_error(503), "done"])
+        assert policy.call(func, 1, key=2) == "done"
+        func.assert_called_with(1, key=2)
+
+        func = MagicMock(side_effect=http_error(503))
+        with pytest.raises(HttpResponseError):
+                policy.call(func)
+        assert func.call_count == 3
+        assert sleep.call_count == 3
@@ -0,0 +1,43 @@
+import pytest
+import os
+from ccbox.scanner import scan_tree, scan_entries
+
+
+@pytest.fixture
+def tree(tmp_path):
+        root = tmp_path / "root"
+        for i in range(3):
+                sub = root / f"dir{i}" / "nested"
+                sub.mkdir(parents=True)
+                (root / f"dir{i}" / "a.txt").write_bytes(b"a" * i)
+                (sub / "b.txt").write_bytes(b"bb")
+        (root / "top.txt").write_bytes(b"top")
+        return root
+
+def flatten(directory, prefix=""):
+        paths = {f"{prefix}{name}": size for name, path, size, mtime_ns in directory.files}
+        for sub in directory.subdirectories:
+                paths.update(flatten(sub, f"{prefix}{sub.name}/"))
+        return paths
+
+def test_scan_entries_splits_files_and_directories(tree):
+        files, subdirectories = scan_entries(str(tree))
+        assert [name for name, path, size, mtime_ns in files] == ["top.txt"]
+        assert files[0][2] == 3
+        assert sorted(name for name, path in subdirectories) == ["dir0", "dir1", "dir2"]
+
+@pytest.mark.parametrize("workers", [0, 4])
+def test_scan_tree(tree, workers):
+        scanned = scan_tree(str(tree), workers=workers)
+        assert scanned.name == "root"
+        assert scanned.file_count() == 7
+        assert flatten(scanned) == {
+                "top.txt": 3,
+                "dir0/a.txt": 0, "dir0/nested/b.txt": 2,
+                "dir1/a.txt": 1, "dir1/nested/b.txt": 2,
+                "dir2/a.txt": 2, "dir2/nested/b.txt": 2,
+        }
+
+def test_scan_tree_invalid_path(tmp_path):
+        with pytest.raises(OSError):
+                scan_tree(str(tmp_path / "missing"))
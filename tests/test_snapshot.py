@@ -0,0 +1,178 @@
+import pytest
+import json
+from unittest.mock import MagicMock
+from ccbox.virtual_drive import Virtual_Drive, Folder, FileEntry, LazyFolder
+from ccbox.snapshot import SnapshotReader
+from ccbox.storage_handler import InMemoryStorageHandler
+
+
+@pytest.fixture
+def virtual_drive():
+        virtual_drive = Virtual_Drive()
+        virtual_drive.metadata = {"owner": "user"}
+        mnt = virtual_drive.add_folder("mnt")
+        mnt.metadata = {"mounted": True}
+        mnt.add_file(FileEntry("a.txt", "/data/mnt/a.txt", 3, 100, "ab" * 32, "mnt/a.txt"))
+        sub = mnt.add_folder("sub")
+        sub.add_file(FileEntry("b.bin", "/elsewhere/renamed.bin", 5, 200, None, "custom/blob"))
+        sub.add_file(FileEntry("c.txt", "/data/mnt/sub/c.txt", 0, 300))
+        virtual_drive.folders["default"].contents.append("legacy file repr")
+        return virtual_drive
+
+def test_binary_snapshot_round_trip(virtual_drive):
+        loaded = Virtual_Drive.from_bytes(virtual_drive.to_bytes())
+
+        assert loaded._id == virtual_drive._id
+        assert loaded.metadata == {"owner": "user"}
+        assert [item._name for item in loaded.contents] == ["default", "mnt"]
+        assert loaded.resolve("mnt").metadata == {"mounted": True}
+        assert loaded.resolve("mnt/a.txt") == virtual_drive.resolve("mnt/a.txt")
+        assert loaded.resolve("mnt/sub/b.bin") == virtual_drive.resolve("mnt/sub/b.bin")
+        assert loaded.resolve("mnt/sub/c.txt") == virtual_drive.resolve("mnt/sub/c.txt")
+        assert loaded.resolve("mnt/sub").parent_dir is loaded.resolve("mnt")
+        assert loaded.folders["default"].contents == ["legacy file repr"]
+        assert loaded.storage_handler is None
+
+def test_binary_snapshot_is_smaller_than_json():
+        virtual_drive = Virtual_Drive()
+        for i in range(50):
+                folder = virtual_drive.add_folder(f"folder{i}")
+                for j in range(50):
+                        folder.add_file(FileEntry(f"file{j}.txt", f"/data/folder{i}/file{j}.txt", j, j, None, f"folder{i}/file{j}.txt"))
+
+        binary = virtual_drive.to_bytes()
+        assert len(binary) * 10 < len(json.dumps(virtual_drive.to_dict()))
+        assert Virtual_Drive.from_bytes(binary).resolve("folder49/file49.txt").blob_name == "folder49/file49.txt"
+
+def test_from_bytes_rejects_other_data():
+        with pytest.raises(ValueError):
+                Virtual_Drive.from_bytes(b'{"_id": 1}')
+
+def test_save_and_load_pick_format(virtual_drive):
+        remote = {}
+        storage_handler = MagicMock()
+        storage_handler.container_name = "fake_container"
+        storage_handler.to_dict.return_value = None
+        storage_handler.upload_from_bytes.side_effect = lambda container, name, data: remote.__setitem__(name, data)
+        storage_handler.upload_json.side_effect = lambda data, name: remote.__setitem__(name, data)
+        storage_handler.download_bytes.side_effect = lambda name: remote.get(name)
+        storage_handler.download_json.side_effect = lambda name: remote.get(name)
+        virtual_drive.add_remote(storage_handler)
+
+        virtual_drive.save_to_remote("json")
+        assert list(remote) == [f"virtual_drive_{virtual_drive._id}.json"]
+        loaded = Virtual_Drive(_id=virtual_drive._id, _from_dict=True)
+        loaded.add_remote(storage_handler)
+        assert loaded.load_from_remote().resolve("mnt/a.txt") is not None
+
+        virtual_drive.save_to_remote("binary")
+        assert f"virtual_drive_{virtual_drive._id}.ccbx" in remote
+        loaded = Virtual_Drive(_id=virtual_drive._id, _from_dict=True)
+        loaded.add_remote(storage_handler)
+        assert loaded.load_from_remote().resolve("mnt/sub/c.txt") is not None
+
+def test_lazy_load_fetches_sections_on_access(virtual_drive):
+        data = virtual_drive.to_bytes()
+        fetches = []
+
+        def fetch(offset, length=None):
+                fetches.append((offset, length))
+                return data[offset:] if length is None else data[offset:offset + length]
+
+        reader = SnapshotReader(data[:64], fetch)
+        loaded = Virtual_Drive.from_snapshot(reader, lazy=True)
+        fetched_on_open = len(fetches)
+
+        mnt = loaded.folders["mnt"]
+        assert isinstance(mnt, LazyFolder) and not mnt.loaded
+        assert mnt.metadata == {"mounted": True}
+        assert len(fetches) == fetched_on_open
+
+        assert loaded.resolve("mnt/sub/c.txt") == virtual_drive.resolve("mnt/sub/c.txt")
+        assert mnt.loaded
+        assert loaded.resolve("mnt/sub").parent_dir is mnt
+        assert len(fetches) == fetched_on_open + 1
+        assert not loaded.folders["default"].loaded
+
+def test_lazy_load_from_remote_uses_range_reads(virtual_drive):
+        data = virtual_drive.to_bytes()
+        storage_handler = MagicMock()
+        storage_handler.to_dict.return_value = None
+        storage_handler.download_range_versioned.side_effect = (
+                lambda name, offset, length=None, version=None:
+                (data[offset:] if length is None else data[offset:offset + length], "1"))
+        loaded = Virtual_Drive(_id=virtual_drive._id, _from_dict=True)
+        loaded.add_remote(storage_handler)
+
+        loaded.load_from_remote(lazy=True)
+
+        storage_handler.download_bytes.assert_not_called()
+        assert loaded.resolve("mnt/a.txt") == virtual_drive.resolve("mnt/a.txt")
+
+def test_lazy_folder_survives_the_snapshot_being_saved_again(virtual_drive, monkeypatch):
+        # Only the header is read up front, so sections are range reads
+        monkeypatch.setattr("ccbox.virtual_drive.PREFETCH_SIZE", 64)
+        storage_handler = InMemoryStorageHandler("lazy")
+        virtual_drive.add_remote(storage_handler)
+        virtual_drive.save_to_remote("binary")
+        loaded = Virtual_Drive(_id=virtual_drive._id, _from_dict=True)
+        loaded.add_remote(storage_handler)
+        loaded.load_from_remote(lazy=True)
+
+        # Saved again by another writer: every section moves
+        for i in range(20):
+                virtual_drive.add_folder(f"a{i}").add_file(FileEntry("x.txt", f"/data/a{i}/x.txt", i))
+        virtual_drive.resolve("mnt/sub").add_file(FileEntry("d.txt", "/data/mnt/sub/d.txt", 4))
+        virtual_drive.save_to_remote("binary")
+
+        assert loaded.resolve("mnt/sub/d.txt") == virtual_drive.resolve("mnt/sub/d.txt")
+        assert loaded.resolve("mnt/a.txt") == virtual_drive.resolve("mnt/a.txt")
+        InMemoryStorageHandler.clear()
+
+def test_to_dict_depth_limit(virtual_drive):
+        assert virtual_drive.to_dict(depth=1)["folders"]["mnt"]["truncated"] is True
+
+        contents = virtual_drive.to_dict(depth=2)
+        mnt = contents["folders"]["mnt"]
+        assert [item["_name"] for item in mnt["contents"]] == ["a.txt", "sub"]
+        assert mnt["folders"]["sub"]["truncated"] is True
+        assert mnt["folders"]["sub"]["contents"] == []
+        assert "truncated" not in virtual_drive.to_dict()["folders"]["mnt"]["folders"]["sub"]
+
+def test_list_contents_pages_by_name(virtual_drive):
+        for i in range(5):
+                virtual_drive.folders["default"].add_file(FileEntry(f"f{i}", f"/data/f{i}", i))
+
+        first = virtual_drive.list_contents("default", limit=2)
+        assert [item["_name"] for item in first["items"]] == ["f0", "f1"]
+        assert first["total"] == 5
+        second = virtual_drive.list_contents("default", limit=2, cursor=first["next_cursor"])
+        assert [item["_name"] for item in second["items"]] == ["f2", "f3"]
+        last = virtual_drive.list_contents("default", limit=2, cursor=second["next_cursor"])
+        assert [item["_name"] for item in last["items"]] == ["f4"]
+        assert last["next_cursor"] is None
+
+        assert virtual_drive.list_contents("mnt")["items"][1]["truncated"] is True
+        assert "truncated" not in virtual_drive.list_contents("mnt", depth=2)["items"][1]
+        assert virtual_drive.list_contents("missing") is None
+        with pytest.raises(ValueError):
+                virtual_drive.list_contents("default", cursor="not hex")
+
+def test_list_contents_loads_only_the_listed_folder(virtual_drive):
+        virtual_drive.add_folder("other").add_file(FileEntry("x", "/x", 1))
+        data = virtual_drive.to_bytes()
+        loaded = Virtual_Drive.from_snapshot(SnapshotReader(data, lambda offset, length=None: data[offset:offset + length]), lazy=True)
+
+        listing = loaded.list_contents("mnt/sub")
+
+        assert [item["_name"] for item in listing["items"]] == ["b.bin", "c.txt"]
+        assert loaded.folders["mnt"].loaded
+        assert not loaded.folders["other"].loaded
+
+@pytest.mark.parametrize("depth", [None, 1, 2])
+def test_iter_json_matches_to_dict(virtual_drive, depth):
+        chunks = list(virtual_drive.iter_json(depth, chunk_size=16))
+
+        assert len(chunks) > 1
+        assert "".join(chunks) == json.dumps(virtual_drive.to_dict(depth))
+        assert "".join(virtual_drive.folders["mnt"].iter_json(depth)) == json.dumps(virtual_drive.folders["mnt"].to_dict(depth))
@@ -1,15 +1,24 @@
 import unittest
 import json
+import io
 from unittest.mock import patch, MagicMock
 from azure.storage.blob import BlobServiceClient, ContainerClient, BlobClient
 from azure.identity import DefaultAzureCredential
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError, ResourceModifiedError, ServiceRequestError
+import os
+import tempfile
+import time
 from ccbox.storage_handler import AzureStorageHandler  # Replace with your actual module name
+from ccbox.storage_handler import azure_clients, AzureClientRegistry
+from ccbox.storage_handler import LocalFSStorageHandler, InMemoryStorageHandler, storage_handler_from_dict, VersionConflict
+from ccbox.virtual_drive import Virtual_Drive
 
 class TestAzureStorageHandler(unittest.TestCase):
     
         @patch('ccbox.storage_handler.BlobServiceClient')
         @patch('ccbox.storage_handler.DefaultAzureCredential')
         def setUp(self, mock_credential, mock_blob_service_client):
+                azure_clients.reset()
                 self.mock_blob_service_client = mock_blob_service_client.return_value
                 self.mock_container_client = MagicMock(spec=ContainerClient)
                 self.mock_blob_service_client.get_container_client.return_value = self.mock_container_client
@@ -28,6 +37,58 @@ class TestAzureStorageHandler(unittest.TestCase):
 
                 mock_blob_client.upload_blob.assert_called_once_with(b'test_data', overwrite=True)
 
+        def test_upload_from_stream(self):
+                mock_blob_client = MagicMock(spec=BlobClient)
+                self.mock_blob_service_client.get_blob_client.return_value = mock_blob_client
+
+                uploaded = self.handler.upload_from_stream('fake_container', 'fake_blob', io.BytesIO(b'0123456789'),
+                                                           block_size=4, max_concurrency=2)
+
+                self.assertEqual(uploaded, 10)
+                staged = sorted(c.args[1] for c in mock_blob_client.stage_block.call_args_list)
+                self.assertEqual(staged, [b'0123', b'4567', b'89'])
+                block_list = mock_blob_client.commit_block_list.call_args.args[0]
+                self.assertEqual(len(block_list), 3)
+                self.assertEqual(len({block.id for block in block_list}), 3)
+
+        def test_upload_from_stream_does_not_commit_on_failure(self):
+                mock_blob_client = MagicMock(spec=BlobClient)
+                mock_blob_client.stage_block.side_effect = Exception("boom")
+                self.mock_blob_service_client.get_blob_client.return_value = mock_blob_client
+
+                with self.assertRaises(Exception):
+                        self.handler.upload_from_stream('fake_container', 'fake_blob', io.BytesIO(b'0123456789'), block_size=4)
+                mock_blob_client.commit_block_list.assert_not_called()
+
+        def test_failed_block_is_staged_again(self):
+                mock_blob_client = MagicMock(spec=BlobClient)
+                mock_blob_client.stage_block.side_effect = [ServiceRequestError("reset"), None, None]
+                self.mock_blob_service_client.get_blob_client.return_value = mock_blob_client
+
+                with patch('ccbox.retry.time.sleep'):
+                        uploaded = self.handler.upload_from_stream('fake_container', 'fake_blob', io.BytesIO(b'01234567'),
+                                                                   block_size=4, max_concurrency=1)
+
+                self.assertEqual(uploaded, 8)
+                self.assertEqual([c.args[1] for c in mock_blob_client.stage_block.call_args_list], [b'0123', b'0123', b'4567'])
+                mock_blob_client.commit_block_list.assert_called_once()
+
+        def test_reads_and_deletes_are_retried(self):
+                mock_blob_client = MagicMock(spec=BlobClient)
+                mock_download_stream = MagicMock()
+                mock_download_stream.readall.return_value = b'data'
+                mock_blob_client.download_blob.side_effect = [ServiceRequestError("timed out"), mock_download_stream]
+                mock_blob_client.delete_blob.side_effect = [ServiceRequestError("timed out"), None]
+                self.mock_container_client.get_blob_client.return_value = mock_blob_client
+                self.mock_blob_service_client.get_blob_client.return_value = mock_blob_client
+
+                with patch('ccbox.retry.time.sleep'):
+                        self.assertEqual(self.handler.download_bytes('fake_blob'), b'data')
+                        self.handler.delete_blob('fake_container', 'fake_blob')
+
+                self.assertEqual(mock_blob_client.download_blob.call_count, 2)
+                self.assertEqual(mock_blob_client.delete_blob.call_count, 2)
+
         def test_upload_json(self):
                 mock_blob_client = MagicMock(spec=BlobClient)
                 self.mock_container_client.get_blob_client.return_value = mock_blob_client
@@ -50,6 +111,38 @@ class TestAzureStorageHandler(unittest.TestCase):
                 mock_blob_client.download_blob.assert_called_once()
                 mock_download_stream.readall.assert_called_once()
 
+        def test_download_json_only_missing_is_none(self):
+                mock_blob_client = MagicMock(spec=BlobClient)
+                self.mock_container_client.get_blob_client.return_value = mock_blob_client
+
+                mock_blob_client.download_blob.side_effect = ResourceNotFoundError("missing")
+                self.assertIsNone(self.handler.download_json('fake_blob'))
+                self.assertEqual(self.handler.download_json_versioned('fake_blob'), (None, None))
+
+                mock_blob_client.download_blob.side_effect = ServiceRequestError("timed out")
+                with patch('ccbox.retry.time.sleep'):
+                        with self.assertRaises(ServiceRequestError):
+                                self.handler.download_json('fake_blob')
+                        with self.assertRaises(ServiceRequestError):
+                                self.handler.download_json_versioned('fake_blob')
+
+        def test_upload_json_versioned(self):
+                mock_blob_client = MagicMock(spec=BlobClient)
+                mock_blob_client.upload_blob.return_value = {"etag": "2"}
+                self.mock_container_client.get_blob_client.return_value = mock_blob_client
+
+                self.assertEqual(self.handler.upload_json_versioned({}, 'fake_blob', "1"), "2")
+                self.assertEqual(mock_blob_client.upload_blob.call_args.kwargs['etag'], "1")
+                self.handler.upload_json_versioned({}, 'fake_blob', None)
+                self.assertFalse(mock_blob_client.upload_blob.call_args.kwargs['overwrite'])
+
+                mock_blob_client.upload_blob.side_effect = ResourceModifiedError("changed")
+                with self.assertRaises(VersionConflict):
+                        self.handler.upload_json_versioned({}, 'fake_blob', "1")
+                mock_blob_client.upload_blob.side_effect = ResourceExistsError("exists")
+                with self.assertRaises(VersionConflict):
+                        self.handler.upload_json_versioned({}, 'fake_blob', None)
+
         def test_to_dict(self):
                 result = self.handler.to_dict()
                 expected = {
@@ -67,5 +160,199 @@ class TestAzureStorageHandler(unittest.TestCase):
                 self.assertEqual(handler.account_url, "http://fake_account_url")
                 self.assertEqual(handler.container_name, "fake_container")
 
+
+class TestAzureClientRegistry(unittest.TestCase):
+
+        def setUp(self):
+                azure_clients.reset()
+
+        def tearDown(self):
+                azure_clients.reset()
+
+        @patch('ccbox.storage_handler.BlobServiceClient')
+        @patch('ccbox.storage_handler.DefaultAzureCredential')
+        def test_handlers_share_clients(self, mock_credential, mock_blob_service_client):
+                first = AzureStorageHandler('https://account', 'container')
+                second = AzureStorageHandler('https://account', 'container')
+                AzureStorageHandler('https://account', 'other')
+                AzureStorageHandler('https://elsewhere', 'container')
+
+                self.assertIs(first.blob_service_client, second.blob_service_client)
+                mock_credential.assert_called_once()
+                self.assertEqual(mock_blob_service_client.call_count, 2)
+                client = mock_blob_service_client.return_value
+                self.assertEqual(client.create_container.call_count, 3)
+
+        @patch('ccbox.storage_handler.BlobServiceClient')
+        @patch('ccbox.storage_handler.DefaultAzureCredential')
+        def test_existing_container_is_remembered(self, mock_credential, mock_blob_service_client):
+                registry = AzureClientRegistry()
+                client = mock_blob_service_client.return_value
+                client.create_container.side_effect = ResourceExistsError("exists")
+                registry.ensure_container('https://account', 'container')
+                registry.ensure_container('https://account', 'container')
+                self.assertEqual(client.create_container.call_count, 1)
+
+        @patch('ccbox.storage_handler.BlobServiceClient')
+        @patch('ccbox.storage_handler.DefaultAzureCredential')
+        def test_failed_container_creation_is_retried(self, mock_credential, mock_blob_service_client):
+                registry = AzureClientRegistry()
+                client = mock_blob_service_client.return_value
+                client.create_container.side_effect = [Exception("throttled"), None, None]
+                registry.ensure_container('https://account', 'container')
+                registry.ensure_container('https://account', 'container')
+                registry.ensure_container('https://account', 'container')
+                self.assertEqual(client.create_container.call_count, 2)
+
+        @patch('ccbox.storage_handler.BlobServiceClient')
+        @patch('ccbox.storage_handler.DefaultAzureCredential')
+        def test_pooled_transport(self, mock_credential, mock_blob_service_client):
+                AzureClientRegistry(pool_size=32).client('https://account')
+                transport = mock_blob_service_client.call_args.kwargs['transport']
+                self.assertEqual(transport.session.get_adapter('https://account')._pool_maxsize, 32)
+
+class TestLocalFSStorageHandler(unittest.TestCase):
+
+        def setUp(self):
+                self.tmp = tempfile.TemporaryDirectory()
+                self.handler = LocalFSStorageHandler(self.tmp.name, 'container')
+
+        def tearDown(self):
+                self.tmp.cleanup()
+
+        def test_blobs_round_trip(self):
+                self.handler.upload_from_bytes('container', 'mnt/', b'')
+                self.handler.upload_from_bytes('container', 'mnt/a.txt', b'0123456789')
+                self.handler.upload_from_stream('container', 'mnt/b.txt', io.BytesIO(b'abcdef'), block_size=4)
+                self.handler.upload_json({"key": "value"}, 'data.json')
+
+                self.assertEqual(self.handler.download_bytes('mnt/'), b'')
+                self.assertEqual(self.handler.download_bytes('mnt/a.txt'), b'0123456789')
+                self.assertEqual(self.handler.download_range('mnt/a.txt', 2, 3), b'234')
+                self.assertEqual(self.handler.download_range('mnt/a.txt', 8), b'89')
+                self.assertEqual(self.handler.download_bytes('mnt/b.txt'), b'abcdef')
+                self.assertEqual(self.handler.download_json('data.json'), {"key": "value"})
+                self.assertIsNone(self.handler.download_bytes('missing'))
+                self.assertIsNone(self.handler.download_json('missing'))
+
+                self.handler.delete_blob('container', 'mnt/a.txt')
+                self.handler.delete_blob('container', 'mnt/a.txt')
+                self.assertIsNone(self.handler.download_bytes('mnt/a.txt'))
+                self.assertEqual(os.listdir(os.path.join(self.tmp.name, 'container', '.tmp')), [])
+
+        def test_versioned_json(self):
+                self.assertEqual(self.handler.download_json_versioned('index.json'), (None, None))
+                version = self.handler.upload_json_versioned({"n": 1}, 'index.json', None)
+                with self.assertRaises(VersionConflict):
+                        self.handler.upload_json_versioned({"n": 2}, 'index.json', None)
+
+                data, read_version = self.handler.download_json_versioned('index.json')
+                self.assertEqual((data, read_version), ({"n": 1}, version))
+                newer = self.handler.upload_json_versioned({"n": 2}, 'index.json', version)
+                self.assertNotEqual(newer, version)
+                with self.assertRaises(VersionConflict):
+                        self.handler.upload_json_versioned({"n": 3}, 'index.json', version)
+                self.assertEqual(self.handler.download_json('index.json'), {"n": 2})
+                with self.assertRaises(VersionConflict):
+                        self.handler.upload_bytes_versioned(b'{}', 'index.json', version)
+                self.handler.upload_bytes_versioned(b'{"n": 3}', 'index.json', self.handler.blob_version('index.json'))
+                self.assertEqual(self.handler.download_json('index.json'), {"n": 3})
+
+        def test_versioned_range_reads(self):
+                self.handler.upload_from_bytes('container', 'blob', b'0123456789')
+                data, version = self.handler.download_range_versioned('blob', 2, 3)
+                self.assertEqual(data, b'234')
+                self.assertEqual(self.handler.download_range_versioned('blob', 8, None, version), (b'89', version))
+
+                self.handler.upload_from_bytes('container', 'blob', b'abcdefghij')
+                with self.assertRaises(VersionConflict):
+                        self.handler.download_range_versioned('blob', 0, 2, version)
+                self.handler.delete_blob('container', 'blob')
+                self.assertEqual(self.handler.download_range_versioned('blob', 0), (None, None))
+
+        def test_delete_blob_if_unmodified(self):
+                self.handler.upload_from_bytes('container', 'blob', b'x')
+                self.assertFalse(self.handler.delete_blob_if_unmodified('container', 'blob', time.time() - 60))
+                self.assertEqual(self.handler.download_bytes('blob'), b'x')
+                self.assertTrue(self.handler.delete_blob_if_unmodified('container', 'blob', time.time() + 1))
+                self.assertIsNone(self.handler.download_bytes('blob'))
+                self.assertTrue(self.handler.delete_blob_if_unmodified('container', 'blob', time.time()))
+
+        def test_long_blob_names(self):
+                name = "/".join(["folder"] * 100)
+                self.handler.upload_from_bytes('container', name, b'x')
+                self.assertEqual(self.handler.download_bytes(name), b'x')
+
+        def test_fsync_batch(self):
+                handler = LocalFSStorageHandler(self.tmp.name, 'container', fsync_batch=3)
+                with patch('ccbox.storage_handler.os.fsync') as fsync:
+                        for i in range(2):
+                                handler.upload_from_bytes('container', f'blob{i}', b'x')
+                        fsync.assert_not_called()
+                        handler.upload_from_bytes('container', 'blob2', b'x')
+                        # Three blobs and their directory
+                        self.assertEqual(fsync.call_count, 4)
+
+        def test_drive_round_trip(self):
+                source = os.path.join(self.tmp.name, 'source')
+                os.makedirs(os.path.join(source, 'sub'))
+                with open(os.path.join(source, 'sub', 'file.txt'), 'wb') as f:
+                        f.write(b'hello')
+                virtual_drive = Virtual_Drive()
+                virtual_drive.add_remote(self.handler)
+
+                virtual_drive.sync_directory(source)
+                loaded = Virtual_Drive(_id=virtual_drive._id, _from_dict=True)
+                loaded.add_remote(storage_handler_from_dict(self.handler.to_dict()))
+                loaded.load_from_remote(lazy=True)
+
+                self.assertEqual(self.handler.download_bytes('source/sub/file.txt'), b'hello')
+                self.assertEqual(loaded.resolve('source/sub/file.txt'), virtual_drive.resolve('source/sub/file.txt'))
+                self.assertIsInstance(loaded.storage_handler, LocalFSStorageHandler)
+
+
+class TestInMemoryStorageHandler(unittest.TestCase):
+
+        def tearDown(self):
+                InMemoryStorageHandler.clear()
+
+        def test_shared_through_from_dict(self):
+                handler = InMemoryStorageHandler('shared')
+                handler.upload_from_bytes('shared', 'blob', b'0123')
+
+                copy = storage_handler_from_dict(handler.to_dict())
+
+                self.assertIsInstance(copy, InMemoryStorageHandler)
+                self.assertEqual(copy.download_range('blob', 1, 2), b'12')
+                copy.delete_blob('shared', 'blob')
+                self.assertIsNone(handler.download_bytes('blob'))
+
+        def test_versioned_json(self):
+                handler = InMemoryStorageHandler('shared')
+                version = handler.upload_json_versioned({"n": 1}, 'index.json', None)
+                copy = storage_handler_from_dict(handler.to_dict())
+
+                self.assertEqual(copy.download_json_versioned('index.json'), ({"n": 1}, version))
+                copy.upload_json_versioned({"n": 2}, 'index.json', version)
+                with self.assertRaises(VersionConflict):
+                        handler.upload_json_versioned({"n": 3}, 'index.json', version)
+
+                handler.upload_from_bytes('shared', 'blob', b'x')
+                self.assertFalse(handler.delete_blob_if_unmodified('shared', 'blob', time.time() - 60))
+                self.assertTrue(handler.delete_blob_if_unmodified('shared', 'blob', time.time() + 1))
+                self.assertIsNone(handler.download_bytes('blob'))
+
+        def test_simulated_latency_and_bandwidth(self):
+                handler = InMemoryStorageHandler('slow', latency=0.01, bandwidth=1000)
+
+                started = time.perf_counter()
+                handler.upload_from_bytes('slow', 'blob', b'x' * 50)
+
+                self.assertGreaterEqual(time.perf_counter() - started, 0.06)
+
+        def test_unknown_type(self):
+                with self.assertRaises(ValueError):
+                        storage_handler_from_dict({"type": "ftp"})
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,142 @@
+import pytest
+import threading
+import time
+from unittest.mock import MagicMock
+from azure.core.exceptions import HttpResponseError
+from ccbox.upload_pipeline import UploadPipeline, UploadStats
+from ccbox.retry import RetryPolicy
+from ccbox.virtual_drive import Virtual_Drive
+
+
+@pytest.fixture
+def storage_handler():
+        handler = MagicMock()
+        handler.container_name = "fake_container"
+        handler.download_json.return_value = None
+        handler.download_json_versioned.return_value = (None, None)
+        return handler
+
+def test_pipeline_uploads_bytes_and_files(storage_handler, tmp_path):
+        file_path = tmp_path / "file1.txt"
+        file_path.write_bytes(b"hello")
+
+        with UploadPipeline(storage_handler, "fake_container", workers=2) as pipeline:
+                pipeline.submit("folder/", data=b"")
+                pipeline.submit("folder/file1.txt", path=str(file_path))
+
+        storage_handler.upload_from_bytes.assert_any_call("fake_container", "folder/", b"")
+        storage_handler.upload_from_bytes.assert_any_call("fake_container", "folder/file1.txt", b"hello")
+        assert pipeline.stats.files == 2
+        assert pipeline.stats.bytes == 5
+        assert pipeline.stats.failed == 0
+
+def test_pipeline_streams_large_files(storage_handler, tmp_path):
+        file_path = tmp_path / "big.bin"
+        file_path.write_bytes(b"x" * 10)
+        storage_handler.upload_from_stream.return_value = 10
+
+        with UploadPipeline(storage_handler, "fake_container", block_size=4, block_concurrency=2) as pipeline:
+                pipeline.submit("big.bin", path=str(file_path))
+
+        args = storage_handler.upload_from_stream.call_args.args
+        assert args[:2] == ("fake_container", "big.bin")
+        assert args[3:] == (4, 2)
+        storage_handler.upload_from_bytes.assert_not_called()
+        assert pipeline.stats.bytes == 10
+
+def test_pipeline_bounds_in_flight_uploads(storage_handler):
+        lock = threading.Lock()
+        in_flight = {"current": 0, "max": 0}
+
+        def slow_upload(container_name, blob_name, data):
+                with lock:
+                        in_flight["current"] += 1
+                        in_flight["max"] = max(in_flight["max"], in_flight["current"])
+                time.sleep(0.01)
+                with lock:
+                        in_flight["current"] -= 1
+
+        storage_handler.upload_from_bytes.side_effect = slow_upload
+        pipeline = UploadPipeline(storage_handler, "fake_container", workers=4, max_in_flight=4)
+        for i in range(20):
+                pipeline.submit(f"blob_{i}", data=b"x")
+        stats = pipeline.close()
+
+        assert stats.files == 20
+        assert in_flight["max"] <= 4
+
+def test_pipeline_counts_failures(storage_handler):
+        storage_handler.upload_from_bytes.side_effect = Exception("boom")
+        with UploadPipeline(storage_handler, "fake_container") as pipeline:
+                pipeline.submit("blob", data=b"x")
+        assert pipeline.stats.failed == 1
+        assert pipeline.stats.files == 0
+
+def throttled():
+        return HttpResponseError(response=MagicMock(status_code=503, headers={}, reason="Server Busy"))
+
+def test_pipeline_retries_throttled_uploads(storage_handler):
+        storage_handler.upload_from_bytes.side_effect = [throttled(), throttled(), None]
+        policy = RetryPolicy(base_delay=0.01, jitter=False)
+        with UploadPipeline(storage_handler, "fake_container", retry_policy=policy) as pipeline:
+                future = pipeline.submit("blob", data=b"x")
+        assert future.result() is None
+        assert (pipeline.stats.files, pipeline.stats.retried, pipeline.stats.failed) == (1, 2, 0)
+
+def test_pipeline_backoff_does_not_hold_workers(storage_handler):
+        calls = {}
+
+        def upload(container_name, blob_name, data):
+                calls[blob_name] = calls.get(blob_name, 0) + 1
+                if blob_name == "throttled" and calls[blob_name] == 1:
+                        raise throttled()
+
+        storage_handler.upload_from_bytes.side_effect = upload
+        policy = RetryPolicy(base_delay=0.5, jitter=False)
+        started = time.perf_counter()
+        pipeline = UploadPipeline(storage_handler, "fake_container", workers=1, retry_policy=policy)
+        pipeline.submit("throttled", data=b"x")
+        others = [pipeline.submit(f"blob_{i}", data=b"x") for i in range(10)]
+        for future in others:
+                future.result()
+        # The only worker kept uploading while the throttled blob waited out its backoff
+        assert time.perf_counter() - started < 0.4
+        stats = pipeline.close()
+        assert stats.files == 11
+        assert calls["throttled"] == 2
+
+def test_pipeline_dead_letters_and_redrive(storage_handler):
+        storage_handler.upload_from_bytes.side_effect = throttled()
+        policy = RetryPolicy(max_attempts=2, base_delay=0.01)
+        with UploadPipeline(storage_handler, "fake_container", retry_policy=policy) as pipeline:
+                future = pipeline.submit("blob", data=b"payload")
+        assert isinstance(future.exception(), HttpResponseError)
+        assert pipeline.stats.failed == 1
+        [failure] = pipeline.stats.dead_letters
+        assert (failure.blob_name, failure.attempts, failure.data) == ("blob", 2, b"payload")
+        assert pipeline.stats.to_dict()["dead_letters"][0]["blob_name"] == "blob"
+
+        storage_handler.upload_from_bytes.side_effect = None
+        with UploadPipeline(storage_handler, "fake_container", retry_policy=policy) as pipeline:
+                pipeline.redrive([failure])
+        storage_handler.upload_from_bytes.assert_called_with("fake_container", "blob", b"payload")
+        assert (pipeline.stats.files, pipeline.stats.dead_letters) == (1, [])
+
+def test_upload_stats_throughput():
+        stats = UploadStats(files=10, bytes=2 * 1024 * 1024, elapsed=2.0)
+        assert stats.files_per_sec == 5.0
+        assert stats.mb_per_sec == 1.0
+        assert stats.to_dict()["files_per_sec"] == 5.0
+
+def test_virtual_drive_upload_contents(storage_handler, tmp_path):
+        (tmp_path / "mnt").mkdir()
+        (tmp_path / "mnt" / "file1.txt").write_bytes(b"data")
+        virtual_drive = Virtual_Drive()
+        virtual_drive.add_remote(storage_handler)
+        virtual_drive.mount_directory(str(tmp_path / "mnt"))
+
+        stats = virtual_drive.upload_contents(workers=2)
+
+        storage_handler.upload_from_bytes.assert_any_call("fake_container", "mnt/file1.txt", b"data")
+        storage_handler.upload_from_bytes.assert_any_call("fake_container", "default/", b"")
+        assert stats.files == 3
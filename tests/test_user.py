@@ -0,0 +1,105 @@
+import pytest
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from ccbox.user import User, UserDatabase, UserRecord, Credentials
+from ccbox.virtual_drive import Virtual_Drive
+from ccbox.storage_handler import InMemoryStorageHandler
+
+
+@pytest.fixture
+def user_database(tmp_path, mocker):
+        mocker.patch.object(User, 'from_dict')
+        database = UserDatabase(str(tmp_path / "users.db"))
+        database.cursor.execute('INSERT INTO users (id, username, virtual_drive_id) VALUES (1, "alice", 7)')
+        yield database
+        database.close()
+
+def test_user_exists_does_not_load_drive(user_database):
+        assert user_database.user_exists("alice")
+        assert not user_database.user_exists("bob")
+        User.from_dict.assert_not_called()
+
+def test_get_user_record(user_database):
+        record = user_database.get_user_record("alice")
+        assert record == UserRecord(username="alice", _id=1, virtual_drive_id=7)
+        assert user_database.get_user_record("bob") is None
+        User.from_dict.assert_not_called()
+
+def test_get_user_from_db_hydrates_from_record(user_database):
+        user_database.get_user_from_db("alice")
+        User.from_dict.assert_called_once_with({"username": "alice", "_id": 1, "virtual_drive_id": 7})
+
+def test_credentials_round_trip(user_database):
+        credentials = Credentials(username="alice", salt="s", hash="h", params={"algorithm": "sha256"})
+        user_database.save_credentials(credentials)
+        assert user_database.get_credentials("alice") == credentials
+        assert user_database.get_credentials("bob") is None
+
+def test_migrate_credentials_runs_once(user_database, tmp_path):
+        legacy = tmp_path / "users.txt"
+        legacy.write_text("alice abc\nbob def\n")
+
+        assert user_database.migrate_credentials(str(legacy)) == 2
+        assert user_database.get_credentials("bob") == Credentials("bob", "", "def", {"algorithm": "sha256"})
+
+        legacy.write_text("carol ghi\n")
+        assert user_database.migrate_credentials(str(legacy)) == 0
+        assert user_database.get_credentials("carol") is None
+
+def test_connections_are_per_thread_and_wal(user_database):
+        other = []
+        thread = threading.Thread(target=lambda: other.append(user_database.connection))
+        thread.start()
+        thread.join()
+
+        assert other[0] is not user_database.connection
+        assert user_database.cursor.execute('PRAGMA journal_mode').fetchone()[0] == "wal"
+
+def test_add_user_to_db_batches_concurrent_writes(user_database):
+        user_database.connection.commit()
+        users = [User(username=f"user{i}", _id=100 + i) for i in range(200)]
+        with ThreadPoolExecutor(max_workers=16) as executor:
+                futures = list(executor.map(lambda user: user_database.add_user_to_db(user, wait=False), users))
+
+        assert all(future.result() for future in futures)
+        assert user_database.get_user_record("user199").virtual_drive_id == users[199].virtual_drive._id
+        assert not user_database.add_user_to_db(User(username="alice")).result()
+
+def test_ids_are_assigned_by_the_database(tmp_path, mocker):
+        mocker.patch.object(User, 'from_dict')
+        path = str(tmp_path / "users.db")
+        # Forked workers start from the same counters
+        first, second = UserDatabase(path), UserDatabase(path)
+        bob, carol = User(username="bob", _id=5), User(username="carol", _id=5)
+
+        assert first.add_user_to_db(bob).result()
+        assert second.add_user_to_db(carol).result()
+        assert second.add_users_bulk(["dave", "bob"], []) == 1
+
+        records = [first.get_user_record(name) for name in ("bob", "carol", "dave")]
+        assert len({record._id for record in records}) == 3
+        assert len({record.virtual_drive_id for record in records}) == 3
+        assert (bob._id, bob.virtual_drive._id) == (records[0]._id, records[0].virtual_drive_id)
+        first.close()
+        second.close()
+
+def test_cached_drive_is_reloaded_once_saved_elsewhere(tmp_path, mocker):
+        mocker.patch.object(Virtual_Drive, 'default_remote', lambda drive_id: InMemoryStorageHandler(f"drive-{drive_id}"))
+        database = UserDatabase(str(tmp_path / "users.db"))
+        database.verify_cached = True
+        database.add_user_to_db(User(username="alice"))
+        user = database.get_user_from_db("alice")
+        assert database.get_user_from_db("alice") is user
+
+        # Another process saves the drive
+        other = Virtual_Drive(_id=user.virtual_drive._id)
+        other.add_remote(Virtual_Drive.default_remote(other._id))
+        other.add_folder("mnt")
+        other.save_to_remote()
+
+        reloaded = database.get_user_from_db("alice")
+        assert reloaded is not user
+        assert reloaded.virtual_drive.resolve("mnt") is not None
+        assert database.get_user_from_db("alice") is reloaded
+        database.close()
+        InMemoryStorageHandler.clear()
@@ -1,6 +1,6 @@
 import pytest
 from unittest.mock import MagicMock
-from ccbox.virtual_drive import Virtual_Drive, Folder
+from ccbox.virtual_drive import Virtual_Drive, Folder, FileEntry
 import os
 
 @pytest.fixture
@@ -24,23 +24,66 @@ def test_virtual_drive_add_duplicate_folder(virtual_drive):
                 virtual_drive.add_folder("new_folder")
         assert str(e.value) == "A folder with the name new_folder already exists."
 
+def test_virtual_drive_folder_name_clashes_with_file(virtual_drive):
+        virtual_drive.add_file(FileEntry("name", "/tmp/name"))
+        with pytest.raises(Exception) as e:
+                virtual_drive.add_folder("name")
+        assert str(e.value) == "A file with the name name already exists."
+
+def test_virtual_drive_add_duplicate_file(virtual_drive):
+        virtual_drive.add_file(FileEntry("name", "/tmp/name"))
+        with pytest.raises(Exception) as e:
+                virtual_drive.add_file(FileEntry("name", "/tmp/other"))
+        assert str(e.value) == "A file with the name name already exists."
+        virtual_drive.add_folder("folder")
+        with pytest.raises(Exception) as e:
+                virtual_drive.add_file(FileEntry("folder", "/tmp/folder"))
+        assert str(e.value) == "A folder with the name folder already exists."
+        assert [item._name for item in virtual_drive.contents].count("name") == 1
+
+def test_virtual_drive_remove_folder(virtual_drive):
+        folder = virtual_drive.add_folder("new_folder")
+        assert virtual_drive.remove_folder("new_folder") is folder
+        assert folder not in virtual_drive.contents
+        assert virtual_drive.resolve("new_folder") is None
+        virtual_drive.add_folder("new_folder")
+
+def test_virtual_drive_resolve(virtual_drive):
+        a = virtual_drive.add_folder("a")
+        b = a.add_folder("b")
+        entry = FileEntry("c.txt", "/tmp/c.txt")
+        b.add_file(entry)
+
+        assert virtual_drive.resolve("a/b") is b
+        assert virtual_drive.resolve("/a/b/c.txt") is entry
+        assert virtual_drive.resolve("a/b/../b/./c.txt") is entry
+        assert virtual_drive.resolve("") is virtual_drive
+        assert virtual_drive.resolve("a/missing") is None
+        assert virtual_drive.resolve("a/b/c.txt/d") is None
+        assert virtual_drive.change_directory("a") is a
+
+def test_virtual_drive_wide_folder_builds_quickly(virtual_drive):
+        folder = virtual_drive.add_folder("wide")
+        for i in range(50000):
+                folder.add_folder(f"sub{i}")
+        assert folder.resolve("sub49999")._name == "sub49999"
+
 def test_virtual_drive_add_file(virtual_drive):
         file_obj = MagicMock()
         virtual_drive.add_file(file_obj)
         assert file_obj in virtual_drive.contents
 
-def test_virtual_drive_mount_directory(mocker, virtual_drive):
-        # Mock os functions to simulate directory structure
-        mocker.patch('os.listdir', return_value=['file1.txt', 'dir1'])
-        mocker.patch('os.path.isdir', side_effect=lambda x: x == 'test_path/dir1')
-        mocker.patch('os.path.isfile', side_effect=lambda x: x == 'test_path/file1.txt')
-        
-        # Mock the open function to simulate file objects
-        mock_open = mocker.mock_open(read_data="data")
-        mocker.patch('builtins.open', mock_open)
+def test_virtual_drive_mount_directory(mocker, tmp_path, virtual_drive):
+        # Build a small directory structure to mount
+        (tmp_path / "test_path" / "dir1").mkdir(parents=True)
+        (tmp_path / "test_path" / "file1.txt").write_text("data")
+        (tmp_path / "test_path" / "dir1" / "file2.txt").write_text("more data")
+
+        # Files must not be opened while mounting
+        mock_open = mocker.patch('builtins.open')
 
         # Mount the directory
-        virtual_drive.mount_directory('test_path')
+        virtual_drive.mount_directory(str(tmp_path / "test_path"))
 
         # Verify the mount directory
         assert 'test_path' in virtual_drive.folders
@@ -50,10 +93,36 @@ def test_virtual_drive_mount_directory(mocker, virtual_drive):
         content_names = [os.path.basename(f._name) if hasattr(f, '_name') else f._name for f in mount_folder.contents]
         assert 'file1.txt' in content_names
         assert 'dir1' in mount_folder.folders
+        assert mount_folder.folders['dir1'].contents[0].size == 9
+        mock_open.assert_not_called()
+
+def test_virtual_drive_mount_invalid_path(virtual_drive, tmp_path):
+        with pytest.raises(ValueError):
+                virtual_drive.mount_directory(str(tmp_path / "missing"))
 
 def test_virtual_drive_to_dict(virtual_drive):
         data = virtual_drive.to_dict()
         assert data['_id'] == virtual_drive._id
         assert 'default' in data['folders']
 
+def test_file_entry_round_trip(tmp_path):
+        file_path = tmp_path / "file1.bin"
+        file_path.write_bytes(b"\x00\xffdata")
+        entry = FileEntry.from_path(str(file_path))
+
+        assert entry._name == "file1.bin"
+        assert entry.size == 6
+        assert entry.read() == b"\x00\xffdata"
+        assert not hasattr(entry, "__dict__")
+        assert FileEntry.from_dict(entry.to_dict()) == entry
+
+def test_virtual_drive_files_survive_serialization(tmp_path):
+        (tmp_path / "mnt").mkdir()
+        (tmp_path / "mnt" / "file1.txt").write_bytes(b"data")
+        virtual_drive = Virtual_Drive()
+        virtual_drive.mount_directory(str(tmp_path / "mnt"))
 
+        data = virtual_drive.folders['mnt'].to_dict()
+        folder = Folder.from_dict(data)
+        assert folder.contents == [FileEntry.from_path(str(tmp_path / "mnt" / "file1.txt"))]
+        assert folder.resolve("file1.txt") is folder.contents[0]
@@ -0,0 +1,116 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado.httpclient import AsyncHTTPClient
+import tornado.gen
+from ccbox import web_server
+from ccbox.web_server import make_app
+from ccbox.authentication import Authentication
+from ccbox.jobs import JobScheduler
+from ccbox.virtual_drive import Virtual_Drive
+
+
+class TestNativeWebServer(AsyncHTTPTestCase):
+        def setUp(self):
+                self.executor = ThreadPoolExecutor(max_workers=4)
+                self.user_database = Authentication.user_database
+                Authentication.user_database = MagicMock()
+                super().setUp()
+
+        def tearDown(self):
+                super().tearDown()
+                Authentication.user_database = self.user_database
+                self.executor.shutdown()
+
+        def get_app(self):
+                return make_app(self.executor)
+
+        def test_login(self):
+                with patch.object(Authentication, 'login', return_value=MagicMock()):
+                        response = self.fetch('/login', method='POST', body=json.dumps({'username': 'alice', 'password': 'pwd'}))
+                self.assertEqual(response.code, 200)
+                self.assertEqual(json.loads(response.body), {'message': 'Login successful'})
+
+        def test_login_requires_credentials(self):
+                response = self.fetch('/login', method='POST', body=json.dumps({'username': 'alice'}))
+                self.assertEqual(response.code, 400)
+
+        def test_contents_with_depth(self):
+                user = MagicMock()
+                user.virtual_drive = Virtual_Drive()
+                user.virtual_drive.folders['default'].add_folder('sub')
+                Authentication.user_database.get_user_from_db.return_value = user
+
+                response = self.fetch('/virtual_drive/alice/contents?depth=1')
+
+                self.assertEqual(json.loads(response.body), user.virtual_drive.to_dict(1))
+                self.assertTrue(response.headers['Content-Type'].startswith('application/json'))
+
+        def test_list_pages(self):
+                user = MagicMock()
+                user.virtual_drive = Virtual_Drive()
+                for name in ('c', 'a', 'b'):
+                        user.virtual_drive.folders['default'].add_folder(name)
+                Authentication.user_database.get_user_from_db.return_value = user
+
+                first = json.loads(self.fetch('/virtual_drive/alice/list?path=default&limit=2').body)
+                second = json.loads(self.fetch(f'/virtual_drive/alice/list?path=default&limit=2&cursor={first["next_cursor"]}').body)
+
+                self.assertEqual([item['_name'] for item in first['items'] + second['items']], ['a', 'b', 'c'])
+                self.assertIsNone(second['next_cursor'])
+                self.assertEqual(self.fetch('/virtual_drive/alice/list?path=nope').code, 404)
+                self.assertEqual(self.fetch('/virtual_drive/alice/list?path=default&cursor=zz').code, 400)
+
+        def test_invalid_numbers_are_bad_requests(self):
+                Authentication.user_database.get_user_from_db.return_value = MagicMock(virtual_drive=Virtual_Drive())
+
+                for url in ('/virtual_drive/alice/contents?depth=x', '/virtual_drive/alice/list?depth=x',
+                            '/virtual_drive/alice/list?limit=ten'):
+                        response = self.fetch(url)
+                        self.assertEqual(response.code, 400)
+                        self.assertIn('error', json.loads(response.body))
+
+        def test_bulk_registration_from_ndjson(self):
+                users = [{'username': f'user{i}', 'password': 'password1'} for i in range(3)]
+                body = "\n".join(json.dumps(user) for user in users)
+                headers = {'Content-Type': 'application/x-ndjson'}
+                with patch.object(Authentication, 'register_bulk') as register_bulk:
+                        register_bulk.return_value.to_dict.return_value = {'created': 3}
+                        response = self.fetch('/register/bulk', method='POST', body=body, headers=headers)
+                        self.assertEqual(response.code, 200)
+                        self.assertEqual(list(register_bulk.call_args[0][0]), [(user['username'], 'password1') for user in users])
+
+                        response = self.fetch('/register/bulk', method='POST', body=body + '\n{"username": ', headers=headers)
+                        self.assertEqual(response.code, 400)
+                        self.assertIn('line 4', json.loads(response.body)['error'])
+                        self.assertEqual(self.fetch('/register/bulk', method='POST', body='[1]').code, 400)
+                        register_bulk.assert_called_once()
+
+        def test_mount_returns_job_to_poll(self):
+                release = threading.Event()
+
+                def runner(scheduler, job):
+                        job.files_total, job.bytes_total = 2, 30
+                        job.advance("/tmp/a", 10)
+                        release.wait(5)
+                        job.advance("/tmp/b", 20)
+
+                scheduler = JobScheduler(MagicMock(), runner=runner)
+                scheduler.store.get_job.return_value = None
+                with patch.object(web_server, 'mount_jobs', scheduler):
+                        response = self.fetch('/mount', method='POST', body=json.dumps({'username': 'alice', 'dir_path': '/tmp'}))
+                        self.assertEqual(response.code, 202)
+                        job_id = json.loads(response.body)['job_id']
+
+                        progress = json.loads(self.fetch(f'/jobs/{job_id}').body)
+                        self.assertEqual(progress['status'], 'running')
+                        self.assertEqual((progress['files_done'], progress['files_total']), (1, 2))
+                        self.assertEqual(self.fetch('/jobs/abc123').code, 404)
+
+                        release.set()
+                        scheduler.shutdown()
+                        scheduler.store.get_job.return_value = scheduler.store.save_job.call_args[0][2]
+                        progress = json.loads(self.fetch(f'/jobs/{job_id}').body)
+                        self.assertEqual((progress['status'], progress['bytes_done'], progress['eta']), ('done', 30, 0.0))